@@ -10,6 +10,7 @@ setup(
 
     packages = find_packages('src'),
     package_dir = {'':'src'},
+    package_data = {'tagman': ['static/tagman/js/*.js']},
     license = "BSD",
     keywords = "django, tagging, tagman",
     description = "Curated tagging app for Django",
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the tagman hot paths.
+
+Seeds a fresh test database with tag groups, tags and tagged items of the
+test models, then times each operation and counts its queries, writing
+the results as JSON so that runs can be compared:
+
+ > PYTHONPATH=src python src/benchmarks.py --tags=20000 --items=50000 \\
+       --output=bench.json
+
+Uses an in-memory SQLite database unless --engine and the other database
+options are given; the test database is created and destroyed as by the
+test runner, so an existing database is never touched.
+"""
+import json
+import platform
+import random
+import sys
+import time
+from optparse import OptionParser
+
+from django.conf import settings
+
+
+def parse_options(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--groups", type="int", default=50,
+                      help="Tag groups to create. Default 50.")
+    parser.add_option("--tags", type="int", default=5000,
+                      help="Tags to create. Default 5000.")
+    parser.add_option("--items", type="int", default=5000,
+                      help="Items to create per tagged model. Default 5000.")
+    parser.add_option("--tags-per-item", type="int", default=5,
+                      help="Tags per item. Default 5.")
+    parser.add_option("--repeat", type="int", default=5,
+                      help="Runs of each benchmark. Default 5.")
+    parser.add_option("--seed", type="int", default=0,
+                      help="Random seed for the data. Default 0.")
+    parser.add_option("--output", default=None,
+                      help="File to write JSON results to. Default stdout.")
+    parser.add_option("--engine", default="django.db.backends.sqlite3",
+                      help="Database engine. Default SQLite.")
+    parser.add_option("--name", default="tagman_bench",
+                      help="Database name; the benchmarks use test_NAME.")
+    parser.add_option("--user", default="")
+    parser.add_option("--password", default="")
+    parser.add_option("--host", default="")
+    parser.add_option("--port", default="")
+    return parser.parse_args(argv)[0]
+
+
+def configure(options):
+    settings.configure(
+        INSTALLED_APPS=('tagman',),
+        DATABASES={'default': {'ENGINE': options.engine,
+                               'NAME': options.name,
+                               'USER': options.user,
+                               'PASSWORD': options.password,
+                               'HOST': options.host,
+                               'PORT': options.port}},
+        # needed for connection.queries
+        DEBUG=True,
+    )
+
+
+def seed(options):
+    """
+    Create the groups, tags and items, with bulk_create, and return the
+    tagged items' models
+    """
+    from tagman.models import Tag, TagGroup
+    from tagman.tests.models import IgnoreTestItem, SlugItem, TestItem
+
+    rand = random.Random(options.seed)
+    TagGroup.objects.bulk_create([
+        TagGroup(name="group-{0}".format(i), slug="group-{0}".format(i),
+                 system=(i % 10 == 0))
+        for i in range(options.groups)])
+    groups = list(TagGroup.objects.order_by("pk"))
+    Tag.objects.bulk_create([
+        Tag(name="tag-{0}".format(i), slug="tag-{0}".format(i),
+            group=groups[i % len(groups)],
+            group_name=unicode(groups[i % len(groups)]),
+            group_slug=groups[i % len(groups)].slug,
+            group_is_system=groups[i % len(groups)].system)
+        for i in range(options.tags)], batch_size=500)
+    tag_ids = list(Tag.objects.values_list("pk", flat=True))
+
+    models = [TestItem, IgnoreTestItem, SlugItem]
+    for model in models:
+        if model is SlugItem:
+            items = [SlugItem(slug="item-{0}".format(i))
+                     for i in range(options.items)]
+        else:
+            items = [model(name="item-{0}".format(i))
+                     for i in range(options.items)]
+        model.objects.bulk_create(items, batch_size=500)
+        through = model.tags.through
+        item_ids = model.objects.values_list("pk", flat=True)
+        rows = []
+        for item_id in item_ids:
+            # skew usage towards low tag ids, as real vocabularies are
+            chosen = set(tag_ids[min(int(rand.paretovariate(1.2)) - 1,
+                                     len(tag_ids) - 1)]
+                         for _ in range(options.tags_per_item))
+            rows.extend(through(**{model.__name__.lower() + "_id": item_id,
+                                   "tag_id": tag_id})
+                        for tag_id in chosen)
+        through.objects.bulk_create(rows, batch_size=500)
+    return models
+
+
+def measure(name, run, repeat, setup=None):
+    """
+    Time `run` `repeat` times, calling `setup` (untimed) before each, and
+    return the timings and the query count of the last run
+    """
+    from django.db import connection, reset_queries
+
+    timings = []
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        reset_queries()
+        started = time.time()
+        run(i)
+        timings.append(time.time() - started)
+        queries = len(connection.queries)
+    timings.sort()
+    return {"name": name,
+            "repeat": repeat,
+            "min": timings[0],
+            "median": timings[len(timings) // 2],
+            "max": timings[-1],
+            "queries": queries}
+
+
+def benchmarks():
+    """
+    Return (name, run, setup) for each benchmark
+    """
+    from django.core.management import call_command
+    from tagman.cache import tag_cache
+    from tagman.models import Tag, TagGroup
+    from tagman.tests.models import SlugItem, TestItem
+
+    popular = Tag.objects.order_by("pk")[0]
+    item = TestItem.objects.order_by("pk")[0]
+    slug_item = SlugItem.objects.order_by("pk")[0]
+    group = TagGroup.objects.order_by("pk")[1]
+    tag_strings = [unicode(tag) for tag in Tag.objects.order_by("pk")[:20]]
+    devnull = open("/dev/null", "w")
+
+    def clear_cache(i):
+        tag_cache().clear()
+
+    def rename_slug_item(i):
+        SlugItem.objects.filter(pk=slug_item.pk)\
+            .update(slug="renamed-{0}".format(i))
+        slug_item.slug = "renamed-{0}".format(i)
+
+    def archive_tags(i):
+        Tag.objects.filter(pk__in=list(
+            Tag.objects.filter(archived=False).order_by("-pk")
+            .values_list("pk", flat=True)[:100])).update(archived=True)
+
+    def rename_group(i):
+        group.name = "renamed-group-{0}".format(i)
+
+    return [
+        ("get_tags_with_weight",
+         lambda i: Tag.public_objects.get_tags_with_weight(), None),
+        ("get_tags_with_weight (top 50)",
+         lambda i: Tag.public_objects.get_tags_with_weight(limit=50), None),
+        ("tagged_items",
+         lambda i: [list(items.all()[:100]) for items in
+                    popular.tagged_items().values() if items is not None],
+         None),
+        ("unique_item_set",
+         lambda i: popular.unique_item_set(limit=100), None),
+        ("tags_for_string (cold)",
+         lambda i: Tag.tags_for_string(", ".join(tag_strings)), clear_cache),
+        ("tags_for_string (cached)",
+         lambda i: Tag.tags_for_string(", ".join(tag_strings)), None),
+        ("add_tag_str",
+         lambda i: item.add_tag_str("bench:new-{0}".format(i)), None),
+        ("associate_auto_tags",
+         lambda i: slug_item.associate_auto_tags(), rename_slug_item),
+        ("TagGroup.save", lambda i: group.save(), rename_group),
+        ("clean_tags",
+         lambda i: call_command("clean_tags", stdout=devnull), archive_tags),
+    ]
+
+
+def main(argv=None):
+    options = parse_options(argv if argv is not None else sys.argv[1:])
+    configure(options)
+
+    import django
+    from django.db import connection
+    # import the test models so that their tables are created
+    import tagman.tests.models  # noqa
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        started = time.time()
+        models = seed(options)
+        seeded = time.time() - started
+        results = [measure(name, run, options.repeat, setup)
+                   for name, run, setup in benchmarks()]
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "volumes": {"groups": options.groups, "tags": options.tags,
+                    "items_per_model": options.items,
+                    "models": [model.__name__ for model in models],
+                    "tags_per_item": options.tags_per_item,
+                    "seed": options.seed},
+        "seed_seconds": seeded,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,81 @@
 """Tagman admin classes and also helpers/mixins for users of Tagman"""
+import time
+
+from django.conf import settings
 from django.contrib import admin
+from tagman.cache import tag_cache
 from tagman.models import TagGroup
-from tagman.models import Tag
+from tagman.models import Tag, _composite_name, _usage_count_sql
+from tagman.models import with_usage_counts
 from django import forms
 
+_tag_choices = None
+
+
+def tag_choices():
+    """
+    Return the (id, "GRP:NAME") choices for all non-system tags. They are
+    built from the de-normalised fields once per version of the tag cache
+    and shared by every form, so changes made in another process are seen
+    when the shared cache tier reports them or, without one, after
+    TAGMAN_TAG_CHOICES_TIMEOUT seconds (default 300).
+    """
+    global _tag_choices
+    version = tag_cache().version()
+    now = time.time()
+    if _tag_choices is None or _tag_choices[0] != version or \
+            _tag_choices[1] < now:
+        choices = [(pk, _composite_name(group_name, name))
+                   for pk, group_name, name in Tag.objects
+                   .filter(group_is_system=False).order_by("pk")
+                   .values_list("id", "group_name", "name")]
+        timeout = getattr(settings, "TAGMAN_TAG_CHOICES_TIMEOUT", 300)
+        _tag_choices = (version, now + timeout, choices)
+    return _tag_choices[2]
+
+
+class TagAutocompleteWidget(forms.SelectMultiple):
+    """
+    Multiple select that renders only the selected tags; the accompanying
+    script searches `url` (see tagman.views.tag_autocomplete) for more.
+    """
+    class Media:
+        js = ("tagman/js/tag_autocomplete.js",)
+
+    def __init__(self, url, attrs=None):
+        super(TagAutocompleteWidget, self).__init__(attrs)
+        self.url = url
+
+    def render(self, name, value, attrs=None, choices=()):
+        attrs = dict(attrs or {})
+        attrs["data-autocomplete-url"] = self.url
+        self.choices = []
+        if value:
+            self.choices = [
+                (pk, _composite_name(group_name, tag_name))
+                for pk, group_name, tag_name in Tag.objects
+                .filter(pk__in=value).order_by("group_name", "name")
+                .values_list("id", "group_name", "name")]
+        return super(TagAutocompleteWidget, self).render(name, value, attrs)
+
 
 class TaggedContentItemForm(forms.ModelForm):
     """
     Form for use on model admins that have a 'tags' field in which you want
     a nice filtered list without system tags polluting it. Typical for all
     TaggedContentItem models.
+
+    Set `tag_autocomplete_url`, e.g. to
+    reverse_lazy("tagman_tag_autocomplete"), to search for tags as you type
+    rather than list them all.
     """
+    tag_autocomplete_url = None
+
     def __init__(self, *args, **kwargs):
         """
         Find all fields in a page ending in 'tags', assume that they are a
         tags M2M and reset the widget's choices to a filtered list that
-        excludes system tags.
+        excludes system tags, or give them a TagAutocompleteWidget.
 
         This is very crude and rather inelegant but it solved a particular
         problem. It is suggested this is used with care, or used as an
@@ -23,12 +83,18 @@ class TaggedContentItemForm(forms.ModelForm):
         in another way.
         """
         super(TaggedContentItemForm, self).__init__(*args, **kwargs)
-        wtf = Tag.objects.filter(group__system=False)
-        wlist = [w for t, w in self.fields.items() if t.endswith("tags")]
-        choices = []
-        for choice in wtf:
-            choices.append((choice.id, str(choice)))
-        [setattr(w, 'choices', choices) for w in wlist]
+        for name, field in self.fields.items():
+            if not name.endswith("tags"):
+                continue
+            if self.tag_autocomplete_url is None:
+                field.choices = tag_choices()
+                continue
+            widget = TagAutocompleteWidget(self.tag_autocomplete_url)
+            if hasattr(field.widget, "widget"):
+                # keep the admin's RelatedFieldWidgetWrapper
+                field.widget.widget = widget
+            else:
+                field.widget = widget
 
 
 class TaggedContentAdminMixin(object):
@@ -46,27 +112,68 @@ class TagGroupAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("name",)}
 
 
+class TagUsageFilter(admin.SimpleListFilter):
+    title = u'usage'
+    parameter_name = 'used'
+
+    def lookups(self, request, model_admin):
+        return (("yes", u"Used"), ("no", u"Unused"))
+
+    def queryset(self, request, queryset):
+        if self.value() not in ("yes", "no"):
+            return queryset
+        sql, params = _usage_count_sql(queryset.db)
+        op = ">" if self.value() == "yes" else "="
+        return queryset.extra(where=["{0} {1} 0".format(sql, op)],
+                              params=params)
+
+
 class TagAdmin(admin.ModelAdmin):
-    list_display = ["name", "slug", "group", "system"]
+    list_display = ["name", "slug", "group_display", "system",
+                    "usage_count", "archived"]
     search_fields = ["name"]
-    list_filter = ["group"]
+    list_filter = ["group", "archived", TagUsageFilter]
     prepopulated_fields = {"slug": ("name",)}
+    actions = ["archive_tags", "unarchive_tags"]
+
+    def get_queryset(self, request):
+        parent = super(TagAdmin, self)
+        # Django < 1.6 has only queryset(), which later versions alias
+        get_queryset = getattr(parent, "get_queryset", None) or \
+            parent.queryset
+        return with_usage_counts(get_queryset(request))
+    queryset = get_queryset
+
+    def group_display(self, _object):
+        return _object.group_name
+    group_display.short_description = u'Group'
+    group_display.admin_order_field = 'group_name'
 
     def system(self, _object):
         return _object.system
     system.short_description = u'System'
     system.boolean = True
 
-    def queryset(self, request):
-        # use our manager, rather than the default one
-        qs = self.model.objects.get_query_set()
+    def usage_count(self, _object):
+        return _object.usage_count
+    usage_count.short_description = u'Usage'
+    usage_count.admin_order_field = 'usage_count'
+
+    def _set_archived(self, request, queryset, archived):
+        tag_ids = list(queryset.values_list("pk", flat=True))
+        updated = Tag.objects.using(queryset.db).filter(pk__in=tag_ids)\
+            .update(archived=archived)
+        tag_cache().invalidate(tag_ids=tag_ids)
+        self.message_user(request, u"{0} {1} tags".format(
+            u"Archived" if archived else u"Unarchived", updated))
+
+    def archive_tags(self, request, queryset):
+        self._set_archived(request, queryset, True)
+    archive_tags.short_description = u'Archive selected tags'
 
-        # we need this from the superclass method
-        # otherwise we might try to *None, which is bad ;)
-        ordering = self.ordering or ()
-        if ordering:
-            qs = qs.order_by(*ordering)
-        return qs
+    def unarchive_tags(self, request, queryset):
+        self._set_archived(request, queryset, False)
+    unarchive_tags.short_description = u'Unarchive selected tags'
 
 try:
     admin.site.register(Tag, TagAdmin)
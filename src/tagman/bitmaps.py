@@ -0,0 +1,253 @@
+"""
+An in-process index of the items of each tag, for boolean tag filtering
+without joining the through-tables.
+
+For each tagged model the index holds, per tag, the primary keys of the
+items having it: as an int used as a bitmap, bit n standing for pk n, when
+the tag is on at least 1 in DENSITY of the pks up to the model's highest,
+and as a set otherwise, so rare tags cost no more than their items. A
+bitmap of every item of the model lets `none_of` be answered too.
+Conditions are combined with int and set operations, which run in C, and
+the result is a sorted list of pks to filter a queryset with:
+
+    pks = tag_bitmaps().items(Book, all_of=["genre:sf"], none_of=[...])
+    Book.objects.filter(pk__in=pks)
+
+The index is built on first use and kept current from m2m_changed,
+tags_merged and the items' post_save and post_delete, as far as they are
+sent in this process. Writes made by other processes or with raw SQL, and
+any rolled back, are picked up by a full rebuild every
+TAGMAN_TAG_BITMAPS_TIMEOUT seconds (default 300). Integer primary keys
+are assumed.
+"""
+import binascii
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from tagman.models import Tag, _existing_tag_rows, _tagged_conditions
+from tagman.registry import registry
+from tagman.signals import tags_merged
+
+# tags on fewer than 1 in DENSITY of a model's pks are held as sets
+DENSITY = 256
+
+
+def _bitmap(value):
+    """
+    Return a set of pks, or a bitmap, as a bitmap
+    """
+    if not isinstance(value, set):
+        return value
+    if not value:
+        return 0
+    buf = bytearray((max(value) >> 3) + 1)
+    for pk in value:
+        buf[pk >> 3] |= 1 << (pk & 7)
+    buf.reverse()
+    return int(binascii.hexlify(bytes(buf)), 16)
+
+
+def _pks(bitmap):
+    """
+    Return the sorted list of pks set in `bitmap`
+    """
+    bits = bin(bitmap)[:1:-1]
+    pks = []
+    pk = bits.find("1")
+    while pk != -1:
+        pks.append(pk)
+        pk = bits.find("1", pk + 1)
+    return pks
+
+
+class TagBitmapIndex(object):
+    """
+    Index of the items of each tag in each tagged model of one database
+    """
+    def __init__(self, using="default", timeout=300):
+        self.using = using
+        self.timeout = timeout
+        # {through model: {tag id: set or bitmap of item pks}}
+        self._items = {}
+        # {model: bitmap of every pk}
+        self._universe = {}
+        # {model: set of deleted pks}, whose bits may linger in tags
+        self._deleted = {}
+        self._built = None
+        self._lock = threading.RLock()
+        m2m_changed.connect(self._m2m_changed)
+        post_save.connect(self._post_save)
+        post_delete.connect(self._post_delete)
+        tags_merged.connect(self._tags_merged)
+
+    def rebuild(self):
+        """
+        Load every through-table row and item pk
+        """
+        with self._lock:
+            items, universe = {}, {}
+            for model in registry.models():
+                universe[model] = _bitmap(set(
+                    model._default_manager.using(self.using)
+                    .values_list("pk", flat=True).iterator()))
+            for relation in registry.relations():
+                tags = items[relation.through] = {}
+                for item_id, tag_id in relation.through._default_manager\
+                        .using(self.using)\
+                        .values_list(relation.item_field, relation.tag_field)\
+                        .iterator():
+                    tags.setdefault(tag_id, set()).add(item_id)
+                dense = universe[relation.model].bit_length() // DENSITY
+                for tag_id, item_ids in tags.items():
+                    if len(item_ids) > dense:
+                        tags[tag_id] = _bitmap(item_ids)
+            self._items, self._universe = items, universe
+            self._deleted = dict((model, set()) for model in universe)
+            self._built = time.time()
+
+    def _refresh(self):
+        if self._built is None or time.time() - self._built > self.timeout:
+            self.rebuild()
+
+    # maintenance
+
+    def _add(self, through, tag_id, item_ids):
+        tags = self._items[through]
+        value = tags.get(tag_id, set())
+        if isinstance(value, set):
+            value.update(item_ids)
+        else:
+            value |= _bitmap(set(item_ids))
+        tags[tag_id] = value
+
+    def _remove(self, through, tag_id, item_ids):
+        tags = self._items[through]
+        value = tags.get(tag_id)
+        if isinstance(value, set):
+            value.difference_update(item_ids)
+        elif value is not None:
+            tags[tag_id] = value & ~_bitmap(set(item_ids))
+
+    def _m2m_changed(self, sender, instance, action, reverse, model, pk_set,
+                     using, **kwargs):
+        if self._built is None or using != self.using or \
+                action not in ("post_add", "post_remove", "pre_clear"):
+            return
+        relation = registry.for_through(sender)
+        if relation is None:
+            return
+        with self._lock:
+            if action == "pre_clear" and reverse:
+                self._items[sender].pop(instance.pk, None)
+                return
+            if action == "pre_clear":
+                pk_set = [tag_id for _, tag_id in _existing_tag_rows(
+                    relation, [instance.pk], using=using)]
+                action = "post_remove"
+            change = self._add if action == "post_add" else self._remove
+            if reverse:
+                change(sender, instance.pk, pk_set or ())
+            else:
+                for tag_id in pk_set or ():
+                    change(sender, tag_id, [instance.pk])
+
+    def _post_save(self, sender, instance, created, using, **kwargs):
+        if self._built is None or using != self.using or not created or \
+                sender not in self._universe:
+            return
+        with self._lock:
+            pk = instance.pk
+            if pk in self._deleted[sender]:
+                # a reused pk: drop the deleted item's tags
+                self._deleted[sender].discard(pk)
+                for relation in registry.relations(models=[sender]):
+                    for tag_id in list(self._items[relation.through]):
+                        self._remove(relation.through, tag_id, [pk])
+            self._universe[sender] |= 1 << pk
+
+    def _post_delete(self, sender, instance, using, **kwargs):
+        if self._built is None or using != self.using:
+            return
+        with self._lock:
+            if sender is Tag:
+                for tags in self._items.values():
+                    tags.pop(instance.pk, None)
+            elif sender in self._universe:
+                # the item's bits stay in its tags until the pk is reused;
+                # the universe masks them meanwhile
+                self._universe[sender] &= ~(1 << instance.pk)
+                self._deleted[sender].add(instance.pk)
+
+    def _tags_merged(self, sender, source_ids, target_id, using, **kwargs):
+        if self._built is None or using != self.using:
+            return
+        with self._lock:
+            for tags in self._items.values():
+                merged = 0
+                for tag_id in source_ids:
+                    merged |= _bitmap(tags.pop(tag_id, 0))
+                if merged:
+                    tags[target_id] = merged | _bitmap(tags.get(target_id,
+                                                                0))
+
+    # queries
+
+    def _tag_bitmap(self, model, tag_id, auto_tags):
+        value = 0
+        for relation in registry.relations(
+                models=[model], auto=None if auto_tags else False):
+            value |= _bitmap(self._items[relation.through].get(tag_id, 0))
+        return value
+
+    def bitmap(self, model, all_of=(), any_of=(), none_of=(),
+               auto_tags=False):
+        """
+        Return the bitmap of the pks of the `model` items matching the
+        conditions, which are as for TaggedItemQuerySet.tagged
+        """
+        conditions = _tagged_conditions(all_of, any_of, none_of)
+        if conditions is None:
+            return 0
+        all_ids, any_ids, none_ids = conditions
+        with self._lock:
+            self._refresh()
+            result = self._universe[model]
+            for tag_id in all_ids:
+                result &= self._tag_bitmap(model, tag_id, auto_tags)
+            if any_ids:
+                matches = 0
+                for tag_id in any_ids:
+                    matches |= self._tag_bitmap(model, tag_id, auto_tags)
+                result &= matches
+            for tag_id in none_ids:
+                result &= ~self._tag_bitmap(model, tag_id, auto_tags)
+        return result
+
+    def items(self, *args, **kwargs):
+        """
+        Return the sorted list of the pks of the matching items; see
+        bitmap
+        """
+        return _pks(self.bitmap(*args, **kwargs))
+
+    def count(self, *args, **kwargs):
+        """
+        Return the number of matching items; see bitmap
+        """
+        return bin(self.bitmap(*args, **kwargs)).count("1")
+
+
+_tag_bitmaps = None
+
+
+def tag_bitmaps():
+    """
+    Return the process-wide TagBitmapIndex of the default database
+    """
+    global _tag_bitmaps
+    if _tag_bitmaps is None:
+        _tag_bitmaps = TagBitmapIndex(
+            timeout=getattr(settings, "TAGMAN_TAG_BITMAPS_TIMEOUT", 300))
+    return _tag_bitmaps
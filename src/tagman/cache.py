@@ -0,0 +1,241 @@
+"""
+Caching of tag string resolution, so that hot paths such as
+Tag.tag_for_string and TaggedItem.add_tag_str need not query the database
+for tags they have seen before.
+
+There are two tiers: a bounded in-process LRU and, optionally, one of the
+Django cache backends shared between processes. Entries hold plain tag
+field values, never model instances, so callers always get a fresh Tag.
+
+Writes made through tagman invalidate the entries of this process and,
+with a shared tier, of every process. Local entries also expire after
+`local_timeout` seconds, which bounds how long writes they do not see,
+from other processes without a shared tier, raw SQL or rolled back
+transactions, can go unnoticed. Callers about to write rows pointing at
+a cached tag should check that it still exists.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import get_cache
+from tagman.signals import vocabulary_changed
+
+GENERATION_KEY = "tagman:tag:generation"
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe mapping that discards the least recently used
+    entry once `max_size` is exceeded.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Store `value` and return the list of (key, value) pairs evicted to
+        make room for it.
+        """
+        evicted = []
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                evicted.append(self._data.popitem(last=False))
+        return evicted
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TagStringCache(object):
+    """
+    Maps normalised "GRP:NAME" strings (group name without the system `*`)
+    to a tuple of tag field values.
+
+    Local entries are indexed by tag and group id so that saving or
+    deleting either drops exactly the strings that may now resolve
+    differently. Shared entries cannot be enumerated, so any write bumps
+    a generation number that forms part of every shared key.
+    """
+    def __init__(self, max_size=1000, backend=None, timeout=None,
+                 local_timeout=60):
+        self.local = LRUCache(max_size) if max_size else None
+        self.shared = get_cache(backend) if backend else None
+        self.timeout = timeout
+        self.local_timeout = local_timeout
+        self._by_tag = {}
+        self._by_group = {}
+        self._lock = threading.RLock()
+        self._version = 0
+
+    def _generation(self):
+        if self.shared is None:
+            return 0
+        return self.shared.get(GENERATION_KEY, 0)
+
+    def _shared_key(self, key, generation):
+        digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+        return "tagman:tag:{0}:{1}".format(generation, digest)
+
+    def _index(self, key, values):
+        with self._lock:
+            self._by_tag.setdefault(values[0], set()).add(key)
+            self._by_group.setdefault(values[3], set()).add(key)
+
+    def _unindex(self, key, values):
+        with self._lock:
+            self._by_tag.get(values[0], set()).discard(key)
+            self._by_group.get(values[3], set()).discard(key)
+
+    def _set_local(self, key, generation, values):
+        if self.local is None:
+            return
+        self._index(key, values)
+        expires = time.time() + self.local_timeout
+        for old_key, (_, old_values, _) in self.local.set(
+                key, (generation, values, expires)):
+            self._unindex(old_key, old_values)
+
+    def _drop_local(self, key):
+        if self.local is None:
+            return
+        entry = self.local.pop(key)
+        if entry is not None:
+            self._unindex(key, entry[1])
+
+    def get(self, key):
+        """
+        Return the cached values for `key`, or None
+        """
+        generation = self._generation()
+        if self.local is not None:
+            entry = self.local.get(key)
+            if entry is not None:
+                if entry[0] == generation and entry[2] > time.time():
+                    return entry[1]
+                self._drop_local(key)
+        if self.shared is not None:
+            values = self.shared.get(self._shared_key(key, generation))
+            if values is not None:
+                self._set_local(key, generation, values)
+                return values
+        return None
+
+    def set(self, key, values):
+        """
+        Cache `values`, a tuple as produced by `Tag.cache_values`
+        """
+        generation = self._generation()
+        self._set_local(key, generation, values)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(key, generation), values,
+                            self.timeout)
+
+    def _bump(self):
+        if self.shared is None:
+            return
+        self.shared.add(GENERATION_KEY, 0)
+        try:
+            self.shared.incr(GENERATION_KEY)
+        except ValueError:
+            # evicted between add and incr
+            self.shared.set(GENERATION_KEY, 1)
+
+    def version(self):
+        """
+        Return a value that changes whenever the cache is invalidated,
+        here or, with a shared tier, in any process; callers caching
+        data derived from the whole tag vocabulary can compare it.
+        """
+        return self._version, self._generation()
+
+    def invalidate(self, keys=(), tag_id=None, group_id=None, tag_ids=(),
+                   group_ids=()):
+        """
+        Drop `keys` plus every string resolved to tag `tag_id`, to any of
+        `tag_ids` or to any tag of group `group_id` or of `group_ids`. With
+        no arguments this only marks the vocabulary as changed.
+        """
+        keys = set(keys)
+        tag_ids, group_ids = list(tag_ids), list(group_ids)
+        with self._lock:
+            self._version += 1
+            if tag_id is not None:
+                keys.update(self._by_tag.pop(tag_id, ()))
+            for changed_id in tag_ids:
+                keys.update(self._by_tag.pop(changed_id, ()))
+            if group_id is not None:
+                keys.update(self._by_group.pop(group_id, ()))
+            for changed_id in group_ids:
+                keys.update(self._by_group.pop(changed_id, ()))
+        for key in keys:
+            self._drop_local(key)
+        self._bump()
+        vocabulary_changed.send(sender=self.__class__, tag_id=tag_id,
+                                group_id=group_id, tag_ids=tag_ids,
+                                group_ids=group_ids)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._by_tag.clear()
+            self._by_group.clear()
+        if self.local is not None:
+            self.local.clear()
+        self._bump()
+        vocabulary_changed.send(sender=self.__class__, tag_id=None,
+                                group_id=None, tag_ids=[], group_ids=[])
+
+
+_tag_cache = None
+
+
+def tag_cache():
+    """
+    Return the process-wide TagStringCache, configured by:
+
+    TAGMAN_TAG_CACHE_SIZE
+        Maximum entries in the in-process tier; 0 disables it.
+        Default 1000.
+    TAGMAN_TAG_CACHE_BACKEND
+        Alias of a Django cache to use as a shared tier. Default None.
+    TAGMAN_TAG_CACHE_TIMEOUT
+        Timeout for shared entries. Default is the backend's.
+    TAGMAN_TAG_CACHE_LOCAL_TIMEOUT
+        Seconds before in-process entries expire. Default 60.
+    """
+    global _tag_cache
+    if _tag_cache is None:
+        _tag_cache = TagStringCache(
+            max_size=getattr(settings, "TAGMAN_TAG_CACHE_SIZE", 1000),
+            backend=getattr(settings, "TAGMAN_TAG_CACHE_BACKEND", None),
+            timeout=getattr(settings, "TAGMAN_TAG_CACHE_TIMEOUT", None),
+            local_timeout=getattr(settings, "TAGMAN_TAG_CACHE_LOCAL_TIMEOUT",
+                                  60))
+    return _tag_cache
@@ -0,0 +1,184 @@
+"""
+Opt-in instrumentation of the tagman public API.
+
+With TAGMAN_INSTRUMENTATION set (or after enable()), each call of an
+instrumented operation - tag resolution, tag weights, tagged item
+fetches, auto-tagging and the TagGroup cascade - is measured for wall
+time, queries issued and rows returned. Each measurement is:
+
+ - sent as the operation_measured signal, with the operation name as
+   sender;
+ - logged at DEBUG to the "tagman.instrumentation" logger, with the
+   values also in the record's `extra`;
+ - added to the process-wide OperationStats returned by stats().
+
+Queries are counted from connection.queries, so debug cursors are
+switched on for the duration of the outermost instrumented call and
+the queries they record are discarded again afterwards unless DEBUG
+already kept them. Operations returning lazy querysets are not
+instrumented, as their queries happen after they return. Nested calls
+are each measured, so an outer operation's figures include those of the
+operations it calls.
+
+When off, an instrumented call costs one global lookup and an extra
+function call.
+"""
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Model
+from tagman.signals import operation_measured
+
+logger = logging.getLogger("tagman.instrumentation")
+
+_enabled = None
+_local = threading.local()
+
+
+def enabled():
+    """
+    Return whether instrumentation is on, by default the value of the
+    TAGMAN_INSTRUMENTATION setting
+    """
+    global _enabled
+    if _enabled is None:
+        _enabled = bool(getattr(settings, "TAGMAN_INSTRUMENTATION", False))
+    return _enabled
+
+
+def enable(on=True):
+    """
+    Switch instrumentation on, or off, overriding the setting
+    """
+    global _enabled
+    _enabled = bool(on)
+
+
+def disable():
+    enable(False)
+
+
+def result_rows(result):
+    """
+    Default count of the rows in an operation's result: 1 for an
+    instance, 0 for None, the length of a list, tuple, set or dict, and
+    otherwise None, i.e. not known
+    """
+    if result is None:
+        return 0
+    if isinstance(result, Model):
+        return 1
+    if isinstance(result, (list, tuple, set, frozenset, dict)):
+        return len(result)
+    return None
+
+
+class OperationStats(object):
+    """
+    Aggregated measurements of the instrumented operations, keyed on
+    operation name
+    """
+    FIELDS = ("calls", "elapsed", "max_elapsed", "queries", "rows")
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, elapsed, queries, rows):
+        with self._lock:
+            totals = self._operations.get(operation)
+            if totals is None:
+                totals = self._operations[operation] = \
+                    dict.fromkeys(self.FIELDS, 0)
+            totals["calls"] += 1
+            totals["elapsed"] += elapsed
+            totals["max_elapsed"] = max(totals["max_elapsed"], elapsed)
+            totals["queries"] += queries
+            totals["rows"] += rows or 0
+
+    def snapshot(self):
+        """
+        Return a dict of {operation: dict of totals}, copied
+        """
+        with self._lock:
+            return dict((operation, dict(totals))
+                        for operation, totals in self._operations.items())
+
+    def __getitem__(self, operation):
+        return self.snapshot()[operation]
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+
+_stats = OperationStats()
+
+
+def stats():
+    """
+    Return the process-wide OperationStats
+    """
+    return _stats
+
+
+def _query_counts():
+    return dict((connection.alias, len(connection.queries))
+                for connection in connections.all())
+
+
+def _measure(operation, rows, func, args, kwargs):
+    outermost = not getattr(_local, "depth", 0)
+    if outermost:
+        forced = [connection for connection in connections.all()
+                  if not (connection.use_debug_cursor or
+                          (connection.use_debug_cursor is None and
+                           settings.DEBUG))]
+        for connection in forced:
+            connection.use_debug_cursor = True
+    _local.depth = getattr(_local, "depth", 0) + 1
+    before = _query_counts()
+    started = time.time()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        elapsed = time.time() - started
+        queries = sum(count - before.get(alias, 0)
+                      for alias, count in _query_counts().items())
+        _local.depth -= 1
+        if outermost:
+            for connection in forced:
+                connection.use_debug_cursor = None
+                del connection.queries[before[connection.alias]:]
+
+    count = rows(result) if rows is not None else None
+    _stats.record(operation, elapsed, queries, count)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s took %.6fs, %d queries, %s rows",
+                     operation, elapsed, queries, count,
+                     extra={"operation": operation, "elapsed": elapsed,
+                            "queries": queries, "rows": count})
+    if operation_measured.receivers:
+        operation_measured.send(sender=operation, elapsed=elapsed,
+                                queries=queries, rows=count)
+    return result
+
+
+def instrumented(operation, rows=result_rows):
+    """
+    Decorator measuring each call of the decorated function as
+    `operation` while instrumentation is on. `rows` is called with the
+    result to count the rows returned.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not (_enabled or (_enabled is None and enabled())):
+                return func(*args, **kwargs)
+            return _measure(operation, rows, func, args, kwargs)
+        return wrapper
+    return decorator
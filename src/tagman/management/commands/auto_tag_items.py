@@ -0,0 +1,72 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import get_model
+from tagman.models import TaggedContentItem, TaggedContentItemQuerySet
+from tagman.registry import registry
+
+
+class Command(BaseCommand):
+    args = '[app_label.ModelName ...]'
+    help = 'Adds or renames the self auto tags of every item of the given ' \
+           'TaggedContentItem models, or of all of them, in chunks'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', action='store', type='int',
+                    dest='chunk_size', default=1000,
+                    help='Items to tag per transaction. Defaults to 1000.'),
+        make_option('--start-after', action='store', dest='start_after',
+                    default=None,
+                    help='Resume after this pk; requires a single model'),
+        make_option('--database', action='store', dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database to use. Defaults to "default".'),
+    )
+
+    def _models(self, labels):
+        if not labels:
+            return [model for model in registry.models()
+                    if issubclass(model, TaggedContentItem)]
+        models = []
+        for label in labels:
+            try:
+                app_label, model_name = label.split('.')
+            except ValueError:
+                raise CommandError('Expected app_label.ModelName, got %s'
+                                   % label)
+            model = get_model(app_label, model_name)
+            if model is None or not issubclass(model, TaggedContentItem):
+                raise CommandError('%s is not a TaggedContentItem model'
+                                   % label)
+            models.append(model)
+        return models
+
+    def handle(self, *args, **options):
+        models = self._models(args)
+        start_after = options['start_after']
+        if start_after is not None and len(models) != 1:
+            raise CommandError('--start-after requires a single model')
+
+        for model in models:
+            name = model.__name__
+
+            def report(progress):
+                rate = progress.items / progress.elapsed \
+                    if progress.elapsed else 0
+                self.stdout.write(
+                    "{0}: {1} items up to pk {2}, {3} tagged, {4} renamed "
+                    "({5:.0f} items/s)\n".format(
+                        name, progress.items, progress.last_pk,
+                        progress.tagged, progress.renamed, rate))
+
+            try:
+                items = TaggedContentItemQuerySet(
+                    model, using=options['database'])
+                progress = items.associate_auto_tags(
+                    chunk_size=options['chunk_size'],
+                    start_after=start_after, callback=report)
+            except Exception as e:
+                raise CommandError(
+                    'Exception while auto-tagging %s: %s' % (name, e))
+            self.stdout.write("{0}: done, {1} items\n".format(
+                name, progress.items))
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from tagman.related import refresh_related_tags
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Recomputes the related tags of tags whose items have changed, ' \
+           'or of every tag with --full'
+    option_list = BaseCommand.option_list + (
+        make_option('--full', action='store_true', dest='full',
+                    default=False,
+                    help='Recompute every tag rather than only stale ones'),
+        make_option('--top', action='store', type='int', dest='top',
+                    default=10,
+                    help='Related tags to keep per tag. Defaults to 10.'),
+        make_option('--chunk-size', action='store', type='int',
+                    dest='chunk_size', default=500,
+                    help='Tags to compute per transaction. Defaults to 500.'),
+        make_option('--database', action='store', dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database to use. Defaults to "default".'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            refreshed = refresh_related_tags(
+                k=options['top'], full=options['full'],
+                chunk_size=options['chunk_size'],
+                using=options['database'])
+        except Exception as e:
+            raise CommandError('Exception while building related tags: %s'
+                               % e)
+        self.stdout.write("Refreshed related tags of {0} tags\n".format(
+            refreshed))
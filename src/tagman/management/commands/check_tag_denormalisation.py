@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from tagman.models import TagGroup
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Reports tags whose de-normalised group name, slug or system ' \
+           'flag differ from their group, and repairs them with --repair'
+    option_list = BaseCommand.option_list + (
+        make_option('--repair', action='store_true', dest='repair',
+                    default=False,
+                    help='Rewrite the de-normalised values of drifted tags'),
+        make_option('--database', action='store', dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database to use. Defaults to "default".'),
+    )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if options['repair']:
+            try:
+                drift = TagGroup.objects.repair(using)
+            except Exception as e:
+                raise CommandError('Exception while repairing tags: %s' % e)
+            self.stdout.write("Repaired {0} tags in {1} groups\n".format(
+                sum(drift.values()), len(drift)))
+            return
+
+        drift = TagGroup.objects.drifted(using)
+        groups = TagGroup.objects.using(using).in_bulk(drift.keys())
+        for group_id, count in sorted(drift.items()):
+            self.stdout.write("Group {0} ({1}): {2} tags drifted\n".format(
+                group_id, groups[group_id], count))
+        if drift:
+            raise CommandError('{0} tags in {1} groups have drifted'.format(
+                sum(drift.values()), len(drift)))
+        self.stdout.write("Tag group values are consistent\n")
@@ -1,14 +1,77 @@
+import time
+from optparse import make_option
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
 from tagman.models import Tag
 
 
 class Command(BaseCommand):
     args = ''
-    help = 'Removes all archived Tags'
+    help = 'Removes all archived Tags, and their through-table rows, in ' \
+           'pk-ordered batches'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', action='store', type='int',
+                    dest='batch_size', default=1000,
+                    help='Tags to delete per transaction. Defaults to 1000.'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help='Report what would be deleted without deleting it'),
+        make_option('--sleep', action='store', type='float', dest='sleep',
+                    default=0,
+                    help='Seconds to pause between batches'),
+        make_option('--time-limit', action='store', type='float',
+                    dest='time_limit', default=None,
+                    help='Stop starting new batches after this many '
+                         'seconds'),
+        make_option('--start-after', action='store', type='int',
+                    dest='start_after', default=None,
+                    help='Resume after this tag pk'),
+        make_option('--database', action='store', dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database to use. Defaults to "default".'),
+    )
 
     def handle(self, *args, **options):
-        try:
-            archived_tags = Tag.objects.filter(archived=True)
-            archived_tags.delete()
-        except Exception, e:
-            raise CommandError('Exception while deleting tags: %s' % e.message)
+        using = options['database']
+        dry_run = options['dry_run']
+        last_pk = options['start_after']
+        verb = 'Would delete' if dry_run else 'Deleted'
+        archived = Tag.objects.using(using).filter(archived=True)\
+            .order_by('pk')
+        started = time.time()
+        tags = rows = 0
+
+        while True:
+            batch = archived if last_pk is None else \
+                archived.filter(pk__gt=last_pk)
+            tag_ids = list(batch.values_list('pk', flat=True)
+                           [:options['batch_size']])
+            if not tag_ids:
+                break
+            try:
+                counts = Tag.bulk_delete(tag_ids, using, dry_run)
+            except Exception as e:
+                raise CommandError('Exception while deleting tags: %s' % e)
+            last_pk = tag_ids[-1]
+            tags += len(tag_ids)
+            rows += sum(counts.values())
+            self.stdout.write("{0} {1} tags up to pk {2} and {3} through "
+                              "rows ({4})\n".format(
+                                  verb, len(tag_ids), last_pk,
+                                  sum(counts.values()),
+                                  ", ".join("{0}: {1}".format(*count)
+                                            for count in sorted(
+                                                counts.items()))))
+            if len(tag_ids) < options['batch_size']:
+                break
+            if options['time_limit'] is not None and \
+                    time.time() - started >= options['time_limit']:
+                self.stdout.write("Time limit reached; resume with "
+                                  "--start-after={0}\n".format(last_pk))
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write("{0} {1} archived tags and {2} through rows\n"
+                          .format(verb, tags, rows))
@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from tagman.models import Tag
+
+
+class Command(BaseCommand):
+    args = '<tag> [<tag> ...]'
+    help = 'Moves the items of the given tags, as "[*]GRP:NAME", to the ' \
+           'tag given by --into, then deletes or, with --archive, ' \
+           'archives them'
+    option_list = BaseCommand.option_list + (
+        make_option('--into', action='store', dest='into', default=None,
+                    help='The tag to merge into, as "[*]GRP:NAME"'),
+        make_option('--archive', action='store_true', dest='archive',
+                    default=False,
+                    help='Archive the merged tags instead of deleting them'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help='Report what would be moved without moving it'),
+        make_option('--database', action='store', dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database to use. Defaults to "default".'),
+    )
+
+    def handle(self, *args, **options):
+        if not args or not options['into']:
+            raise CommandError('Give the tags to merge and --into')
+        verb = 'Would add' if options['dry_run'] else 'Added'
+        try:
+            counts = Tag.merge(args, options['into'],
+                               archive=options['archive'],
+                               using=options['database'],
+                               dry_run=options['dry_run'])
+        except Exception as e:
+            raise CommandError('Exception while merging tags: %s' % e)
+        self.stdout.write("{0} {1} rows to {2} ({3})\n".format(
+            verb, sum(counts.values()), options['into'],
+            ", ".join("{0}: {1}".format(*count)
+                      for count in sorted(counts.items()))))
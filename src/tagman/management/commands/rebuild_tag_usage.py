@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from tagman.models import TagUsage
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Rebuilds the materialised tag usage counters from the ' \
+           'through-tables, or reports drift with --verify'
+    option_list = BaseCommand.option_list + (
+        make_option('--verify', action='store_true', dest='verify',
+                    default=False,
+                    help='Report drifted counters without changing them'),
+        make_option('--database', action='store', dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database to use. Defaults to "default".'),
+    )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if options['verify']:
+            drift = TagUsage.objects.verify(using)
+            for (tag_id, model, auto), (stored, expected) in \
+                    sorted(drift.items()):
+                self.stdout.write(
+                    "Tag {0} on {1}{2}: stored {3}, expected {4}\n".format(
+                        tag_id, model, " (auto)" if auto else "",
+                        stored, expected))
+            if drift:
+                raise CommandError('{0} tag usage counters have drifted'
+                                   .format(len(drift)))
+            self.stdout.write("Tag usage counters are consistent\n")
+            return
+
+        try:
+            with transaction.commit_on_success(using=using):
+                written = TagUsage.objects.rebuild(using)
+        except Exception as e:
+            raise CommandError('Exception while rebuilding tag usage: %s' % e)
+        self.stdout.write("Rebuilt {0} tag usage counters\n".format(written))
@@ -0,0 +1,65 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import get_model
+from tagman.models import TagStringsMixin, _commit_on_success
+from tagman.models import refresh_tag_strings
+from tagman.registry import registry
+
+
+class Command(BaseCommand):
+    args = '[app_label.ModelName ...]'
+    help = 'Rewrites the de-normalised tag strings of every item of the ' \
+           'given TagStringsMixin models, or of all of them, in chunks'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', action='store', type='int',
+                    dest='chunk_size', default=1000,
+                    help='Items to refresh per transaction. Defaults to '
+                         '1000.'),
+        make_option('--database', action='store', dest='database',
+                    default=DEFAULT_DB_ALIAS,
+                    help='Database to use. Defaults to "default".'),
+    )
+
+    def _models(self, labels):
+        if not labels:
+            return [model for model in registry.models()
+                    if issubclass(model, TagStringsMixin)]
+        models = []
+        for label in labels:
+            try:
+                app_label, model_name = label.split('.')
+            except ValueError:
+                raise CommandError('Expected app_label.ModelName, got %s'
+                                   % label)
+            model = get_model(app_label, model_name)
+            if model is None or not issubclass(model, TagStringsMixin):
+                raise CommandError('%s is not a TagStringsMixin model'
+                                   % label)
+            models.append(model)
+        return models
+
+    def handle(self, *args, **options):
+        using = options['database']
+        chunk_size = options['chunk_size']
+        for model in self._models(args):
+            name = model.__name__
+            items, last_pk = 0, None
+            try:
+                while True:
+                    pks = model._default_manager.using(using).order_by('pk')
+                    if last_pk is not None:
+                        pks = pks.filter(pk__gt=last_pk)
+                    pks = list(pks.values_list('pk', flat=True)[:chunk_size])
+                    if not pks:
+                        break
+                    with _commit_on_success(using):
+                        refresh_tag_strings(model, pks, using=using)
+                    items += len(pks)
+                    last_pk = pks[-1]
+            except Exception as e:
+                raise CommandError(
+                    'Exception while refreshing tag strings of %s: %s'
+                    % (name, e))
+            self.stdout.write("{0}: done, {1} items\n".format(name, items))
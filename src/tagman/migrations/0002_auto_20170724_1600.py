@@ -7,13 +7,12 @@ def denormalised_group(apps, schema_editor):
     Tag = apps.get_model('tagman', 'Tag')
     TagGroup = apps.get_model('tagman', 'TagGroup')
 
-    for tag in Tag.objects.all():
-        group = TagGroup.objects.get(id=tag.group_id)
+    for group in TagGroup.objects.all():
         prefix = "*" if group.system else ""
-        tag.group_name = "{}{}".format(prefix, group.name)
-        tag.group_slug = str(group.slug)
-        tag.group_is_system = group.system
-        tag.save()
+        Tag.objects.filter(group_id=group.id).update(
+            group_name="{}{}".format(prefix, group.name),
+            group_slug=str(group.slug),
+            group_is_system=group.system)
 
 
 class Migration(migrations.Migration):
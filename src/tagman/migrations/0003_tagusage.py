@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tagman', '0002_auto_20170724_1600'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagUsage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('model', models.CharField(help_text=b'Label of the tagged model, e.g. app_label.ModelName', max_length=255)),
+                ('auto', models.BooleanField(default=False)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('tag', models.ForeignKey(related_name='usage_counts', to='tagman.Tag')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagusage',
+            unique_together=set([('tag', 'model', 'auto')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tagman', '0003_tagusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedTag',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('count', models.PositiveIntegerField(default=0, help_text=b'Items having both tags')),
+                ('score', models.FloatField(default=0)),
+                ('related', models.ForeignKey(related_name='+', to='tagman.Tag')),
+                ('tag', models.ForeignKey(related_name='related_scores', to='tagman.Tag')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StaleRelatedTag',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('tag', models.ForeignKey(related_name='+', to='tagman.Tag')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='relatedtag',
+            unique_together=set([('tag', 'related')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tagman', '0004_relatedtag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VocabularyGeneration',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('generation', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
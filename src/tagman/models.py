@@ -6,14 +6,322 @@ A compound construct, the qualified tag, has a name but is assigned to a group.
 
 These models implement this idea.
 """
+import json
 import logging
-
-from django.db import models
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.query import EmptyQuerySet, QuerySet
+from django.db.models.signals import (class_prepared, m2m_changed,
+                                      post_delete, post_init, pre_delete)
 from django.template.defaultfilters import slugify
 
+from tagman.cache import tag_cache
+from tagman.instrumentation import instrumented
+from tagman.registry import registry
+from tagman.signals import tag_denormalised, tags_merged, vocabulary_changed
+from tagman.streaming import cursor_for, encode_cursor, merge_querysets
+from tagman.vocabulary import vocabulary_snapshot
+
 TAG_SEPARATOR = ":"
 logger = logging.getLogger()
 
+# result of Tag.resolve_tag_strings: the tags found, in input order, and the
+# tokens that could not be resolved
+TagResolution = namedtuple("TagResolution", ["tags", "missing"])
+
+# running totals reported by TaggedContentItemQuerySet.associate_auto_tags;
+# `last_pk` is the cursor to resume from
+AutoTagProgress = namedtuple("AutoTagProgress", [
+    "items", "tagged", "renamed", "last_pk", "elapsed"])
+
+# tag counts returned by tag_facets; a group's `count` is the sum of its
+# tags' counts, over all of them rather than only the `tags` listed
+TagFacet = namedtuple("TagFacet", ["id", "name", "slug", "count"])
+TagGroupFacet = namedtuple("TagGroupFacet", [
+    "name", "slug", "system", "count", "tags"])
+
+
+def _chunks(seq, size):
+    """
+    Yield successive lists of at most `size` items from `seq`
+    """
+    seq = list(seq)
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+@contextmanager
+def _commit_on_success(using):
+    """
+    transaction.commit_on_success, unless the caller already manages a
+    transaction, which a nested commit_on_success would commit early
+    """
+    if transaction.is_managed(using=using):
+        yield
+    else:
+        with transaction.commit_on_success(using=using):
+            yield
+
+
+def _parse_tag_string(s):
+    """
+    Split a "[*]GRP:NAME" representation into (is_system, GRP, NAME)
+    """
+    is_system = s.strip().startswith("*")
+    group_name, name = s.strip('* ').split(TAG_SEPARATOR)
+    return is_system, group_name, name
+
+
+def _cache_key(group_name, name):
+    """
+    Key used by the tag string cache; the system prefix is not part of it
+    """
+    return u"{0}{1}{2}".format(group_name.lstrip("*"), TAG_SEPARATOR, name)
+
+
+def _composite_name(group_name, name):
+    """
+    Return the "[*]GRP:NAME" representation from de-normalised values
+    """
+    return u"{0}{1}".format(
+        group_name + TAG_SEPARATOR if group_name else "", name
+    )
+
+
+def _vocabulary_snapshot_enabled():
+    """
+    The process-wide vocabulary snapshot is opt-in via
+    TAGMAN_VOCABULARY_SNAPSHOT
+    """
+    return getattr(settings, "TAGMAN_VOCABULARY_SNAPSHOT", False)
+
+
+def _usage_counters_enabled():
+    """
+    Materialised TagUsage counters are opt-in via TAGMAN_USAGE_COUNTERS
+    """
+    return getattr(settings, "TAGMAN_USAGE_COUNTERS", False)
+
+
+def _model_label(model):
+    return "{0}.{1}".format(model._meta.app_label, model._meta.object_name)
+
+
+@instrumented("tag_weights")
+def _tag_weights(tag_ids=None, ignore_models=None, limit=None,
+                 min_weight=None, using="default"):
+    """
+    Return a list of (tag id, weight) tuples, where weight is the number of
+    times a tag is used in the `tags` field of any tagged model.
+
+    All through-tables are aggregated in one grouped UNION query, or the
+    TagUsage counters are read if enabled. When `limit` or `min_weight` is
+    given the database ranks the results, heaviest first, and tags that
+    are not used at all are never returned.
+    """
+    if tag_ids is not None and not tag_ids:
+        return []
+    ignore_models = set(ignore_models or [])
+    if _usage_counters_enabled():
+        return _counted_tag_weights(tag_ids, ignore_models, limit,
+                                    min_weight, using)
+
+    qn = connections[using].ops.quote_name
+    selects, params = [], []
+    for relation in registry.relations(auto=False,
+                                       ignore_models=ignore_models):
+        field = relation.field
+        tag_column = qn(field.m2m_reverse_name())
+        sql = "SELECT {0} AS tag_id, COUNT(*) AS weight FROM {1}".format(
+            tag_column, qn(field.m2m_db_table()))
+        if tag_ids is not None:
+            sql += " WHERE {0} IN ({1})".format(
+                tag_column, ", ".join(["%s"] * len(tag_ids)))
+            params.extend(tag_ids)
+        selects.append(sql + " GROUP BY {0}".format(tag_column))
+
+    if not selects:
+        return []
+
+    sql = "SELECT tag_id, SUM(weight) FROM ({0}) tag_usage GROUP BY tag_id"\
+        .format(" UNION ALL ".join(selects))
+    if min_weight is not None:
+        sql += " HAVING SUM(weight) >= %s"
+        params.append(min_weight)
+    if limit is not None or min_weight is not None:
+        sql += " ORDER BY SUM(weight) DESC, tag_id"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+
+    cursor = connections[using].cursor()
+    cursor.execute(sql, params)
+    return [(tag_id, int(weight)) for tag_id, weight in cursor.fetchall()]
+
+
+def _counted_tag_weights(tag_ids, ignore_models, limit, min_weight, using):
+    """
+    As _tag_weights but read from the materialised TagUsage counters
+    """
+    usage = TagUsage.objects.using(using).filter(auto=False, count__gt=0)\
+        .exclude(model__in=[_model_label(m) for m in ignore_models])
+    if tag_ids is not None:
+        usage = usage.filter(tag__in=tag_ids)
+    usage = usage.values_list("tag").annotate(weight=Sum("count"))
+    if min_weight is not None:
+        usage = usage.filter(weight__gte=min_weight)
+    if limit is not None or min_weight is not None:
+        usage = usage.order_by("-weight", "tag")
+    if limit is not None:
+        usage = usage[:limit]
+    return [(tag_id, int(weight)) for tag_id, weight in usage]
+
+
+def _usage_count_sql(using="default"):
+    """
+    Return (sql, params) for a subquery giving the weight of the tag in the
+    current row of the Tag table, from the through-tables or the TagUsage
+    counters if enabled
+    """
+    qn = connections[using].ops.quote_name
+    tag_id = "{0}.{1}".format(qn(Tag._meta.db_table), qn(Tag._meta.pk.column))
+    if _usage_counters_enabled():
+        return ("(SELECT COALESCE(SUM({count}), 0) FROM {usage} "
+                "WHERE {tag} = {tag_id} AND {auto} = %s)".format(
+                    count=qn("count"), usage=qn(TagUsage._meta.db_table),
+                    tag=qn("tag_id"), auto=qn("auto"), tag_id=tag_id),
+                [False])
+    counts = ["(SELECT COUNT(*) FROM {0} WHERE {1} = {2})".format(
+        qn(relation.field.m2m_db_table()),
+        qn(relation.field.m2m_reverse_name()), tag_id)
+        for relation in registry.relations(auto=False)]
+    return "({0})".format(" + ".join(counts) or "0"), []
+
+
+def with_usage_counts(tags):
+    """
+    Return the `tags` queryset with a `usage_count` attribute, the tag's
+    weight, on each tag; it can be used in order_by.
+    """
+    sql, params = _usage_count_sql(tags.db)
+    return tags.extra(select={"usage_count": sql}, select_params=params)
+
+
+def _fetch_tags(keys, chunk_size=100):
+    """
+    Return a dictionary of Tag keyed on (group name, tag name) for the given
+    keys, fetched with one OR'd query per `chunk_size` keys.
+    """
+    found = {}
+    for chunk in _chunks(keys, chunk_size):
+        condition = Q()
+        for group_name, name in chunk:
+            condition |= Q(group__name=group_name, name=name)
+        rows = dict(((tag.group.name, tag.name), tag) for tag in
+                    Tag.objects.filter(condition).select_related("group"))
+        found.update(_match_rows(chunk, rows))
+    return found
+
+
+def _fold(key):
+    if isinstance(key, tuple):
+        return tuple(part.lower() for part in key)
+    return key.lower()
+
+
+def _match_rows(keys, rows):
+    """
+    Return a dict mapping each of `keys` to the value of `rows`, keyed on
+    the names as stored, that the database matched it with: the row of
+    the same spelling or, failing that, one that no key spells exactly
+    and that differs only in case, as returned under case-insensitive
+    collations such as MySQL's default
+    """
+    keys = set(keys)
+    found, folded = {}, {}
+    for stored, row in rows.items():
+        if stored in keys:
+            found[stored] = row
+        else:
+            folded.setdefault(_fold(stored), row)
+    for key in keys - set(found):
+        if _fold(key) in folded:
+            found[key] = folded[_fold(key)]
+    return found
+
+
+def _validate_cached_tags(tags, chunk_size=500):
+    """
+    Return those of `tags`, from a cache, whose rows still exist with the
+    same name and group, updating their archived flag from the rows, with
+    one query per chunk. The cache entries of the others are dropped.
+    """
+    rows = {}
+    for chunk in _chunks([tag.pk for tag in tags], chunk_size):
+        rows.update((pk, (name, group_name, archived))
+                    for pk, name, group_name, archived in Tag.objects
+                    .filter(pk__in=chunk)
+                    .values_list("pk", "name", "group_name", "archived"))
+    valid, stale = [], []
+    for tag in tags:
+        row = rows.get(tag.pk)
+        if row is not None and row[:2] == (tag.name, tag.group_name):
+            tag.archived = row[2]
+            valid.append(tag)
+        else:
+            stale.append(tag.pk)
+    if stale:
+        tag_cache().invalidate(tag_ids=stale)
+    return valid
+
+
+class TagGroupManager(models.Manager):
+    def drifted(self, using="default"):
+        """
+        Return a dict of the number of tags, by group id, whose
+        de-normalised group values differ from their group's, found with
+        one join query
+        """
+        qn = connections[using].ops.quote_name
+        sql = (
+            "SELECT t.{group_id}, COUNT(*) FROM {tag} t "
+            "INNER JOIN {group} g ON g.{id} = t.{group_id} "
+            "WHERE t.{group_slug} <> g.{slug} "
+            "OR t.{group_is_system} <> g.{system} "
+            "OR (g.{system} = %s AND t.{group_name} <> g.{name}) "
+            "OR (g.{system} = %s AND (SUBSTR(t.{group_name}, 1, 1) <> '*' "
+            "OR SUBSTR(t.{group_name}, 2) <> g.{name})) "
+            "GROUP BY t.{group_id}".format(
+                tag=qn(Tag._meta.db_table), group=qn(TagGroup._meta.db_table),
+                id=qn("id"), group_id=qn("group_id"), name=qn("name"),
+                slug=qn("slug"), system=qn("system"),
+                group_name=qn("group_name"), group_slug=qn("group_slug"),
+                group_is_system=qn("group_is_system")))
+        cursor = connections[using].cursor()
+        cursor.execute(sql, [False, True])
+        return dict(cursor.fetchall())
+
+    def repair(self, using="default"):
+        """
+        Rewrite the de-normalised values of every tag of each drifted
+        group, with set-based updates per group. Returns the drift found,
+        as `drifted`.
+        """
+        drift = self.drifted(using)
+        groups = self.using(using).in_bulk(drift.keys())
+        with _commit_on_success(using):
+            for group in groups.values():
+                group._cascade(group._denormalised(), using)
+        if groups:
+            tag_cache().invalidate(group_ids=groups.keys())
+        return drift
+
 
 class TagGroup(models.Model):
     """
@@ -27,6 +335,11 @@ class TagGroup(models.Model):
                                  help_text="Set True for system groups that "
                                            "should not appear for general use")
 
+    objects = TagGroupManager()
+
+    # tags per UPDATE when cascading de-normalised values
+    CASCADE_CHUNK_SIZE = 10000
+
     def __unicode__(self):
         prefix = "*" if self.system else ""
         return prefix + self.name
@@ -37,16 +350,68 @@ class TagGroup(models.Model):
         """
         return self.tag_set.all()
 
+    def _denormalised(self):
+        """
+        Return the values de-normalised onto the Tags of this group
+        """
+        return dict(group_name=unicode(self), group_slug=self.slug,
+                    group_is_system=self.system)
+
+    def _stored_denormalised(self, using):
+        """
+        Return the de-normalised values of the stored row, or None
+        """
+        for row in TagGroup.objects.using(using).filter(pk=self.pk)\
+                .values("name", "slug", "system"):
+            return TagGroup(**row)._denormalised()
+
     def save(self, *args, **kwargs):
-        """ assign slug if empty """
+        """
+        Assign slug if empty and, if the name, slug or system flag has
+        changed, update the de-normalised values in Tags of this group.
+        """
         if not self.slug:
             self.slug = slugify(self.name)
-        super(TagGroup, self).save(*args, **kwargs)
-
-        # update de-normalised values in Tags of this group
-        tags_for_group = self.tag_set.all()
-        for tag in tags_for_group:
-            tag.save()
+        using = kwargs.get("using") or router.db_for_write(TagGroup,
+                                                           instance=self)
+        adding = self._state.adding
+        denormalised = self._denormalised()
+        # instances with deferred fields are not snapshotted on init
+        saved = self.__dict__.get("_saved_denormalised")
+        if saved is None and not adding:
+            saved = self._stored_denormalised(using)
+
+        with _commit_on_success(using):
+            super(TagGroup, self).save(*args, **kwargs)
+            if not adding and denormalised != saved:
+                self._cascade(denormalised, self._state.db)
+        self._saved_denormalised = denormalised
+        tag_cache().invalidate(group_id=self.pk)
+
+    @instrumented("TagGroup.cascade", rows=lambda updated: updated)
+    def _cascade(self, denormalised, using):
+        """
+        Write de-normalised values to the Tags of this group with one
+        UPDATE per CASCADE_CHUNK_SIZE range of primary keys, then send
+        tag_denormalised for each tag if anyone is listening. Returns the
+        number of tags updated.
+        """
+        tags = Tag.objects.using(using).filter(group=self)
+        bounds = tags.aggregate(low=Min("pk"), high=Max("pk"))
+        if bounds["low"] is None:
+            return 0
+        updated = 0
+        for start in range(bounds["low"], bounds["high"] + 1,
+                           self.CASCADE_CHUNK_SIZE):
+            updated += tags.filter(pk__gte=start,
+                                   pk__lt=start + self.CASCADE_CHUNK_SIZE)\
+                .update(**denormalised)
+        _refresh_renamed_tag_strings(using, group_id=self.pk)
+
+        if tag_denormalised.receivers:
+            for tag in tags.iterator():
+                tag_denormalised.send(sender=Tag, instance=tag, using=using)
+        return updated
 
 
 class TagManager(models.Manager):
@@ -70,21 +435,47 @@ class TagManager(models.Manager):
             .exclude(group__system=not self.system_tags)\
             .filter(archived=self.archived)
 
-    def get_tags_with_weight(self, ignore_models=[], composite_name=True):
+    @instrumented("TagManager.get_tags_with_weight")
+    def get_tags_with_weight(self, ignore_models=[], composite_name=True,
+                             limit=None, min_weight=None):
         """
         :param ignore_models: Models to ignore in Tag usage results.
         :param composite_name: If True the group name will be prepended
         to tag name for dict keys.
+        :param limit: If given, return only the `limit` heaviest tags.
+        :param min_weight: If given, return only tags used at least
+        this many times.
 
         Returns dictionary of tag name as key and tag weight (usage) as
-        value.
+        value. When `limit` or `min_weight` is given the dictionary is
+        ordered heaviest first and unused tags are left out.
         """
-        tag_dict = {}
         tags = super(TagManager, self).get_query_set()
-        for tag in tags:
-            tag_name = tag.__unicode__() if composite_name else tag.name
-            tag_dict[tag_name] = tag.tag_weight(ignore_models)
-        return tag_dict
+        ranked = limit is not None or min_weight is not None
+        weights = _tag_weights(ignore_models=ignore_models, limit=limit,
+                               min_weight=min_weight, using=self.db)
+
+        if ranked:
+            rows = []
+            for ids in _chunks([tag_id for tag_id, _ in weights], 500):
+                rows.extend(tags.filter(pk__in=ids)
+                                .values_list("id", "name", "group_name"))
+        else:
+            rows = tags.values_list("id", "name", "group_name")
+
+        names = {}
+        for tag_id, name, group_name in rows:
+            names[tag_id] = _composite_name(group_name, name) \
+                if composite_name else name
+
+        if ranked:
+            return OrderedDict((names[tag_id], weight)
+                               for tag_id, weight in weights
+                               if tag_id in names)
+
+        weights = dict(weights)
+        return dict((name, weights.get(tag_id, 0))
+                    for tag_id, name in names.items())
 
 
 class Tag(models.Model):
@@ -116,7 +507,8 @@ class Tag(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Assign slug if empty
+        Assign slug if empty and, if the tag has been renamed, refresh the
+        tag strings of its TagStringsMixin items
         """
         if not self.slug:
             self.slug = slugify(self.name)
@@ -126,15 +518,34 @@ class Tag(models.Model):
         self.group_slug = str(self.group.slug) if self.group else ""
         self.group_is_system = self.group.system
 
+        adding = self._state.adding
+        string = _composite_name(self.group_name, self.name)
+        # instances with deferred fields are not snapshotted on init
+        saved = self.__dict__.get("_saved_string")
+        if saved is None and not adding:
+            saved = self._stored_string(
+                kwargs.get("using") or router.db_for_write(Tag,
+                                                           instance=self))
         super(Tag, self).save(*args, **kwargs)
+        if not adding and string != saved:
+            _refresh_renamed_tag_strings(self._state.db, tag_ids=[self.pk])
+        self._saved_string = string
+        tag_cache().invalidate([_cache_key(self.group_name, self.name)],
+                               tag_id=self.pk)
+
+    def _stored_string(self, using):
+        """
+        Return the "[*]GRP:NAME" string of the stored row, or None
+        """
+        for group_name, name in Tag.objects.using(using).filter(pk=self.pk)\
+                .values_list("group_name", "name"):
+            return _composite_name(group_name, name)
 
     class Meta:
         unique_together = ("name", "group",)
 
     def __unicode__(self):
-        return u"{0}{1}".format(
-            self.group_name + TAG_SEPARATOR if self.group_name else "", self.name
-        )
+        return _composite_name(self.group_name, self.name)
 
     def __repr__(self):
         return u"{0}{1}".format(
@@ -152,20 +563,32 @@ class Tag(models.Model):
     def system(self):
         return self.group_is_system
 
+    CACHE_FIELDS = ("id", "name", "slug", "group_id", "group_name",
+                    "group_slug", "group_is_system", "archived")
+
+    def cache_values(self):
+        """
+        Return the tuple of field values held by the tag string cache
+        """
+        return tuple(getattr(self, f) for f in self.CACHE_FIELDS) + \
+            (self._state.db,)
+
+    @classmethod
+    def from_cache_values(cls, values):
+        """
+        Return a Tag instance built, without a query, from `cache_values`
+        """
+        tag = cls(**dict(zip(cls.CACHE_FIELDS, values)))
+        tag._state.adding = False
+        tag._state.db = values[-1]
+        return tag
+
     def models_for_tag(self):
         """
-        Return the unique set of model names, all of which have had
-        instances tagged with this tag.
-        @todo: This is *really* hacky. Can we do it more elegantly?
+        Return the set of model classes that can be tagged, i.e. every
+        concrete TaggedItem model (see tagman.registry).
         """
-        models = set()
-        for attribute in dir(self):
-            if attribute[-4:] == '_set':
-                # we just want the model name, not the set name
-                model_name = attribute.split('_')[0]
-                models.add(model_name)
-        # return the unique set of model names
-        return models
+        return set(registry.models())
 
     def tagged_model_items(self, model_cls=None, model_name="",
                            only_auto=False):
@@ -176,34 +599,14 @@ class Tag(models.Model):
 
         If `only_auto`==True then return only auto-tagged sets.
         """
-        def _get_model_query_set(set_name):
-            query_set = None
-            try:
-                _set = getattr(self, set_name)
-            except AttributeError:
-                logger.debug("Set {0} not found on tag {1}".format(
-                    set_name,
-                    self
-                ))
-            else:
-                query_set = _set
-            return query_set
-
-        if model_cls:
-            cls_name = model_cls.__name__.lower()
-        else:
-            cls_name = model_name.lower()
-
-        if not only_auto:
-            model_set = _get_model_query_set(
-                "{0}_set".format(cls_name)
-            )
-        else:
-            model_set = _get_model_query_set(
-                "{0}_auto_tagged_set".format(cls_name)
-            )
-
-        return model_set
+        if not model_cls:
+            model_cls = registry.model_for_name(model_name)
+        relation = registry.relation(model_cls, auto=only_auto)
+        if relation is None:
+            logger.debug("{0} is not a tagged model, for tag {1}".format(
+                model_cls or model_name, self))
+            return None
+        return getattr(self, relation.accessor)
 
     def auto_tagged_model_items(self, model_cls=None, model_name="",
                                 limit=None):
@@ -221,50 +624,58 @@ class Tag(models.Model):
 
         :param models:
             A list of model classes for which to retrieve items. If absent,
-            retrieve any model that has a foreign key to a tag.
+            retrieve every registered TaggedItem model.
         :param ignore_models:
             Model classes not to include in the list of retrieved items.
         """
         if models is None:
-            models = self.models_for_tag()
-        else:
-            models = [model.__name__.lower() for model in models]
-
-        if ignore_models is None:
-            ignore_models = set()
-        else:
-            ignore_models = set([model.__name__.lower()
-                                 for model in ignore_models])
+            models = registry.models()
+        ignore_models = set(ignore_models or [])
 
         rdict = {}
         for model in models:
             if model not in ignore_models:
-                rdict[model] = self.tagged_model_items(model_name=model,
-                                                       only_auto=only_auto)
+                rdict[model.__name__.lower()] = self.tagged_model_items(
+                    model_cls=model, only_auto=only_auto)
         return rdict
 
+    @instrumented("Tag.tag_weight", rows=lambda weight: 1)
     def tag_weight(self, ignore_models=[]):
         """
         Returns the weight of a tag based on the tags usage.
         """
-        weight = 0
-        for model_set in self.tagged_items(
-            ignore_models=ignore_models
-        ).values():
-            if model_set:
-                weight += model_set.count()
-        return weight
+        weights = _tag_weights(tag_ids=[self.pk],
+                               ignore_models=ignore_models,
+                               using=self._state.db or "default")
+        return weights[0][1] if weights else 0
 
+    def related_tags(self, k=10):
+        """
+        Return up to `k` tags that most often share items with this one,
+        best first, each with a `related_score`, as last computed by
+        tagman.related.refresh_related_tags
+        """
+        related = []
+        for row in self.related_scores.select_related("related")\
+                .order_by("-score", "related")[:k]:
+            row.related.related_score = row.score
+            related.append(row.related)
+        return related
+
+    @instrumented("Tag.unique_item_set")
     def unique_item_set(self, limit=None, only_auto=False, models=None,
                         ignore_models=None, filter_dict=None):
         """
         Return the unique item set for a tag.
 
         :param models:
-            Return only instances from these models. If absent, retrieve any
-            model that has a foreign key to Tag
+            Return only instances from these models. If absent, retrieve
+            every registered TaggedItem model
         :param ignore_models:
             Do not retrieve instances of these models
+
+        Note `limit` applies to each model; see iter_unique_items for an
+        ordered stream with an overall limit.
         """
         item_set = set()
         tagged_items = self.tagged_items(only_auto=only_auto,
@@ -282,21 +693,83 @@ class Tag(models.Model):
 
         return item_set
 
+    def iter_unique_items(self, order_by="pk", limit=None, cursor=None,
+                          only_auto=False, models=None, ignore_models=None,
+                          filter_dict=None, chunk_size=1000):
+        """
+        Return a generator of the items tagged with this tag, from all
+        models, merged into one sequence ordered by `order_by` (a field
+        every model has, "-" prefixed for descending) and stopping after
+        `limit` items overall. Each model is read `chunk_size` rows at a
+        time. See tagman.streaming for `cursor`.
+
+        `models`, `ignore_models` and `filter_dict` are as for
+        unique_item_set.
+        """
+        tagged_items = self.tagged_items(only_auto=only_auto,
+                                         models=models,
+                                         ignore_models=ignore_models)
+        querysets = [model_set.filter(**filter_dict) if filter_dict
+                     else model_set.all()
+                     for model_set in tagged_items.values() if model_set]
+        return merge_querysets(querysets, order_by, limit, cursor,
+                               chunk_size)
+
+    @instrumented("Tag.unique_item_page", rows=lambda page: len(page[0]))
+    def unique_item_page(self, limit, cursor=None, order_by="pk", **kwargs):
+        """
+        Return a page of at most `limit` items, as iter_unique_items, and
+        a cursor token for the next page, or None if this is the last.
+        """
+        items = list(self.iter_unique_items(order_by, limit + 1, cursor,
+                                            **kwargs))
+        if len(items) <= limit:
+            return items, None
+        items = items[:limit]
+        return items, encode_cursor(cursor_for(items[-1], order_by))
+
+    @classmethod
+    def items_tagged(cls, all_of=(), any_of=(), none_of=(), auto_tags=False,
+                     models=None, ignore_models=None):
+        """
+        Return a dictionary, keyed on model name, of lazy querysets of the
+        items of each tagged model that match the tag conditions; see
+        TaggedItemQuerySet.tagged. `models` and `ignore_models` are as for
+        tagged_items.
+        """
+        if models is None:
+            models = registry.models()
+        ignore_models = set(ignore_models or [])
+        conditions = _tagged_conditions(all_of, any_of, none_of)
+        return dict((model.__name__.lower(),
+                     TaggedItemQuerySet(model)._tagged(conditions, auto_tags))
+                    for model in models if model not in ignore_models)
+
     @classmethod
+    @instrumented("Tag.tag_for_string")
     def tag_for_string(cls, s):
         """
         Given a tag representation as "[*]GRP:NAME", return
-        the tag instance.
+        the tag instance. Raises Tag.DoesNotExist if either the group or
+        the tag is missing.
 
-        @todo: handle the [TagGroup|Tag].DoesNotExist exceptions
+        Resolved tags are cached (see tagman.cache) so repeat lookups
+        usually need no query.
         """
-        s = s.strip('* ')  # representation of system group prefixed *
-        groupname, tagname = s.split(TAG_SEPARATOR)
-        try:
-            grp = TagGroup.objects.get(name=groupname)
-            tag = Tag.objects.get(name=tagname, group=grp)
-        except TagGroup.DoesNotExist:
-            raise Tag.DoesNotExist()
+        # representation of system group prefixed *
+        _, groupname, tagname = _parse_tag_string(s)
+        if _vocabulary_snapshot_enabled():
+            values = vocabulary_snapshot().vocabulary().tag_for_names(
+                groupname, tagname)
+            if values is not None:
+                return Tag.from_cache_values(values)
+        key = _cache_key(groupname, tagname)
+        values = tag_cache().get(key)
+        if values is not None:
+            return Tag.from_cache_values(values)
+
+        tag = Tag.objects.get(name=tagname, group__name=groupname)
+        tag_cache().set(key, tag.cache_values())
         return tag
 
     @classmethod
@@ -305,6 +778,10 @@ class Tag(models.Model):
         Like get_or_create on a manager but driven by distinct strings and
         creates the TagGroup if required.
         """
+        return cls._get_or_create(group_name, tag_name, system)[0]
+
+    @classmethod
+    def _get_or_create(cls, group_name, tag_name, system=False):
         group, _ = TagGroup.objects.get_or_create(name=group_name,
                                                   system=system)
         tag, created = Tag.objects.get_or_create(name=tag_name,
@@ -317,19 +794,37 @@ class Tag(models.Model):
         elif tag.archived:
             tag.archived = False
             tag.save()
-        return tag
+        return tag, created
 
     @classmethod
+    @instrumented("Tag.get_or_create_tag_for_string")
     def get_or_create_tag_for_string(cls, s):
         """
         Given a tag representation as "[*]GRP:NAME", return the tag
         instance.
         """
-        group, name = s.strip('* ').split(':')
-        is_system = True if s.strip()[0] == '*' else False
-        return Tag.get_or_create(group, name, is_system)
+        is_system, group, name = _parse_tag_string(s)
+        key = _cache_key(group, name)
+        values = tag_cache().get(key)
+        if values is not None:
+            tag = Tag.from_cache_values(values)
+            # archived tags and system flag mismatches take the slow path
+            # so that get_or_create can deal with them, as do tags the
+            # cache has not seen deleted, renamed or archived elsewhere;
+            # the caller is about to point rows at the tag
+            if not tag.archived and tag.group_is_system == is_system and \
+                    _validate_cached_tags([tag]) == [tag]:
+                return tag
+
+        tag, created = Tag._get_or_create(group, name, is_system)
+        # a new tag is not cached until it is next looked up, which keeps
+        # tags from a transaction that is rolled back out of the cache
+        if not created:
+            tag_cache().set(key, tag.cache_values())
+        return tag
 
     @classmethod
+    @instrumented("Tag.tags_for_string")
     def tags_for_string(cls, s):
         """
         Given a comma delimited list of tag string representations, e.g.::
@@ -337,14 +832,757 @@ class Tag(models.Model):
         <GRP>:<NAME>,<GRP>:<NAME2>...
 
         return the list of tag instances that these represent.
-        @todo: handle case where no tag instance returned
+
+        Raises Tag.DoesNotExist naming every token that is not found; use
+        resolve_tag_strings to get them back instead.
         """
         tokens = s.strip().split(',')
-        _tags = [Tag.tag_for_string(t) for t in tokens]
+        _tags, missing = Tag.resolve_tag_strings(tokens)
+        if missing:
+            raise Tag.DoesNotExist("Tags not found: {0}".format(
+                ", ".join(missing)))
         if not _tags:
             return None
         return _tags
 
+    @classmethod
+    @instrumented("Tag.resolve_tag_strings")
+    def resolve_tag_strings(cls, strings):
+        """
+        Resolve a list of "[*]GRP:NAME" strings in one query (per hundred
+        uncached strings) and return a TagResolution of the tags found, in
+        input order, and the strings that are malformed or not found.
+        """
+        keys = []
+        for s in strings:
+            try:
+                _, group_name, name = _parse_tag_string(s)
+            except ValueError:
+                keys.append(None)
+            else:
+                keys.append((group_name, name))
+
+        found = cls._resolve_keys(set(keys) - set([None]))
+        tags, missing = [], []
+        for s, key in zip(strings, keys):
+            if key in found:
+                tags.append(found[key])
+            else:
+                missing.append(s)
+        return TagResolution(tags, missing)
+
+    @classmethod
+    def _resolve_keys(cls, keys, validate=False):
+        """
+        Return a dictionary of Tag keyed on (group name, tag name), from the
+        vocabulary snapshot, if enabled, or the tag string cache where
+        possible. With validate = True tags found there are checked
+        against the database, with one query, and fetched again if stale.
+        """
+        found = {}
+        if _vocabulary_snapshot_enabled():
+            vocabulary = vocabulary_snapshot().vocabulary()
+            for key in keys:
+                values = vocabulary.tag_for_names(*key)
+                if values is not None:
+                    found[key] = Tag.from_cache_values(values)
+        for key in set(keys) - set(found):
+            values = tag_cache().get(_cache_key(*key))
+            if values is not None:
+                found[key] = Tag.from_cache_values(values)
+        if validate and found:
+            valid = set(tag.pk for tag in
+                        _validate_cached_tags(found.values()))
+            found = dict((key, tag) for key, tag in found.items()
+                         if tag.pk in valid)
+
+        fetched = _fetch_tags(set(keys) - set(found))
+        for key, tag in fetched.items():
+            tag_cache().set(_cache_key(*key), tag.cache_values())
+        found.update(fetched)
+        return found
+
+    @classmethod
+    @instrumented("Tag.get_or_create_tags_for_strings")
+    def get_or_create_tags_for_strings(cls, strings):
+        """
+        Batch form of get_or_create_tag_for_string: return the tags for a
+        list of "[*]GRP:NAME" strings, in input order, creating missing
+        groups and tags with bulk_create and un-archiving archived tags.
+        """
+        parsed = [_parse_tag_string(s) for s in strings]
+        keys = [(group_name, name) for _, group_name, name in parsed]
+        found = cls._resolve_keys(set(keys), validate=True)
+
+        archived = [tag for tag in found.values() if tag.archived]
+        if archived:
+            Tag.objects.filter(pk__in=[t.pk for t in archived])\
+                .update(archived=False)
+            for tag in archived:
+                tag.archived = False
+            tag_cache().invalidate(tag_ids=[tag.pk for tag in archived])
+
+        missing = OrderedDict()
+        for is_system, group_name, name in parsed:
+            if (group_name, name) not in found:
+                missing.setdefault((group_name, name), is_system)
+        if missing:
+            group_names = set(group_name for group_name, _ in missing)
+            groups = _match_rows(group_names, dict(
+                (g.name, g) for g in
+                TagGroup.objects.filter(name__in=group_names)))
+            new_groups, new_group_ids = OrderedDict(), []
+            for (group_name, _), is_system in missing.items():
+                if group_name not in groups:
+                    new_groups.setdefault(group_name, TagGroup(
+                        name=group_name, slug=slugify(group_name),
+                        system=is_system))
+            if new_groups:
+                TagGroup.objects.bulk_create(new_groups.values())
+                created = TagGroup.objects.filter(name__in=new_groups.keys())
+                groups.update((g.name, g) for g in created)
+                new_group_ids = [g.pk for g in created]
+
+            Tag.objects.bulk_create([
+                Tag(name=name, slug=slugify(name), group=groups[group_name],
+                    group_name=unicode(groups[group_name]),
+                    group_slug=groups[group_name].slug,
+                    group_is_system=groups[group_name].system)
+                for group_name, name in missing])
+            logger.debug("Created {0} tags via get_or_create_tags_for_strings"
+                         .format(len(missing)))
+            created = _fetch_tags(missing.keys())
+            tag_cache().invalidate(
+                tag_ids=[tag.pk for tag in created.values()],
+                group_ids=new_group_ids)
+            found.update(created)
+
+        return [found[key] for key in keys]
+
+    @classmethod
+    def bulk_delete(cls, tag_ids, using="default", dry_run=False):
+        """
+        Delete the tags with `tag_ids`, first removing their rows from every
+        tagged model's through-tables with one DELETE per table, so that
+        Django's collector does not load them into memory.
+
+        Returns a dict of the number of through rows removed per model
+        label. With dry_run = True nothing is deleted; the rows are counted.
+        """
+        tag_ids = list(tag_ids)
+        counts = {}
+        if not tag_ids:
+            return counts
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        with _commit_on_success(using):
+            if not dry_run:
+                items = _tag_strings_items(using, tag_ids)
+            cursor = connection.cursor()
+            for relation in registry.relations():
+                if dry_run:
+                    removed = relation.through._default_manager.using(using)\
+                        .filter(**{relation.tag_field + "__in": tag_ids})\
+                        .count()
+                else:
+                    cursor.execute(
+                        "DELETE FROM {0} WHERE {1} IN ({2})".format(
+                            qn(relation.through._meta.db_table),
+                            qn(relation.field.m2m_reverse_name()),
+                            ", ".join(["%s"] * len(tag_ids))),
+                        tag_ids)
+                    removed = cursor.rowcount
+                label = _model_label(relation.model)
+                counts[label] = counts.get(label, 0) + removed
+            if not dry_run:
+                transaction.set_dirty(using=using)
+                with _deleting_tags_in_bulk() as cache_keys:
+                    cls.objects.using(using).filter(pk__in=tag_ids).delete()
+                _refresh_items_tag_strings(items, using)
+        if not dry_run:
+            tag_cache().invalidate(cache_keys, tag_ids=tag_ids)
+        return counts
+
+    @classmethod
+    def merge(cls, sources, target, archive=False, using="default",
+              dry_run=False):
+        """
+        Move every item of the `sources`, Tag instances and/or "[*]GRP:NAME"
+        strings, to the `target` tag or string, in the `tags` and
+        `auto_tags` of every tagged model, then delete the sources or, with
+        archive = True, archive them.
+
+        Each model's through rows are moved by set-based SQL in one
+        transaction, skipping items that already have the target. Returns
+        a dict of the number of rows added to the target per model label;
+        with dry_run = True nothing is changed and the rows are counted.
+        """
+        if not isinstance(target, Tag):
+            target = cls.tag_for_string(target)
+        source_ids, missing = _tag_ids(sources)
+        if missing:
+            raise cls.DoesNotExist("Tags to merge not found")
+        source_ids.discard(target.pk)
+        source_ids = sorted(source_ids)
+        counts = {}
+        if not source_ids:
+            return counts
+
+        items = [] if dry_run else _tag_strings_items(using, source_ids)
+        for model in registry.models():
+            label = _model_label(model)
+            with _commit_on_success(using):
+                for relation in registry.relations(models=[model]):
+                    counts[label] = counts.get(label, 0) + _merge_tag_rows(
+                        relation, source_ids, target.pk, using, dry_run)
+        if dry_run:
+            return counts
+
+        tags_merged.send(sender=cls, source_ids=source_ids,
+                         target_id=target.pk, using=using)
+        cache_keys = []
+        if archive:
+            cls.objects.using(using).filter(pk__in=source_ids)\
+                .update(archived=True)
+        else:
+            # with no through rows left to collect
+            with _deleting_tags_in_bulk() as cache_keys:
+                cls.objects.using(using).filter(pk__in=source_ids).delete()
+        _refresh_items_tag_strings(items, using)
+        tag_cache().invalidate(cache_keys, tag_ids=source_ids + [target.pk])
+        logger.info("Merged tags {0} into {1!r}".format(source_ids, target))
+        return counts
+
+
+def _send_tag_rows_changed(relation, action, rows, tags, items, using):
+    """
+    Send m2m_changed for through `rows`, a set of (item id, tag id),
+    written in bulk. One signal is sent per tag, from the reverse side,
+    unless `items` holds the instances and there are fewer items than tags.
+    """
+    through = relation.through
+    if items and len(items) < len(tags):
+        by_item = {}
+        for item_id, tag_id in rows:
+            by_item.setdefault(item_id, set()).add(tag_id)
+        for item_id, tag_ids in by_item.items():
+            m2m_changed.send(sender=through, action=action,
+                             instance=items[item_id], reverse=False,
+                             model=Tag, pk_set=tag_ids, using=using)
+    else:
+        by_tag = {}
+        for item_id, tag_id in rows:
+            by_tag.setdefault(tag_id, set()).add(item_id)
+        for tag_id, item_ids in by_tag.items():
+            m2m_changed.send(sender=through, action=action,
+                             instance=tags[tag_id], reverse=True,
+                             model=relation.model, pk_set=item_ids,
+                             using=using)
+
+
+def _existing_tag_rows(relation, item_ids, tag_ids=None, using="default"):
+    """
+    Return the set of (item id, tag id) through rows of `relation` for the
+    given items, optionally restricted to the given tags
+    """
+    item_field, tag_field = relation.item_field, relation.tag_field
+    rows = set()
+    for ids in _chunks(item_ids, 500):
+        through_rows = relation.through._default_manager.using(using)\
+            .filter(**{item_field + "__in": ids})
+        if tag_ids is not None:
+            through_rows = through_rows.filter(**{tag_field + "__in": tag_ids})
+        rows.update(through_rows.values_list(item_field, tag_field))
+    return rows
+
+
+def _delete_tag_rows(relation, rows, using="default", chunk_size=400):
+    """
+    Delete the through `rows` of `relation`, a set of (item id, tag id).
+    When `rows` are every pair of their items and tags, as when removing
+    tags from many items, one DELETE per chunk of items and of tags does;
+    otherwise one is run per item, or per tag if there are fewer tags.
+    """
+    field = relation.field
+    qn = connections[using].ops.quote_name
+    table = qn(field.m2m_db_table())
+    columns = (qn(field.m2m_column_name()), qn(field.m2m_reverse_name()))
+    item_ids = set(item_id for item_id, _ in rows)
+    tag_ids = set(tag_id for _, tag_id in rows)
+
+    if len(rows) == len(item_ids) * len(tag_ids):
+        groups = [(items, tags) for items in _chunks(item_ids, chunk_size)
+                  for tags in _chunks(tag_ids, chunk_size)]
+    else:
+        side = 0 if len(item_ids) <= len(tag_ids) else 1
+        by_key = {}
+        for row in rows:
+            by_key.setdefault(row[side], []).append(row[1 - side])
+        groups = []
+        for key, others in by_key.items():
+            for chunk in _chunks(others, chunk_size):
+                groups.append(([key], chunk) if side == 0 else
+                              (chunk, [key]))
+
+    cursor = connections[using].cursor()
+    for items, tags in groups:
+        cursor.execute(
+            "DELETE FROM {0} WHERE {1} IN ({2}) AND {3} IN ({4})".format(
+                table, columns[0], ", ".join(["%s"] * len(items)),
+                columns[1], ", ".join(["%s"] * len(tags))),
+            list(items) + list(tags))
+    transaction.set_dirty(using=using)
+
+
+def _merge_tag_rows(relation, source_ids, target_id, using="default",
+                    dry_run=False):
+    """
+    Move the through rows of `relation` from the tags `source_ids` to
+    `target_id` with one INSERT ... SELECT, skipping items that have the
+    target already, and one DELETE, keeping TagUsage counters and stale
+    related tags current. Returns the number of rows added.
+    """
+    field = relation.field
+    qn = connections[using].ops.quote_name
+    table = qn(field.m2m_db_table())
+    item, tag = qn(field.m2m_column_name()), qn(field.m2m_reverse_name())
+    rows = relation.through._default_manager.using(using)
+    sources = rows.filter(**{relation.tag_field + "__in": source_ids})
+    placeholders = ", ".join(["%s"] * len(source_ids))
+
+    if dry_run:
+        return sources.exclude(**{relation.item_field + "__in": rows.filter(
+            **{relation.tag_field: target_id}).values(relation.item_field)})\
+            .values(relation.item_field).distinct().count()
+
+    if _usage_counters_enabled():
+        deltas = dict((tag_id, -count) for tag_id, count in
+                      sources.values_list(relation.tag_field)
+                      .annotate(Count("pk")).order_by())
+    if _related_tags_enabled() and not relation.auto:
+        _mark_related_tags_stale(
+            relation, list(sources.values_list(relation.item_field,
+                                               flat=True).distinct()),
+            source_ids + [target_id], using)
+
+    cursor = connections[using].cursor()
+    cursor.execute(
+        "INSERT INTO {table} ({item}, {tag}) "
+        "SELECT DISTINCT s.{item}, %s FROM {table} s "
+        "WHERE s.{tag} IN ({ids}) AND NOT EXISTS "
+        "(SELECT 1 FROM {table} t WHERE t.{item} = s.{item} "
+        "AND t.{tag} = %s)".format(table=table, item=item, tag=tag,
+                                  ids=placeholders),
+        [target_id] + source_ids + [target_id])
+    added = cursor.rowcount
+    cursor.execute("DELETE FROM {0} WHERE {1} IN ({2})".format(
+        table, tag, placeholders), source_ids)
+    transaction.set_dirty(using=using)
+
+    if _usage_counters_enabled():
+        deltas[target_id] = added
+        TagUsage.objects.adjust(relation.model, relation.auto, deltas, using)
+    return added
+
+
+# set while _change_tag_rows sends m2m_changed for rows it writes in bulk;
+# handlers that write to the database leave the work to it, which knows
+# every row at once
+_bulk_tag_rows = threading.local()
+
+
+@contextmanager
+def _writing_tag_rows_in_bulk():
+    _bulk_tag_rows.active = True
+    try:
+        yield
+    finally:
+        _bulk_tag_rows.active = False
+
+
+def _change_tag_rows(relation, add, remove, tags, items=None,
+                     using="default"):
+    """
+    Insert the `add` and delete the `remove` through rows of `relation`, each
+    a set of (item id, tag id), with one bulk_create and set-based deletes
+    (see _delete_tag_rows), sending m2m_changed as Django's related
+    managers would, then rewrite the tag strings of all the items, for
+    TagStringsMixin models, and adjust the TagUsage counters of all the
+    rows.
+    """
+    through = relation.through
+    item_field, tag_field = relation.item_field, relation.tag_field
+    with _commit_on_success(using), _writing_tag_rows_in_bulk():
+        if remove:
+            _send_tag_rows_changed(relation, "pre_remove", remove, tags, items,
+                                   using)
+            _delete_tag_rows(relation, remove, using)
+            _send_tag_rows_changed(relation, "post_remove", remove, tags,
+                                   items, using)
+        if add:
+            _send_tag_rows_changed(relation, "pre_add", add, tags, items,
+                                   using)
+            through._default_manager.using(using).bulk_create([
+                through(**{item_field + "_id": item_id,
+                           tag_field + "_id": tag_id})
+                for item_id, tag_id in add], batch_size=500)
+            _send_tag_rows_changed(relation, "post_add", add, tags, items,
+                                   using)
+        if issubclass(relation.model, TagStringsMixin) and (add or remove):
+            written = refresh_tag_strings(
+                relation.model, set(item_id for item_id, _ in add | remove),
+                relation.auto, using)
+            field = _tag_strings_field(relation.auto)
+            for item_id, item in (items or {}).items():
+                if (item_id, field) in written:
+                    setattr(item, field, written[(item_id, field)])
+        if _usage_counters_enabled():
+            deltas = {}
+            for rows, delta in ((add, 1), (remove, -1)):
+                for _, tag_id in rows:
+                    deltas[tag_id] = deltas.get(tag_id, 0) + delta
+            TagUsage.objects.adjust(relation.model, relation.auto, deltas,
+                                    using)
+
+
+def _bulk_tag(model, item_ids, strings, auto_tag=False, mode="add",
+              items=None, using="default"):
+    """
+    Add, remove or set ("add", "remove", "set") the tags for `strings` on
+    every item in `item_ids` and return the tags. Tags are resolved, or
+    for add and set created, in bulk; see _change_tag_rows for the writes.
+    """
+    relation = registry.relation(model, auto_tag)
+    if mode == "remove":
+        tags = Tag.resolve_tag_strings(strings).tags
+    else:
+        tags = Tag.get_or_create_tags_for_strings(strings)
+    by_id = dict((tag.pk, tag) for tag in tags)
+    wanted = set((item_id, tag_id) for item_id in item_ids for tag_id in by_id)
+
+    if mode == "set":
+        existing = _existing_tag_rows(relation, item_ids, using=using)
+        by_id.update((tag.pk, tag) for tag in Tag.objects.using(using).filter(
+            pk__in=set(tag_id for _, tag_id in existing) - set(by_id)))
+        add, remove = wanted - existing, existing - wanted
+    else:
+        existing = _existing_tag_rows(relation, item_ids, by_id.keys(),
+                                      using)
+        if mode == "add":
+            add, remove = wanted - existing, set()
+        else:
+            add, remove = set(), existing
+
+    _change_tag_rows(relation, add, remove, by_id, items, using)
+    return tags
+
+
+def _tag_ids(tags):
+    """
+    Return the set of ids for a list of Tag instances and/or tag strings,
+    and whether any string did not resolve to a tag
+    """
+    ids = set(tag.pk for tag in tags if isinstance(tag, Tag))
+    strings = [tag for tag in tags if not isinstance(tag, Tag)]
+    if not strings:
+        return ids, False
+    resolution = Tag.resolve_tag_strings(strings)
+    ids.update(tag.pk for tag in resolution.tags)
+    return ids, bool(resolution.missing)
+
+
+def _tagged_conditions(all_of, any_of, none_of):
+    """
+    Return the (all, any, none) tag id sets for TaggedItemQuerySet.tagged,
+    or None if the conditions cannot match any item
+    """
+    all_ids, all_missing = _tag_ids(all_of)
+    any_ids, _ = _tag_ids(any_of)
+    none_ids, _ = _tag_ids(none_of)
+    if all_missing or (any_of and not any_ids):
+        return None
+    return all_ids, any_ids, none_ids
+
+
+def _tagged_where(model, all_ids, any_ids, none_ids, auto_tags, using):
+    """
+    Return (where clauses, params) restricting `model` to items that have
+    every tag in `all_ids`, at least one in `any_ids` and none in
+    `none_ids`, using GROUP BY / HAVING COUNT on the through-tables.
+    """
+    qn = connections[using].ops.quote_name
+    relations = registry.relations(models=[model],
+                                   auto=None if auto_tags else False)
+    if not relations:
+        # no rows: nothing has any tag
+        return (["1 = 0"] if all_ids or any_ids else []), []
+    rows = " UNION ".join(
+        "SELECT {0} AS item_id, {1} AS tag_id FROM {2}".format(
+            qn(r.field.m2m_column_name()), qn(r.field.m2m_reverse_name()),
+            qn(r.through._meta.db_table))
+        for r in relations)
+    source = "({0}) tagman_rows".format(rows)
+    pk = "{0}.{1}".format(qn(model._meta.db_table), qn(model._meta.pk.column))
+
+    def _in(ids):
+        return ", ".join(["%s"] * len(ids)), list(ids)
+
+    where, params = [], []
+    if all_ids:
+        placeholders, ids = _in(all_ids)
+        where.append(
+            "{0} IN (SELECT item_id FROM {1} WHERE tag_id IN ({2}) "
+            "GROUP BY item_id HAVING COUNT(DISTINCT tag_id) = %s)".format(
+                pk, source, placeholders))
+        params.extend(ids + [len(ids)])
+    if any_ids:
+        placeholders, ids = _in(any_ids)
+        where.append("{0} IN (SELECT item_id FROM {1} WHERE tag_id IN ({2}))"
+                     .format(pk, source, placeholders))
+        params.extend(ids)
+    if none_ids:
+        placeholders, ids = _in(none_ids)
+        where.append(
+            "{0} NOT IN (SELECT item_id FROM {1} WHERE tag_id IN ({2}))"
+            .format(pk, source, placeholders))
+        params.extend(ids)
+    return where, params
+
+
+def tag_facets(queryset, top=None, system=False, archived=False,
+               auto_tag=False):
+    """
+    Return the TagGroupFacets of the tags of the items in `queryset`, of a
+    TaggedItem model, heaviest group first, each with the TagFacets of its
+    `top` (default all) most used tags, heaviest first.
+
+    The counts come from one query grouping the through-table rows of the
+    items by tag; the de-normalised group fields of Tag are used, so
+    TagGroup is not joined. As with TagManager, only system tags are
+    counted if `system`, otherwise only public ones, and only archived
+    tags if `archived`, otherwise only current ones. `auto_tag` counts
+    `auto_tags` instead of `tags`.
+    """
+    if isinstance(queryset, EmptyQuerySet):
+        # which would be dropped from the filter below, matching every item
+        return []
+    relation = registry.relation(queryset.model, auto_tag)
+    tag = relation.tag_field
+    rows = relation.through._default_manager.using(queryset.db)\
+        .filter(**{relation.item_field + "__in": queryset.values("pk"),
+                   tag + "__group_is_system": system,
+                   tag + "__archived": archived})\
+        .values(tag, tag + "__name", tag + "__slug", tag + "__group_name",
+                tag + "__group_slug")\
+        .annotate(count=Count("pk")).order_by()
+
+    groups = {}
+    for row in rows:
+        key = (row[tag + "__group_name"], row[tag + "__group_slug"])
+        groups.setdefault(key, []).append(TagFacet(
+            row[tag], row[tag + "__name"], row[tag + "__slug"],
+            row["count"]))
+
+    facets = []
+    for (group_name, group_slug), tags in groups.items():
+        tags.sort(key=lambda facet: (-facet.count, facet.name))
+        facets.append(TagGroupFacet(
+            group_name, group_slug, system,
+            sum(facet.count for facet in tags),
+            tags[:top] if top is not None else tags))
+    facets.sort(key=lambda facet: (-facet.count, facet.name))
+    return facets
+
+
+def _prefetch_tags(model, items, using):
+    """
+    Load the `tags` and `auto_tags` of `items`, instances of `model`, with
+    one query per field, into the prefetch cache their related managers
+    read from, as prefetch_related would. Only the tag table's own columns
+    are read; groups are built from the de-normalised fields when needed.
+    """
+    if not items:
+        return
+    qn = connections[using].ops.quote_name
+    item_ids = [item.pk for item in items]
+    for relation in registry.relations(models=[model]):
+        field = relation.field
+        item_column = "{0}.{1}".format(qn(field.m2m_db_table()),
+                                       qn(field.m2m_column_name()))
+        rows = Tag.objects.using(using).filter(**{
+            field.related_query_name() + "__pk__in": item_ids
+        }).extra(select={"_tagman_item_id": item_column})\
+            .values_list("_tagman_item_id", *Tag.CACHE_FIELDS)
+        by_item = {}
+        for row in rows:
+            by_item.setdefault(row[0], []).append(
+                Tag.from_cache_values(row[1:] + (using,)))
+        for item in items:
+            queryset = getattr(item, field.name).all()
+            queryset._result_cache = by_item.get(item.pk, [])
+            queryset._prefetch_done = True
+            if not hasattr(item, "_prefetched_objects_cache"):
+                item._prefetched_objects_cache = {}
+            item._prefetched_objects_cache[field.name] = queryset
+
+
+def _iter_with_tags(model, items, using, chunk_size=500):
+    """
+    Yield `items`, prefetching the tags of each `chunk_size` of them
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            _prefetch_tags(model, chunk, using)
+            for prefetched in chunk:
+                yield prefetched
+            chunk = []
+    _prefetch_tags(model, chunk, using)
+    for prefetched in chunk:
+        yield prefetched
+
+
+class TaggedItemQuerySet(QuerySet):
+    """
+    QuerySet for TaggedItem models, adding tag queries and bulk tagging of
+    every item
+    """
+    _with_tags = False
+
+    def _clone(self, *args, **kwargs):
+        clone = super(TaggedItemQuerySet, self)._clone(*args, **kwargs)
+        clone._with_tags = kwargs.get("_with_tags", self._with_tags)
+        return clone
+
+    def iterator(self):
+        items = super(TaggedItemQuerySet, self).iterator()
+        if self._with_tags:
+            return _iter_with_tags(self.model, items, self.db)
+        return items
+
+    def with_tags(self):
+        """
+        Return a queryset whose items come with their `tags` and `auto_tags`
+        loaded, using one query per field for each chunk of items, so that
+        `item.tags.all()`, `all_tag_groups()` and `self_auto_tag` need no
+        further queries. Tag groups are not joined.
+        """
+        return self._clone(_with_tags=True)
+
+    def tag_facets(self, top=None, system=False, archived=False,
+                   auto_tag=False):
+        """
+        Return the tag counts of the items in this queryset, by group; see
+        tag_facets
+        """
+        return tag_facets(self, top, system, archived, auto_tag)
+
+    def tagged(self, all_of=(), any_of=(), none_of=(), auto_tags=False):
+        """
+        Return a queryset of the items that have all of the tags in
+        `all_of`, at least one of those in `any_of` and none of those in
+        `none_of`. Each is a list of Tag instances and/or "[*]GRP:NAME"
+        strings; strings that are not tags match no item.
+
+        Only `tags` are considered unless auto_tags = True, in which case
+        `auto_tags` count as well.
+
+        The tag conditions are compiled into subqueries of the one SQL
+        statement, which is not run until the queryset is evaluated.
+        """
+        return self._tagged(_tagged_conditions(all_of, any_of, none_of),
+                            auto_tags)
+
+    def _tagged(self, conditions, auto_tags):
+        if conditions is None:
+            return self.none()
+        all_ids, any_ids, none_ids = conditions
+        where, params = _tagged_where(self.model, all_ids, any_ids, none_ids,
+                                      auto_tags, self.db)
+        if not where:
+            return self._clone()
+        return self.extra(where=where, params=params)
+
+    def add_tag_strs(self, strings, auto_tag=False):
+        """
+        Add the tags for `strings`, creating any that are missing, to every
+        item in this queryset. Returns the tags.
+        """
+        return _bulk_tag(self.model, list(self.values_list("pk", flat=True)),
+                         strings, auto_tag, "add", using=self.db)
+
+    def remove_tag_strs(self, strings, auto_tag=False):
+        """
+        Remove the tags for `strings` from every item in this queryset.
+        Strings that do not resolve to a tag are ignored.
+        """
+        return _bulk_tag(self.model, list(self.values_list("pk", flat=True)),
+                         strings, auto_tag, "remove", using=self.db)
+
+    def set_tag_strs(self, strings, auto_tag=False):
+        """
+        Make the tags for `strings` the only tags of every item in this
+        queryset, creating any that are missing. Returns the tags.
+        """
+        return _bulk_tag(self.model, list(self.values_list("pk", flat=True)),
+                         strings, auto_tag, "set", using=self.db)
+
+    def tag_strings_contain(self, string, auto_tag=False):
+        """
+        Return the items whose de-normalised tag strings, or auto tag
+        strings, include the "[*]GRP:NAME" `string`, without joining the
+        tags; for models using TagStringsMixin. Matching follows the
+        database's case sensitivity for LIKE.
+        """
+        return self.filter(**{_tag_strings_field(auto_tag) + "__contains":
+                              json.dumps(string)})
+
+
+class TaggedItemManager(models.Manager):
+    """
+    Default manager for TaggedItem models. If you give your model another
+    manager, base its queryset on TaggedItemQuerySet to keep these methods.
+    """
+    def get_query_set(self):
+        return TaggedItemQuerySet(self.model, using=self._db)
+
+    def tagged(self, *args, **kwargs):
+        return self.get_query_set().tagged(*args, **kwargs)
+
+    def with_tags(self):
+        return self.get_query_set().with_tags()
+
+    def tag_facets(self, *args, **kwargs):
+        return self.get_query_set().tag_facets(*args, **kwargs)
+
+    def add_tag_strs(self, *args, **kwargs):
+        return self.get_query_set().add_tag_strs(*args, **kwargs)
+
+    def remove_tag_strs(self, *args, **kwargs):
+        return self.get_query_set().remove_tag_strs(*args, **kwargs)
+
+    def set_tag_strs(self, *args, **kwargs):
+        return self.get_query_set().set_tag_strs(*args, **kwargs)
+
+    def tag_strings_contain(self, *args, **kwargs):
+        return self.get_query_set().tag_strings_contain(*args, **kwargs)
+
+
+def _group_from_tag(tag):
+    """
+    Return the TagGroup of `tag` built, without a query, from its
+    de-normalised fields
+    """
+    name = tag.group_name
+    if tag.group_is_system and name.startswith("*"):
+        name = name[1:]
+    group = TagGroup(id=tag.group_id, name=name, slug=tag.group_slug,
+                     system=tag.group_is_system)
+    group._state.adding = False
+    group._state.db = tag._state.db
+    return group
+
 
 class TaggedItem(models.Model):
     """
@@ -359,6 +1597,8 @@ class TaggedItem(models.Model):
         related_name="%(class)s_auto_tagged_set",
         blank=True, editable=False)
 
+    objects = TaggedItemManager()
+
     class Meta:
         abstract = True
 
@@ -373,14 +1613,190 @@ class TaggedItem(models.Model):
         tags.add(tag)
         return tag
 
+    def _prefetched_tags(self, auto_tag=False):
+        """
+        Return the list of tags (or auto_tags) loaded by with_tags, or None
+        """
+        cache = getattr(self, "_prefetched_objects_cache", {})
+        queryset = cache.get("auto_tags" if auto_tag else "tags")
+        return None if queryset is None else list(queryset)
+
+    def _bulk_tag(self, strings, auto_tag, mode):
+        # the bulk writes bypass the related manager, so forget any
+        # prefetched tags rather than serve stale ones
+        getattr(self, "_prefetched_objects_cache", {}).pop(
+            "auto_tags" if auto_tag else "tags", None)
+        return _bulk_tag(self.__class__, [self.pk], strings, auto_tag, mode,
+                         items={self.pk: self}, using=self._state.db)
+
+    def add_tag_strs(self, strings, auto_tag=False):
+        """
+        Create tags from a list of strings, in bulk, and add them to tags
+        (or to auto_tags if auto_tag = True). Returns the tags.
+        """
+        return self._bulk_tag(strings, auto_tag, "add")
+
+    def remove_tag_strs(self, strings, auto_tag=False):
+        """
+        Remove the tags for a list of strings from tags (or from auto_tags
+        if auto_tag = True). Strings that are not tags are ignored.
+        """
+        return self._bulk_tag(strings, auto_tag, "remove")
+
+    def set_tag_strs(self, strings, auto_tag=False):
+        """
+        Replace tags (or auto_tags if auto_tag = True) with the tags for a
+        list of strings, creating them as required. Returns the tags.
+        """
+        return self._bulk_tag(strings, auto_tag, "set")
+
     def all_tag_groups(self, auto_tag=False):
         """
         Return all set of unique tag groups of tags associated with this
         instance. If auto_tag = True, return from the auto_tags list instead
         of tags
         """
-        tags = self.auto_tags if auto_tag else self.tags
-        return set(tag.group for tag in tags.all())
+        tags = self._prefetched_tags(auto_tag)
+        if tags is None:
+            tags = self.auto_tags if auto_tag else self.tags
+            return set(tag.group for tag in tags.select_related("group"))
+        return set(_group_from_tag(tag) for tag in tags)
+
+
+def _rename_tags(renames, using, chunk_size=100):
+    """
+    Rename tags and unarchive them, `renames` mapping tag id to new name,
+    with one UPDATE per chunk
+    """
+    qn = connections[using].ops.quote_name
+    cursor = connections[using].cursor()
+    for chunk in _chunks(sorted(renames.items()), chunk_size):
+        cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        sql = (
+            "UPDATE {table} SET {name} = CASE {id} {cases} END, "
+            "{slug} = CASE {id} {cases} END, {archived} = %s "
+            "WHERE {id} IN ({ids})".format(
+                table=qn(Tag._meta.db_table), name=qn("name"),
+                slug=qn("slug"), archived=qn("archived"), id=qn("id"),
+                cases=cases, ids=", ".join(["%s"] * len(chunk))))
+        params = []
+        for tag_id, name in chunk:
+            params.extend([tag_id, name])
+        for tag_id, name in chunk:
+            params.extend([tag_id, slugify(name)])
+        params.append(False)
+        params.extend(tag_id for tag_id, _ in chunk)
+        cursor.execute(sql, params)
+    transaction.set_dirty(using=using)
+    _refresh_renamed_tag_strings(using, tag_ids=renames.keys())
+
+
+def _auto_tag_items(model, items, using):
+    """
+    Do what associate_auto_tags does for each of `items`, with a fixed
+    number of queries: rename each item's latest stale self-tag, or add
+    the "*<Class>:<name>" tag, created in bulk as required. Returns the
+    number of items tagged and of tags renamed.
+    """
+    relation = registry.relation(model, auto=True)
+    qn = connections[using].ops.quote_name
+    group_name = "*" + model.__name__
+    expected = dict((item.pk, item._make_self_tag_name()) for item in items)
+
+    item_column = "{0}.{1}".format(qn(relation.field.m2m_db_table()),
+                                   qn(relation.field.m2m_column_name()))
+    current = {}
+    for item_id, tag_id, name, archived in Tag.objects.using(using).filter(**{
+            relation.field.related_query_name() + "__pk__in": expected.keys(),
+            "group_name": group_name,
+    }).extra(select={"_tagman_item_id": item_column}).order_by("pk")\
+            .values_list("_tagman_item_id", "pk", "name", "archived"):
+        current.setdefault(item_id, []).append((tag_id, name, archived))
+    taken = set(Tag.objects.using(using).filter(
+        group_name=group_name, name__in=set(expected.values()))
+        .values_list("name", flat=True))
+
+    renames, wanted, renamed_to = {}, {}, set()
+    for item_id, name in expected.items():
+        tags = current.get(item_id)
+        if tags:
+            tag_id, current_name, archived = tags[-1]
+            if current_name == name and not archived:
+                continue
+            if current_name == name or (name not in taken and
+                                        name not in renamed_to):
+                renames[tag_id] = name
+                renamed_to.add(name)
+                continue
+        wanted[item_id] = name
+
+    if renames:
+        _rename_tags(renames, using)
+        tag_cache().invalidate(
+            [_cache_key(group_name, name) for name in renames.values()],
+            tag_ids=renames.keys())
+    if wanted:
+        tags = Tag.get_or_create_tags_for_strings(
+            [_composite_name(group_name, name) for name in wanted.values()])
+        by_name = dict((tag.name, tag) for tag in tags)
+        existing = set((item_id, tag_id)
+                       for item_id, tags in current.items()
+                       for tag_id, _, _ in tags)
+        add = set((item_id, by_name[name].pk)
+                  for item_id, name in wanted.items()) - existing
+        _change_tag_rows(relation, add, set(),
+                         dict((tag.pk, tag) for tag in tags), using=using)
+    return len(wanted), len(renames)
+
+
+class TaggedContentItemQuerySet(TaggedItemQuerySet):
+    """
+    QuerySet for TaggedContentItem models, adding bulk auto-tagging
+    """
+    @instrumented("TaggedContentItemQuerySet.associate_auto_tags",
+                  rows=lambda progress: progress.items)
+    def associate_auto_tags(self, chunk_size=1000, start_after=None,
+                            callback=None):
+        """
+        Auto-tag every item in this queryset as associate_auto_tags does,
+        `chunk_size` items at a time in pk order, each chunk in its own
+        transaction. Iteration starts after pk `start_after`, so that an
+        interrupted run can be resumed.
+
+        `callback` is called with an AutoTagProgress after each chunk; the
+        final one is returned.
+        """
+        using = self.db
+        ordered = self.order_by("pk")
+        progress = AutoTagProgress(0, 0, 0, start_after, 0.0)
+        started = time.time()
+        while True:
+            chunk = ordered
+            if progress.last_pk is not None:
+                chunk = chunk.filter(pk__gt=progress.last_pk)
+            items = list(chunk[:chunk_size])
+            if not items:
+                return progress
+            with _commit_on_success(using):
+                tagged, renamed = _auto_tag_items(self.model, items, using)
+            progress = AutoTagProgress(
+                progress.items + len(items), progress.tagged + tagged,
+                progress.renamed + renamed, items[-1].pk,
+                time.time() - started)
+            logger.debug("Auto-tagged {0} {1} items up to pk {2}".format(
+                progress.items, self.model.__name__, progress.last_pk))
+            if callback is not None:
+                callback(progress)
+            if len(items) < chunk_size:
+                return progress
+
+
+class TaggedContentItemManager(TaggedItemManager):
+    def get_query_set(self):
+        return TaggedContentItemQuerySet(self.model, using=self._db)
+
+    def associate_auto_tags(self, *args, **kwargs):
+        return self.get_query_set().associate_auto_tags(*args, **kwargs)
 
 
 class TaggedContentItem(TaggedItem):
@@ -388,6 +1804,8 @@ class TaggedContentItem(TaggedItem):
     Mixin for models that would have features such as auto-tagging
     enabled.
     """
+    objects = TaggedContentItemManager()
+
     class Meta:
         abstract = True
 
@@ -414,11 +1832,17 @@ class TaggedContentItem(TaggedItem):
         Return the tag instance that is this object's own auto tag
         """
         tag_str = self.self_tag_string
-        my_tag = [t for t in self.auto_tags.all() if str(t) == tag_str]
+        tags = self._prefetched_tags(auto_tag=True)
+        if tags is None:
+            tags = self.auto_tags.filter(
+                group_name="*" + self.__class__.__name__,
+                name=self._make_self_tag_name())
+        my_tag = [t for t in tags if str(t) == tag_str]
         if not my_tag:
             raise Exception("{0} has yet to be auto-tagged".format(self))
         return my_tag[0]
 
+    @instrumented("TaggedContentItem.associate_auto_tags")
     def associate_auto_tags(self):
         """
         Automatically tag myself (by adding to auto_tags):
@@ -455,3 +1879,551 @@ class TaggedContentItem(TaggedItem):
         logger.info("Auto tagging {0} with {1}".format(str(self), repr(tag)))
 
         return tag
+
+
+def _dump_tag_strings(strings):
+    return json.dumps(strings, separators=(",", ":"))
+
+
+class TagStringsMixin(models.Model):
+    """
+    Opt-in mixin for TaggedItem models keeping a copy of the "[*]GRP:NAME"
+    strings of each item's tags and auto tags on its own row, as JSON
+    lists, so that lists of items can render and filter on their tags
+    without joining Tag:
+
+        class Book(TagStringsMixin, TaggedItem):
+            ...
+
+    The copies are rewritten by m2m_changed, when tags and groups are
+    renamed or deleted, and by Tag.merge. Rows written before the mixin was
+    added are filled in by the refresh_tag_strings command. Instances in
+    memory are only updated by changes made through their own `tags` and
+    `auto_tags`.
+    """
+    tag_strings = models.TextField(default="[]", editable=False)
+    auto_tag_strings = models.TextField(default="[]", editable=False)
+
+    class Meta:
+        abstract = True
+
+    def get_tag_strings(self, auto_tag=False):
+        """
+        Return the list of the item's tag strings, or auto tag strings if
+        auto_tag = True, sorted, without a query
+        """
+        return json.loads(self.auto_tag_strings if auto_tag
+                          else self.tag_strings)
+
+
+def _tag_strings_field(auto):
+    return "auto_tag_strings" if auto else "tag_strings"
+
+
+def refresh_tag_strings(model, item_ids, auto=None, using="default",
+                        chunk_size=100):
+    """
+    Rewrite the tag_strings and auto_tag_strings, or only those of
+    `auto_tags` or `tags` if `auto` is True or False, of the `model`
+    items `item_ids` from their through rows, with one query and one
+    UPDATE per chunk of items. Returns a dict of {(item id, field name):
+    JSON written}.
+    """
+    qn = connections[using].ops.quote_name
+    pk = qn(model._meta.pk.column)
+    cursor = connections[using].cursor()
+    written = {}
+    for relation in registry.relations(auto=auto, models=[model]):
+        field = _tag_strings_field(relation.auto)
+        column = qn(model._meta.get_field(field).column)
+        tag = relation.tag_field
+        for ids in _chunks(sorted(set(item_ids)), chunk_size):
+            strings = dict((item_id, []) for item_id in ids)
+            for item_id, group_name, name in relation.through\
+                    ._default_manager.using(using)\
+                    .filter(**{relation.item_field + "__in": ids})\
+                    .values_list(relation.item_field, tag + "__group_name",
+                                 tag + "__name"):
+                strings[item_id].append(_composite_name(group_name, name))
+            params = []
+            for item_id in ids:
+                written[(item_id, field)] = _dump_tag_strings(
+                    sorted(strings[item_id]))
+                params.extend([item_id, written[(item_id, field)]])
+            cursor.execute(
+                "UPDATE {table} SET {column} = CASE {pk} {cases} END "
+                "WHERE {pk} IN ({ids})".format(
+                    table=qn(model._meta.db_table), column=column, pk=pk,
+                    cases=" ".join(["WHEN %s THEN %s"] * len(ids)),
+                    ids=", ".join(["%s"] * len(ids))),
+                params + ids)
+    if written:
+        transaction.set_dirty(using=using)
+    return written
+
+
+def register_tagged_model(sender, **kwargs):
+    """
+    class_prepared handler adding concrete TaggedItem models to the registry
+    """
+    if issubclass(sender, TaggedItem) and not sender._meta.abstract \
+            and not sender._meta.proxy:
+        registry.register(sender)
+
+
+class_prepared.connect(register_tagged_model)
+
+
+class TagUsageManager(models.Manager):
+    def adjust(self, model, auto, deltas, using="default"):
+        """
+        Apply `deltas`, a dictionary of tag id to change in usage, to the
+        counters of `model`. Tags sharing a delta are updated together.
+        """
+        label = _model_label(model)
+        by_delta = {}
+        for tag_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(tag_id)
+
+        for delta, tag_ids in by_delta.items():
+            for ids in _chunks(tag_ids, 500):
+                counters = self.using(using).filter(tag__in=ids, model=label,
+                                                    auto=auto)
+                if delta > 0:
+                    existing = set(counters.values_list("tag", flat=True))
+                    self.using(using).bulk_create([
+                        TagUsage(tag_id=tag_id, model=label, auto=auto,
+                                 count=delta)
+                        for tag_id in ids if tag_id not in existing])
+                    counters = counters.filter(tag__in=existing)
+                counters.update(count=F("count") + delta)
+
+    def counted(self, using="default"):
+        """
+        Return the counters as they should be, computed from the
+        through-tables with one grouped query per tagged model field, as a
+        dictionary keyed on (tag id, model label, auto).
+        """
+        counts = {}
+        for relation in registry.relations():
+            rows = relation.through._default_manager.using(using)\
+                .values_list(relation.tag_field).annotate(n=Count("pk"))\
+                .order_by()
+            label = _model_label(relation.model)
+            for tag_id, n in rows:
+                counts[(tag_id, label, relation.auto)] = n
+        return counts
+
+    def verify(self, using="default"):
+        """
+        Return a dictionary, keyed as `counted`, of (stored, expected)
+        for every counter that has drifted from the through-tables.
+        """
+        expected = self.counted(using)
+        stored = dict(((tag_id, model, auto), count) for
+                      tag_id, model, auto, count in self.using(using)
+                      .values_list("tag", "model", "auto", "count"))
+        drift = {}
+        for key in set(expected) | set(stored):
+            if expected.get(key, 0) != stored.get(key, 0):
+                drift[key] = (stored.get(key, 0), expected.get(key, 0))
+        return drift
+
+    def rebuild(self, using="default", batch_size=1000):
+        """
+        Replace all counters with values computed from the through-tables.
+        Returns the number of counters written.
+        """
+        counts = self.counted(using)
+        self.using(using).all().delete()
+        counters = [TagUsage(tag_id=tag_id, model=model, auto=auto,
+                             count=count)
+                    for (tag_id, model, auto), count in counts.items()]
+        for batch in _chunks(counters, batch_size):
+            self.using(using).bulk_create(batch)
+        return len(counters)
+
+
+class TagUsage(models.Model):
+    """
+    A materialised count of the items of one tagged model that use a tag,
+    kept current by m2m_changed handlers when TAGMAN_USAGE_COUNTERS is set.
+    `auto` distinguishes `auto_tags` usage from `tags` usage.
+    """
+    tag = models.ForeignKey(Tag, related_name="usage_counts")
+    model = models.CharField(max_length=255,
+                             help_text="Label of the tagged model, "
+                                       "e.g. app_label.ModelName")
+    auto = models.BooleanField(default=False)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = TagUsageManager()
+
+    class Meta:
+        unique_together = ("tag", "model", "auto",)
+
+    def __unicode__(self):
+        return u"{0} on {1}{2}: {3}".format(
+            self.tag_id, self.model, " (auto)" if self.auto else "",
+            self.count)
+
+
+def update_usage_counters(sender, instance, action, reverse, model, pk_set,
+                          using, **kwargs):
+    """
+    m2m_changed handler keeping TagUsage current for `tags` and
+    `auto_tags` changes made from either side of the relation.
+    """
+    if not _usage_counters_enabled() or \
+            getattr(_bulk_tag_rows, "active", False):
+        return
+    relation = registry.for_through(sender)
+    if relation is None:
+        return
+
+    tagged_model, auto = relation.model, relation.auto
+    item_field, tag_field = relation.item_field, relation.tag_field
+    pending = instance.__dict__.setdefault("_tagman_usage_pending", {})
+
+    if action == "post_add" and pk_set:
+        if reverse:
+            deltas = {instance.pk: len(pk_set)}
+        else:
+            deltas = dict.fromkeys(pk_set, 1)
+        TagUsage.objects.adjust(tagged_model, auto, deltas, using)
+
+    elif action in ("pre_remove", "pre_clear"):
+        rows = sender._default_manager.using(using)
+        if reverse:
+            rows = rows.filter(**{tag_field: instance.pk})
+            if action == "pre_remove":
+                rows = rows.filter(**{item_field + "__in": pk_set or []})
+            pending[sender] = {instance.pk: -rows.count()}
+        else:
+            rows = rows.filter(**{item_field: instance.pk})
+            if action == "pre_remove":
+                rows = rows.filter(**{tag_field + "__in": pk_set or []})
+            pending[sender] = dict.fromkeys(
+                rows.values_list(tag_field, flat=True), -1)
+
+    elif action in ("post_remove", "post_clear") and sender in pending:
+        TagUsage.objects.adjust(tagged_model, auto, pending.pop(sender),
+                                using)
+
+
+def release_usage_counters(sender, instance, using, **kwargs):
+    """
+    pre_delete handler; deleting a tagged item removes its through rows
+    without m2m_changed so its counters are decremented here.
+    """
+    if not _usage_counters_enabled():
+        return
+    for relation in registry.relations(models=[sender]):
+        tag_ids = relation.through._default_manager.using(using)\
+            .filter(**{relation.item_field: instance.pk})\
+            .values_list(relation.tag_field, flat=True)
+        TagUsage.objects.adjust(sender, relation.auto,
+                                dict.fromkeys(tag_ids, -1), using)
+
+
+m2m_changed.connect(update_usage_counters)
+pre_delete.connect(release_usage_counters)
+
+
+class RelatedTag(models.Model):
+    """
+    One of the top neighbours of a tag: a tag often found on the same items
+    in the `tags` of any tagged model. See tagman.related.
+    """
+    tag = models.ForeignKey(Tag, related_name="related_scores")
+    related = models.ForeignKey(Tag, related_name="+")
+    count = models.PositiveIntegerField(
+        default=0, help_text="Items having both tags")
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ("tag", "related",)
+
+    def __unicode__(self):
+        return u"{0} -> {1}: {2}".format(self.tag_id, self.related_id,
+                                         self.score)
+
+
+class StaleRelatedTag(models.Model):
+    """
+    A tag whose RelatedTags need recomputing because the tags of one of
+    its items have changed; recorded when TAGMAN_RELATED_TAGS is set.
+    """
+    tag = models.ForeignKey(Tag, related_name="+")
+
+
+def _related_tags_enabled():
+    return getattr(settings, "TAGMAN_RELATED_TAGS", False)
+
+
+def _mark_related_tags_stale(relation, item_ids, tag_ids, using):
+    """
+    Record `tag_ids` and the tags of `item_ids` in `relation` as stale
+    """
+    stale = set(tag_ids)
+    stale.update(tag_id for _, tag_id in
+                 _existing_tag_rows(relation, item_ids, using=using))
+    recorded = set(StaleRelatedTag.objects.using(using)
+                   .filter(tag__in=stale).values_list("tag", flat=True))
+    StaleRelatedTag.objects.using(using).bulk_create(
+        [StaleRelatedTag(tag_id=tag_id) for tag_id in stale - recorded],
+        batch_size=500)
+
+
+def mark_related_tags_stale(sender, instance, action, reverse, model, pk_set,
+                            using, **kwargs):
+    """
+    m2m_changed handler recording the tags whose neighbours may change:
+    those of every item whose `tags` are about to change, and the tags
+    being added or removed.
+    """
+    if not _related_tags_enabled() or \
+            action not in ("pre_add", "pre_remove", "pre_clear"):
+        return
+    relation = registry.for_through(sender)
+    if relation is None or relation.auto:
+        return
+    if not reverse:
+        item_ids, tag_ids = [instance.pk], pk_set or ()
+    else:
+        tag_ids = [instance.pk]
+        item_ids = pk_set
+        if action == "pre_clear":
+            item_ids = relation.through._default_manager.using(using)\
+                .filter(**{relation.tag_field: instance.pk})\
+                .values_list(relation.item_field, flat=True)
+    _mark_related_tags_stale(relation, list(item_ids or ()), tag_ids, using)
+
+
+def mark_deleted_item_tags_stale(sender, instance, using, **kwargs):
+    """
+    pre_delete handler; a deleted item's through rows go without
+    m2m_changed, so its tags are recorded as stale here
+    """
+    if not _related_tags_enabled():
+        return
+    for relation in registry.relations(auto=False, models=[sender]):
+        _mark_related_tags_stale(relation, [instance.pk], (), using)
+
+
+m2m_changed.connect(mark_related_tags_stale)
+pre_delete.connect(mark_deleted_item_tags_stale)
+
+
+class VocabularyGenerationManager(models.Manager):
+    def __init__(self):
+        super(VocabularyGenerationManager, self).__init__()
+        self._bumps = {}
+
+    def current(self, using="default"):
+        """
+        Return the generation of the vocabulary of database `using`
+        """
+        generations = self.using(using).filter(pk=1)\
+            .values_list("generation", flat=True)
+        return generations[0] if generations else 0
+
+    def bump(self, using="default"):
+        """
+        Increment the generation, creating its row if need be
+        """
+        if not self.using(using).filter(pk=1)\
+                .update(generation=F("generation") + 1):
+            self.using(using).create(pk=1, generation=1)
+        self._bumps[using] = self._bumps.get(using, 0) + 1
+
+    def bumps(self, using="default"):
+        """
+        Return how many times this process has bumped the generation
+        """
+        return self._bumps.get(using, 0)
+
+
+class VocabularyGeneration(models.Model):
+    """
+    A single row counting the writes to tags and groups, so that processes
+    holding a snapshot of the vocabulary (see tagman.vocabulary) can tell
+    whether it is current; maintained when TAGMAN_VOCABULARY_SNAPSHOT is
+    set.
+    """
+    generation = models.PositiveIntegerField(default=0)
+
+    objects = VocabularyGenerationManager()
+
+
+def bump_vocabulary_generation(sender, **kwargs):
+    """
+    vocabulary_changed handler; the tag string cache is invalidated on
+    every write to tags and groups
+    """
+    if _vocabulary_snapshot_enabled():
+        VocabularyGeneration.objects.bump(
+            router.db_for_write(VocabularyGeneration))
+
+
+vocabulary_changed.connect(bump_vocabulary_generation)
+
+
+def _tag_strings_relations(auto=None):
+    return [relation for relation in registry.relations(auto=auto)
+            if issubclass(relation.model, TagStringsMixin)]
+
+
+def update_tag_strings(sender, instance, action, reverse, model, pk_set,
+                       using, **kwargs):
+    """
+    m2m_changed handler rewriting the tag strings of TagStringsMixin items
+    whose `tags` or `auto_tags` have changed, from either side; rows
+    written in bulk are left to _change_tag_rows
+    """
+    relation = registry.for_through(sender)
+    if relation is None or not issubclass(relation.model, TagStringsMixin) \
+            or getattr(_bulk_tag_rows, "active", False):
+        return
+    pending = instance.__dict__.setdefault("_tagman_strings_pending", {})
+    if action == "pre_clear" and reverse:
+        pending[sender] = list(sender._default_manager.using(using)
+                               .filter(**{relation.tag_field: instance.pk})
+                               .values_list(relation.item_field, flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        item_ids = [instance.pk]
+    elif action == "post_clear":
+        item_ids = pending.pop(sender, [])
+    else:
+        item_ids = pk_set or []
+    written = refresh_tag_strings(relation.model, item_ids, relation.auto,
+                                  using)
+    if not reverse:
+        field = _tag_strings_field(relation.auto)
+        setattr(instance, field, written[(instance.pk, field)])
+
+
+def _tag_strings_items(using, tag_ids=(), group_id=None):
+    """
+    Return a list of (relation, item ids) of the TagStringsMixin items of
+    the tags `tag_ids`, or of group `group_id`, from the through rows
+    """
+    items = []
+    for relation in _tag_strings_relations():
+        through = relation.through._default_manager.using(using)
+        if group_id is not None:
+            conditions = [{relation.tag_field + "__group": group_id}]
+        else:
+            conditions = [{relation.tag_field + "__in": ids}
+                          for ids in _chunks(tag_ids, 500)]
+        item_ids = set()
+        for condition in conditions:
+            item_ids.update(through.filter(**condition)
+                            .values_list(relation.item_field, flat=True))
+        items.append((relation, item_ids))
+    return items
+
+
+def _refresh_items_tag_strings(items, using):
+    """
+    Rewrite the tag strings of `items`, as from _tag_strings_items
+    """
+    for relation, item_ids in items:
+        refresh_tag_strings(relation.model, item_ids, relation.auto, using)
+
+
+def _refresh_renamed_tag_strings(using, tag_ids=(), group_id=None):
+    """
+    Rewrite the tag strings of the TagStringsMixin items of the tags
+    `tag_ids`, or of group `group_id`, once they have been renamed
+    """
+    _refresh_items_tag_strings(_tag_strings_items(using, tag_ids, group_id),
+                               using)
+
+
+# set while Tag.bulk_delete and Tag.merge, which refresh the tag strings
+# of all their tags' items and invalidate the tag string cache at once,
+# delete tags; the cache keys of the deleted tags are collected for them
+_bulk_tag_deletes = threading.local()
+
+
+@contextmanager
+def _deleting_tags_in_bulk():
+    _bulk_tag_deletes.active = True
+    _bulk_tag_deletes.cache_keys = []
+    try:
+        yield _bulk_tag_deletes.cache_keys
+    finally:
+        _bulk_tag_deletes.active = False
+
+
+def collect_deleted_tag_strings(sender, instance, using, **kwargs):
+    """
+    Tag pre_delete handler noting the TagStringsMixin items of a tag
+    deleted on its own, while its through rows remain
+    """
+    if not getattr(_bulk_tag_deletes, "active", False):
+        instance.__dict__["_tagman_strings_items"] = _tag_strings_items(
+            using, [instance.pk])
+
+
+def refresh_deleted_tag_strings(sender, instance, using, **kwargs):
+    """
+    Tag post_delete handler rewriting the tag strings noted by
+    collect_deleted_tag_strings
+    """
+    _refresh_items_tag_strings(
+        instance.__dict__.pop("_tagman_strings_items", ()), using)
+
+
+def snapshot_tag_string(sender, instance, **kwargs):
+    """
+    post_init handler recording the string of a Tag as loaded, so that
+    save() refreshes tag strings only on renames; deferred instances are
+    skipped as by snapshot_denormalised
+    """
+    instance._saved_string = _composite_name(instance.group_name,
+                                             instance.name)
+
+
+m2m_changed.connect(update_tag_strings)
+pre_delete.connect(collect_deleted_tag_strings, sender=Tag)
+post_delete.connect(refresh_deleted_tag_strings, sender=Tag)
+post_init.connect(snapshot_tag_string, sender=Tag)
+
+
+def snapshot_denormalised(sender, instance, **kwargs):
+    """
+    post_init handler recording the values a TagGroup de-normalises onto
+    its tags as loaded, so that save() cascades only changes. Instances
+    with deferred fields are of a subclass and are skipped; reading a
+    deferred field here would build another instance to load it.
+    """
+    instance._saved_denormalised = instance._denormalised()
+
+
+post_init.connect(snapshot_denormalised, sender=TagGroup)
+
+
+def invalidate_tag_cache(sender, instance, **kwargs):
+    """
+    post_delete handler dropping deleted tags and groups from the tag
+    string cache, or noting their keys while tags are deleted in bulk
+    """
+    if sender is Tag and getattr(_bulk_tag_deletes, "active", False):
+        _bulk_tag_deletes.cache_keys.append(
+            _cache_key(instance.group_name, instance.name))
+    elif sender is Tag:
+        tag_cache().invalidate([_cache_key(instance.group_name,
+                                           instance.name)],
+                               tag_id=instance.pk)
+    elif sender is TagGroup:
+        tag_cache().invalidate(group_id=instance.pk)
+
+
+post_delete.connect(invalidate_tag_cache, sender=Tag)
+post_delete.connect(invalidate_tag_cache, sender=TagGroup)
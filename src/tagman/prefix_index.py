@@ -0,0 +1,188 @@
+"""
+An in-process prefix index of the tag vocabulary, for autocomplete.
+
+Every tag is indexed under its lower-cased name, group name and
+"GRP:NAME" form, without the system `*`, in a sorted list per
+visibility (system, archived) that is searched with bisect, so a search
+only scans the keys of the tags it can return. Matches are ranked by tag
+weight.
+
+The index is built on first use and kept current from the tag string
+cache's vocabulary_changed signal: changed tags and groups are reloaded,
+in one query each, before the next search. Changes made by other
+processes, and tag weights, are picked up by a full rebuild every
+TAGMAN_PREFIX_INDEX_TIMEOUT seconds (default 300).
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from django.conf import settings
+from tagman.models import Tag, _composite_name, _tag_weights
+from tagman.signals import vocabulary_changed
+
+IndexedTag = namedtuple("IndexedTag", [
+    "id", "name", "group_id", "group_name", "system", "archived"])
+
+# a search result; `text` is the "[*]GRP:NAME" representation
+TagMatch = namedtuple("TagMatch", ["id", "text", "weight"])
+
+INDEXED_FIELDS = ("id", "name", "group_id", "group_name", "group_is_system",
+                  "archived")
+
+
+def _visibility(tag):
+    return tag.system, tag.archived
+
+
+def _keys(tag):
+    group_name = tag.group_name.lstrip("*").lower()
+    name = tag.name.lower()
+    return set([name, group_name, _composite_name(group_name, name)])
+
+
+class TagPrefixIndex(object):
+    """
+    Prefix index over the tags of one database. Pending changes beyond
+    `max_pending` tags or groups are applied by a full rebuild instead.
+    """
+    def __init__(self, using="default", timeout=300, max_pending=500):
+        self.using = using
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._tags = {}
+        self._keys = {}
+        self._weights = {}
+        self._built = None
+        self._stale = False
+        self._pending_tags = set()
+        self._pending_groups = set()
+        self._lock = threading.RLock()
+        vocabulary_changed.connect(self._vocabulary_changed)
+
+    def _vocabulary_changed(self, sender, tag_id=None, group_id=None,
+                            tag_ids=(), group_ids=(), **kwargs):
+        self.changed(tag_id, group_id, tag_ids, group_ids)
+
+    def changed(self, tag_id=None, group_id=None, tag_ids=(), group_ids=()):
+        """
+        Note that a tag, several tags, the tags of one or several groups
+        or, with none of them, any tag may have changed
+        """
+        with self._lock:
+            if self._built is None:
+                return
+            if tag_id is None and group_id is None and not tag_ids and \
+                    not group_ids:
+                self._stale = True
+            if tag_id is not None:
+                self._pending_tags.add(tag_id)
+            self._pending_tags.update(tag_ids)
+            if group_id is not None:
+                self._pending_groups.add(group_id)
+            self._pending_groups.update(group_ids)
+            if len(self._pending_tags) + len(self._pending_groups) > \
+                    self.max_pending:
+                self._stale = True
+
+    def _add(self, tag):
+        self._tags[tag.id] = tag
+        keys = self._keys.setdefault(_visibility(tag), [])
+        for key in _keys(tag):
+            insort(keys, (key, tag.id))
+
+    def _remove(self, tag_id):
+        tag = self._tags.pop(tag_id, None)
+        if tag is None:
+            return
+        keys = self._keys[_visibility(tag)]
+        for key in _keys(tag):
+            position = bisect_left(keys, (key, tag_id))
+            if position < len(keys) and keys[position] == (key, tag_id):
+                del keys[position]
+
+    def _rows(self, **filters):
+        return (IndexedTag(*row) for row in Tag.objects.using(self.using)
+                .filter(**filters).values_list(*INDEXED_FIELDS))
+
+    def rebuild(self):
+        """
+        Load every tag and the tag weights
+        """
+        with self._lock:
+            self._tags = dict((tag.id, tag) for tag in self._rows())
+            self._keys = {}
+            for tag in self._tags.values():
+                self._keys.setdefault(_visibility(tag), []).extend(
+                    (key, tag.id) for key in _keys(tag))
+            for keys in self._keys.values():
+                keys.sort()
+            self._weights = dict(_tag_weights(using=self.using))
+            self._built = time.time()
+            self._stale = False
+            self._pending_tags.clear()
+            self._pending_groups.clear()
+
+    def _refresh(self):
+        if self._built is None or self._stale or \
+                time.time() - self._built > self.timeout:
+            self.rebuild()
+            return
+        if self._pending_groups:
+            group_ids = self._pending_groups
+            for tag_id in [tag.id for tag in self._tags.values()
+                           if tag.group_id in group_ids]:
+                self._remove(tag_id)
+            for tag in self._rows(group__in=group_ids):
+                self._remove(tag.id)
+                self._add(tag)
+            self._pending_groups = set()
+        if self._pending_tags:
+            tag_ids = self._pending_tags
+            for tag_id in tag_ids:
+                self._remove(tag_id)
+            for tag in self._rows(pk__in=tag_ids):
+                self._add(tag)
+            self._pending_tags = set()
+
+    def search(self, prefix, k=10, system=False, archived=False):
+        """
+        Return up to `k` TagMatches for the tags with a name, group name or
+        "GRP:NAME" starting with `prefix`, ignoring case and any system
+        `*`, heaviest first. As with TagManager, only system tags are
+        matched if `system`, otherwise only public ones, and only archived
+        tags if `archived`, otherwise only current ones.
+        """
+        prefix = prefix.strip().lstrip("*").lower()
+        with self._lock:
+            self._refresh()
+            keys, matches = self._keys.get((system, archived), []), set()
+            position = bisect_left(keys, (prefix,))
+            while position < len(keys) and \
+                    keys[position][0].startswith(prefix):
+                matches.add(keys[position][1])
+                position += 1
+            tags = [self._tags[tag_id] for tag_id in matches]
+            weights = self._weights
+        best = heapq.nsmallest(
+            k, tags, key=lambda tag: (-weights.get(tag.id, 0),
+                                      tag.group_name, tag.name))
+        return [TagMatch(tag.id, _composite_name(tag.group_name, tag.name),
+                         weights.get(tag.id, 0))
+                for tag in best]
+
+
+_tag_index = None
+
+
+def tag_index():
+    """
+    Return the process-wide TagPrefixIndex of the default database
+    """
+    global _tag_index
+    if _tag_index is None:
+        _tag_index = TagPrefixIndex(
+            timeout=getattr(settings, "TAGMAN_PREFIX_INDEX_TIMEOUT", 300))
+    return _tag_index
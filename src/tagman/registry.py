@@ -0,0 +1,103 @@
+"""
+Registry of the concrete TaggedItem models and their through-tables.
+
+Models are registered as they are prepared (see tagman.models), from the
+`tags` and `auto_tags` fields they define, so nothing needs to inspect
+Tag's attributes to find out what can be tagged.
+"""
+from collections import namedtuple
+
+# `item_field` and `tag_field` are the names of the through model's foreign
+# keys; `accessor` is the name of the related manager on Tag
+TaggedRelation = namedtuple("TaggedRelation", [
+    "model", "field", "through", "item_field", "tag_field", "auto",
+    "accessor"])
+
+TAG_FIELDS = (("tags", False), ("auto_tags", True))
+
+
+def _lineage(model):
+    """
+    Return the concrete model of `model` and its concrete ancestors
+    """
+    model = model._meta.concrete_model or model
+    return [model] + list(model._meta.get_parent_list())
+
+
+class TaggedModelRegistry(object):
+    def __init__(self):
+        self._relations = []
+        self._by_through = {}
+
+    def register(self, model):
+        """
+        Register the `tags` and `auto_tags` fields that `model` defines.
+        Models inheriting them from a concrete parent share its
+        through-tables and are not registered again.
+        """
+        local = dict((f.name, f) for f in model._meta.local_many_to_many)
+        for name, auto in TAG_FIELDS:
+            field = local.get(name)
+            if field is None or field.rel.through in self._by_through:
+                continue
+            relation = TaggedRelation(
+                model=model,
+                field=field,
+                through=field.rel.through,
+                item_field=field.m2m_field_name(),
+                tag_field=field.m2m_reverse_field_name(),
+                auto=auto,
+                accessor=field.related.get_accessor_name())
+            self._relations.append(relation)
+            self._by_through[relation.through] = relation
+
+    def models(self):
+        """
+        Return the registered model classes, in registration order
+        """
+        models = []
+        for relation in self._relations:
+            if relation.model not in models:
+                models.append(relation.model)
+        return models
+
+    def model_for_name(self, name):
+        """
+        Return the registered model whose lower-cased class name is `name`
+        """
+        for model in self.models():
+            if model.__name__.lower() == name.lower():
+                return model
+        return None
+
+    def relations(self, auto=None, models=None, ignore_models=None):
+        """
+        Return TaggedRelations, optionally only those for `tags`
+        (auto=False) or `auto_tags` (auto=True), and only for `models` or
+        not for `ignore_models`. The relations of a proxy or multi-table
+        child model are those of the model defining its fields, whose
+        primary keys are the child's.
+        """
+        if models is not None:
+            models = set(parent for model in models
+                         for parent in _lineage(model))
+        return [relation for relation in self._relations
+                if (auto is None or relation.auto == auto) and
+                (models is None or relation.model in models) and
+                (not ignore_models or relation.model not in ignore_models)]
+
+    def relation(self, model, auto=False):
+        """
+        Return the TaggedRelation for `model`'s tags or auto_tags, or None
+        """
+        relations = self.relations(auto=auto, models=[model])
+        return relations[0] if relations else None
+
+    def for_through(self, through):
+        """
+        Return the TaggedRelation whose through model is `through`, or None
+        """
+        return self._by_through.get(through)
+
+
+registry = TaggedModelRegistry()
@@ -0,0 +1,101 @@
+"""
+Related tags: for each tag, the tags that most often appear in the `tags`
+of the same items, across every tagged model.
+
+The tag x tag co-occurrence counts are computed by the database, with a
+self-join of each through-table grouped by pairs of tags, for a chunk of
+tags at a time, so only the non-zero entries of one chunk's rows of the
+matrix are ever held in memory. Each pair is scored by cosine similarity,
+count / sqrt(weight(a) * weight(b)), and the best `k` per tag are stored
+as RelatedTag rows for Tag.related_tags to read.
+
+With TAGMAN_RELATED_TAGS set, tags whose items change are recorded as
+StaleRelatedTag rows and refresh_related_tags recomputes only those.
+"""
+import heapq
+import math
+
+from django.db import connections
+from tagman.models import (RelatedTag, StaleRelatedTag, Tag, _chunks,
+                           _commit_on_success, _tag_weights)
+from tagman.registry import registry
+
+
+def cooccurrence(tag_ids, using="default"):
+    """
+    Return a dict of {(tag id, other tag id): number of items having both}
+    for the given tags and every other tag they share an item with
+    """
+    tag_ids = list(tag_ids)
+    counts = {}
+    if not tag_ids:
+        return counts
+    qn = connections[using].ops.quote_name
+    cursor = connections[using].cursor()
+    for relation in registry.relations(auto=False):
+        field = relation.field
+        item, tag = qn(field.m2m_column_name()), qn(field.m2m_reverse_name())
+        cursor.execute(
+            "SELECT a.{tag}, b.{tag}, COUNT(*) FROM {table} a "
+            "INNER JOIN {table} b ON b.{item} = a.{item} AND b.{tag} <> a.{tag} "
+            "WHERE a.{tag} IN ({ids}) GROUP BY a.{tag}, b.{tag}".format(
+                table=qn(field.m2m_db_table()), item=item, tag=tag,
+                ids=", ".join(["%s"] * len(tag_ids))),
+            tag_ids)
+        for pair_tag, other, count in cursor.fetchall():
+            pair = (pair_tag, other)
+            counts[pair] = counts.get(pair, 0) + count
+    return counts
+
+
+def _top_related(tag_ids, k, using):
+    """
+    Return the RelatedTag instances, unsaved, of the best `k` neighbours of
+    each of `tag_ids`
+    """
+    counts = cooccurrence(tag_ids, using)
+    weights = {}
+    for ids in _chunks(set(tag_id for pair in counts for tag_id in pair),
+                       500):
+        weights.update(_tag_weights(tag_ids=ids, using=using))
+    neighbours = {}
+    for (tag_id, other), count in counts.items():
+        # drifted usage counters may be missing or zero; skip such pairs
+        # until the counters are rebuilt
+        weight = weights.get(tag_id, 0) * weights.get(other, 0)
+        if not weight:
+            continue
+        score = count / math.sqrt(weight)
+        neighbours.setdefault(tag_id, []).append((score, count, other))
+    related = []
+    for tag_id, scored in neighbours.items():
+        for score, count, other in heapq.nlargest(
+                k, scored, key=lambda entry: (entry[0], -entry[2])):
+            related.append(RelatedTag(tag_id=tag_id, related_id=other,
+                                      count=count, score=score))
+    return related
+
+
+def refresh_related_tags(k=10, full=False, chunk_size=500,
+                         using="default"):
+    """
+    Recompute the RelatedTags of every tag if `full`, otherwise of the
+    tags recorded as stale, `chunk_size` tags per transaction. Returns
+    the number of tags refreshed.
+    """
+    if full:
+        tag_ids = Tag.objects.using(using).order_by("pk")\
+            .values_list("pk", flat=True)
+    else:
+        tag_ids = StaleRelatedTag.objects.using(using).order_by("tag")\
+            .values_list("tag", flat=True).distinct()
+    tag_ids = list(tag_ids)
+    for chunk in _chunks(tag_ids, chunk_size):
+        with _commit_on_success(using):
+            related = _top_related(chunk, k, using)
+            RelatedTag.objects.using(using).filter(tag__in=chunk).delete()
+            RelatedTag.objects.using(using).bulk_create(related,
+                                                        batch_size=500)
+            StaleRelatedTag.objects.using(using).filter(tag__in=chunk)\
+                .delete()
+    return len(tag_ids)
@@ -0,0 +1,28 @@
+"""
+Signals sent by tagman
+"""
+from django.dispatch import Signal
+
+# Sent with sender=Tag for each tag whose de-normalised group fields have
+# been rewritten in bulk by TagGroup.save, which no longer saves (and so
+# sends post_save for) each tag. Tags are only loaded to send it while it
+# has receivers.
+tag_denormalised = Signal(providing_args=["instance", "using"])
+
+# Sent by the tag string cache whenever it is invalidated, i.e. whenever
+# tags or groups are written. `tag_id`, `group_id`, and `tag_ids` and
+# `group_ids`, lists of tags and groups changed in bulk, identify what
+# changed; when none is given any tag may have changed.
+vocabulary_changed = Signal(providing_args=["tag_id", "group_id",
+                                            "tag_ids", "group_ids"])
+
+# Sent by tagman.instrumentation, while it is enabled, after each call of
+# an instrumented operation, with the operation name as sender. `rows` is
+# None when the result's size is not known.
+operation_measured = Signal(providing_args=["elapsed", "queries", "rows"])
+
+# Sent with sender=Tag by Tag.merge, which moves through rows with SQL and
+# so sends no m2m_changed, once the items of the tags `source_ids` have
+# been moved to the tag `target_id` and before the sources are deleted or
+# archived.
+tags_merged = Signal(providing_args=["source_ids", "target_id", "using"])
@@ -0,0 +1,74 @@
+/*
+ * Adds a search box to each TagAutocompleteWidget select which loads the
+ * matching tags, a page at a time, from the widget's autocomplete URL.
+ * Selected options are kept as the search changes.
+ */
+(function () {
+    "use strict";
+
+    function init(select) {
+        var url = select.getAttribute("data-autocomplete-url"),
+            input = document.createElement("input"),
+            more = document.createElement("a"),
+            term = "",
+            page = 1,
+            timer = null;
+
+        input.type = "search";
+        input.placeholder = "Search tags";
+        more.href = "#";
+        more.textContent = "More tags";
+        more.style.display = "none";
+        select.parentNode.insertBefore(input, select);
+        select.parentNode.insertBefore(more, select.nextSibling);
+
+        function load(reset) {
+            var request = new XMLHttpRequest();
+            request.open("GET", url + "?q=" + encodeURIComponent(term) +
+                         "&page=" + page);
+            request.onload = function () {
+                var data = JSON.parse(request.responseText), i;
+                if (reset) {
+                    for (i = select.options.length - 1; i >= 0; i--) {
+                        if (!select.options[i].selected) {
+                            select.remove(i);
+                        }
+                    }
+                }
+                data.results.forEach(function (result) {
+                    var value = String(result.id), present = false;
+                    for (i = 0; i < select.options.length; i++) {
+                        present = present || select.options[i].value === value;
+                    }
+                    if (!present) {
+                        select.add(new Option(result.text, value));
+                    }
+                });
+                more.style.display = data.more ? "" : "none";
+            };
+            request.send();
+        }
+
+        input.addEventListener("input", function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                term = input.value;
+                page = 1;
+                load(true);
+            }, 250);
+        });
+        more.addEventListener("click", function (event) {
+            event.preventDefault();
+            page += 1;
+            load(false);
+        });
+    }
+
+    document.addEventListener("DOMContentLoaded", function () {
+        var selects = document.querySelectorAll(
+            "select[data-autocomplete-url]"), i;
+        for (i = 0; i < selects.length; i++) {
+            init(selects[i]);
+        }
+    });
+}());
@@ -0,0 +1,163 @@
+"""
+Streaming of items from several tagged models' querysets as one ordered
+sequence.
+
+Each queryset is read in keyset-paginated chunks, ordered by a field
+common to every model and then by primary key, and the streams are
+combined with a k-way merge so that only one chunk per model is held in
+memory. Cursors let API callers resume from the last item they saw.
+"""
+import base64
+import heapq
+import json
+from collections import namedtuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+# position of an item in a merged stream; items are ordered on
+# (value, model, pk) where model is the "app_label.ModelName" label
+ItemCursor = namedtuple("ItemCursor", ["value", "model", "pk"])
+
+
+def _label(model):
+    return "{0}.{1}".format(model._meta.app_label, model._meta.object_name)
+
+
+def _field_value(item, field_name):
+    return item.pk if field_name == "pk" else getattr(item, field_name)
+
+
+def cursor_for(item, order_by="pk"):
+    """
+    Return the ItemCursor of `item` in a stream ordered by `order_by`
+    """
+    return ItemCursor(_field_value(item, order_by.lstrip("-")),
+                      _label(item.__class__), item.pk)
+
+
+def encode_cursor(cursor):
+    """
+    Return an opaque, URL-safe token for an ItemCursor
+    """
+    data = json.dumps(list(cursor), cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(data.encode("utf-8"))
+
+
+def decode_cursor(token, model, order_by="pk"):
+    """
+    Return the ItemCursor for a token from encode_cursor, converting the
+    value with `model`'s `order_by` field. Raises ValueError if the token
+    is not valid.
+    """
+    try:
+        value, label, pk = json.loads(
+            base64.urlsafe_b64decode(str(token)).decode("utf-8"))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor {0!r}".format(token))
+    field_name = order_by.lstrip("-")
+    field = model._meta.pk if field_name == "pk" else \
+        model._meta.get_field(field_name)
+    return ItemCursor(field.to_python(value), label, pk)
+
+
+def _after(field_name, descending, value, pk, tie_break=None):
+    """
+    Return a Q selecting rows after (value, pk) in (field, pk) order.
+    `tie_break` True/False selects all / no rows with an equal value, for
+    models that sort after / before the cursor's model.
+    """
+    op = "lt" if descending else "gt"
+    after = Q(**{"{0}__{1}".format(field_name, op): value})
+    if tie_break is None:
+        return after | Q(**{field_name: value, "pk__" + op: pk})
+    if tie_break:
+        return after | Q(**{field_name: value})
+    return after
+
+
+def _stream(queryset, field_name, descending, cursor, chunk_size):
+    """
+    Yield the rows of `queryset` in (field, pk) order, `chunk_size` at a
+    time, starting after `cursor`.
+    """
+    prefix = "-" if descending else ""
+    ordered = queryset.order_by(prefix + field_name, prefix + "pk")
+    rows = ordered
+    if cursor is not None:
+        label = _label(queryset.model)
+        tie_break = None
+        if label != cursor.model:
+            tie_break = (label > cursor.model) != descending
+        rows = ordered.filter(_after(field_name, descending, cursor.value,
+                                     cursor.pk, tie_break))
+    while True:
+        chunk = list(rows[:chunk_size])
+        for item in chunk:
+            yield item
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        rows = ordered.filter(_after(field_name, descending,
+                                     _field_value(last, field_name),
+                                     last.pk))
+
+
+class _Descending(object):
+    """
+    Wraps a sort key to invert its ordering in a heap
+    """
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def merge_querysets(querysets, order_by="pk", limit=None, cursor=None,
+                    chunk_size=1000):
+    """
+    Yield the items of several querysets, of different models, as one
+    sequence ordered by `order_by` ("field" or "-field", which every model
+    must have) then model label and pk, stopping after `limit` items.
+
+    `cursor` may be an ItemCursor or a token from encode_cursor, in which
+    case iteration starts after the item it identifies.
+    """
+    querysets = list(querysets)
+    if not querysets or limit == 0:
+        return
+    descending = order_by.startswith("-")
+    field_name = order_by.lstrip("-")
+    if cursor is not None and not isinstance(cursor, ItemCursor):
+        cursor = decode_cursor(cursor, querysets[0].model, order_by)
+
+    def _entry(item, stream):
+        key = (_field_value(item, field_name), _label(item.__class__),
+               item.pk)
+        return (_Descending(key) if descending else key), item, stream
+
+    heap = []
+    for queryset in querysets:
+        stream = _stream(queryset, field_name, descending, cursor,
+                         chunk_size)
+        for item in stream:
+            heap.append(_entry(item, stream))
+            break
+    heapq.heapify(heap)
+
+    count = 0
+    while heap and (limit is None or count < limit):
+        _, item, stream = heap[0]
+        yield item
+        count += 1
+        for next_item in stream:
+            heapq.heapreplace(heap, _entry(next_item, stream))
+            break
+        else:
+            heapq.heappop(heap)
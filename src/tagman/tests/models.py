@@ -1,7 +1,7 @@
 from django.db import models
 
 from tagman.models import TaggedItem
-from tagman.models import TaggedContentItem
+from tagman.models import TaggedContentItem, TagStringsMixin
 
 
 class TestItem(TaggedItem):
@@ -24,8 +24,40 @@ class IgnoreTestItem(TaggedItem):
         return str(self.name)
 
 
+class ChildItem(IgnoreTestItem):
+    """
+    Multi-table child inheriting its tags from IgnoreTestItem
+    """
+    extra = models.CharField(max_length=100, default="")
+
+    class Meta:
+        app_label = "tagman"
+
+
+class Underscored_Item(TaggedItem):
+    """
+    Model name with underscores, which the model registry must not split
+    """
+    class Meta:
+        app_label = "tagman"
+
+
 class TCI(TaggedContentItem):
     class Meta:
         app_label = "tagman"
 
     slug = "tci-slug"
+
+
+class SlugItem(TaggedContentItem):
+    slug = models.SlugField(max_length=100)
+
+    class Meta:
+        app_label = "tagman"
+
+
+class StringsItem(TagStringsMixin, TaggedItem):
+    name = models.CharField(max_length=100, default="test")
+
+    class Meta:
+        app_label = "tagman"
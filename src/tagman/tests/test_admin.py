@@ -0,0 +1,147 @@
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from django.contrib import admin
+from django.test.utils import override_settings
+
+from tagman.admin import TagAdmin, TagAutocompleteWidget
+from tagman.admin import TaggedContentItemForm, TagUsageFilter
+from tagman.cache import tag_cache
+from tagman.models import Tag, TagUsage
+from tagman.tests.models import IgnoreTestItem, TCI, TestItem
+from tagman.views import tag_autocomplete
+
+
+class TCIForm(TaggedContentItemForm):
+    class Meta:
+        model = TCI
+
+
+class TCIAutocompleteForm(TaggedContentItemForm):
+    tag_autocomplete_url = "/tags/autocomplete/"
+
+    class Meta:
+        model = TCI
+
+
+class TestTaggedContentItemForm(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.tags = Tag.get_or_create_tags_for_strings(
+            ["meat:beef", "flavour:spicy", "*System:hidden"])
+
+    def test_choices_shared(self):
+        choices = list(TCIForm().fields["tags"].choices)
+        self.assertEquals([text for _, text in choices],
+                          ["meat:beef", "flavour:spicy"])
+        with self.assertNumQueries(0):
+            self.assertEquals(list(TCIForm().fields["tags"].choices),
+                              choices)
+
+    def test_choices_follow_changes(self):
+        TCIForm()
+        Tag.get_or_create_tags_for_strings(["meat:pork"])
+        self.assertEquals(len(TCIForm().fields["tags"].choices), 3)
+        tag = self.tags[0]
+        tag.name = "veal"
+        tag.save()
+        self.assertTrue((tag.pk, "meat:veal") in
+                        TCIForm().fields["tags"].choices)
+
+    def test_autocomplete_renders_selected(self):
+        tci = TCI.objects.create()
+        tci.tags.add(self.tags[1])
+        form = TCIAutocompleteForm(instance=tci)
+        self.assertTrue(isinstance(form.fields["tags"].widget,
+                                   TagAutocompleteWidget))
+        html = unicode(form["tags"])
+        self.assertTrue('data-autocomplete-url="/tags/autocomplete/"' in html)
+        self.assertTrue("flavour:spicy" in html)
+        self.assertFalse("meat:beef" in html)
+        self.assertTrue("tag_autocomplete.js" in unicode(form.media))
+
+
+class TestTagAutocompleteView(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        Tag.get_or_create_tags_for_strings(
+            ["meat:beef", "meat:bacon", "flavour:beefy", "*System:beef"] +
+            ["colour:c{0:02d}".format(i) for i in range(25)])
+
+    def _get(self, **params):
+        request = RequestFactory().get("/tags/autocomplete/", params)
+        return json.loads(tag_autocomplete(request).content)
+
+    def test_search(self):
+        data = self._get(q="bee")
+        self.assertEquals([r["text"] for r in data["results"]],
+                          ["flavour:beefy", "meat:beef"])
+        self.assertFalse(data["more"])
+        data = self._get(q="meat:ba")
+        self.assertEquals([r["text"] for r in data["results"]],
+                          ["meat:bacon"])
+
+    def test_pages(self):
+        data = self._get(q="colour")
+        self.assertEquals(len(data["results"]), 20)
+        self.assertTrue(data["more"])
+        data = self._get(q="colour", page="2")
+        self.assertEquals([r["text"] for r in data["results"]],
+                          ["colour:c{0:02d}".format(i) for i in range(20, 25)])
+        self.assertFalse(data["more"])
+
+
+class TestTagAdmin(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.beef, self.pork, self.lamb = Tag.get_or_create_tags_for_strings(
+            ["meat:beef", "meat:pork", "meat:lamb"])
+        TestItem.objects.create(name="a").tags.add(self.beef, self.pork)
+        IgnoreTestItem.objects.create(name="b").tags.add(self.beef)
+        TestItem.objects.create(name="c").auto_tags.add(self.lamb)
+        self.admin = TagAdmin(Tag, admin.site)
+        self.request = RequestFactory().get("/")
+
+    def _counts(self):
+        with self.assertNumQueries(1):
+            return [(str(tag), self.admin.usage_count(tag),
+                     self.admin.group_display(tag))
+                    for tag in self.admin.queryset(self.request)
+                    .order_by("-usage_count", "name")]
+
+    def test_usage_count(self):
+        self.assertEquals(self._counts(), [("meat:beef", 2, "meat"),
+                                           ("meat:pork", 1, "meat"),
+                                           ("meat:lamb", 0, "meat")])
+
+    @override_settings(TAGMAN_USAGE_COUNTERS=True)
+    def test_usage_count_from_counters(self):
+        TagUsage.objects.rebuild()
+        self.assertEquals([count for _, count, _ in self._counts()],
+                          [2, 1, 0])
+
+    def test_usage_filter(self):
+        usage_filter = TagUsageFilter(self.request, {"used": "no"}, Tag,
+                                      self.admin)
+        tags = usage_filter.queryset(self.request,
+                                     self.admin.queryset(self.request))
+        self.assertEquals([str(tag) for tag in tags], ["meat:lamb"])
+
+    def test_archive_actions(self):
+        messages = []
+        self.admin.message_user = lambda request, message: \
+            messages.append(message)
+        selected = Tag.objects.filter(pk__in=[self.beef.pk, self.pork.pk])
+        self.admin.archive_tags(self.request, selected)
+        self.assertEquals(Tag.objects.filter(archived=True).count(), 2)
+        self.assertEquals(Tag.tag_for_string("meat:beef").archived, True)
+        with self.assertNumQueries(2):
+            # selected ids, one update; the cache is invalidated at once
+            self.admin.unarchive_tags(self.request, selected)
+        self.assertEquals(Tag.objects.filter(archived=True).count(), 0)
+        self.assertEquals(messages, ["Archived 2 tags", "Unarchived 2 tags"])
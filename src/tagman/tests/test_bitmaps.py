@@ -0,0 +1,92 @@
+from django.test import TestCase
+
+from tagman.bitmaps import DENSITY, TagBitmapIndex, _bitmap, _pks
+from tagman.cache import tag_cache
+from tagman.models import Tag
+from tagman.tests.models import IgnoreTestItem
+
+
+class TestTagBitmapIndex(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.beef, self.pork, self.spicy, self.mild = \
+            Tag.get_or_create_tags_for_strings(
+                ["meat:beef", "meat:pork", "flavour:spicy", "flavour:mild"])
+        self.items = [IgnoreTestItem.objects.create(name=str(i))
+                      for i in range(6)]
+        for item, tags in zip(self.items, [
+                [self.beef, self.spicy], [self.beef, self.mild],
+                [self.pork, self.spicy], [self.pork], [], [self.beef]]):
+            item.tags.add(*tags)
+        self.items[4].auto_tags.add(self.beef)
+        self.index = TagBitmapIndex()
+
+    def assertMatchesSql(self, **conditions):
+        expected = sorted(IgnoreTestItem.objects.tagged(**conditions)
+                          .values_list("pk", flat=True))
+        self.assertEquals(self.index.items(IgnoreTestItem, **conditions),
+                          expected)
+        self.assertEquals(self.index.count(IgnoreTestItem, **conditions),
+                          len(expected))
+
+    def _check_all(self):
+        self.assertMatchesSql(all_of=[self.beef])
+        self.assertMatchesSql(all_of=[self.beef, self.spicy])
+        self.assertMatchesSql(any_of=[self.spicy, self.mild])
+        self.assertMatchesSql(all_of=["meat:beef"], none_of=["flavour:mild"])
+        self.assertMatchesSql(none_of=[self.beef, self.pork])
+        self.assertMatchesSql(all_of=[self.beef], auto_tags=True)
+        self.assertMatchesSql(all_of=["meat:missing"])
+        self.assertMatchesSql()
+
+    def test_queries(self):
+        self._check_all()
+
+    def test_in_memory(self):
+        self.index.items(IgnoreTestItem, all_of=[self.beef])
+        with self.assertNumQueries(0):
+            self.index.items(IgnoreTestItem, all_of=[self.beef],
+                             any_of=[self.spicy, self.mild],
+                             none_of=[self.pork])
+
+    def test_follows_changes(self):
+        self.index.rebuild()
+        self.items[0].tags.remove(self.spicy)
+        self.items[3].tags.add(self.beef, self.mild)
+        self.items[1].tags.clear()
+        self.spicy.ignoretestitem_set.add(self.items[5])
+        self.mild.ignoretestitem_set.clear()
+        IgnoreTestItem.objects.filter(name__in=["0", "2"]).add_tag_strs(
+            ["flavour:spicy"])
+        IgnoreTestItem.objects.filter(name="5").set_tag_strs(["meat:pork"])
+        self.items[2].delete()
+        IgnoreTestItem.objects.create(name="new").tags.add(self.beef)
+        with self.assertNumQueries(0):
+            self.index.count(IgnoreTestItem, all_of=[self.beef])
+        self._check_all()
+
+    def test_follows_merge(self):
+        self.index.rebuild()
+        Tag.merge([self.pork, self.mild], self.beef)
+        self._check_all()
+
+    def test_deleted_tag(self):
+        self.index.rebuild()
+        beef_id = self.beef.pk
+        self.beef.delete()
+        self.assertEquals(
+            self.index._tag_bitmap(IgnoreTestItem, beef_id, True), 0)
+
+    def test_dense_tags(self):
+        self.index.rebuild()
+        tags = self.index._items[IgnoreTestItem.tags.through]
+        # with only six items every tag in use is dense
+        self.assertTrue(DENSITY > 6)
+        self.assertTrue(isinstance(tags[self.beef.pk], (int, long)))
+
+    def test_bitmap_helpers(self):
+        pks = set([0, 1, 7, 8, 9, 100, 1000])
+        self.assertEquals(_pks(_bitmap(pks)), sorted(pks))
+        self.assertEquals(_bitmap(set()), 0)
+        self.assertEquals(_pks(0), [])
@@ -0,0 +1,184 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from tagman.cache import tag_cache
+from tagman.models import Tag, TagGroup, TagUsage
+from tagman.tests.models import SlugItem, StringsItem, TestItem
+
+
+class TestRebuildTagUsage(TestCase):
+
+    def setUp(self):
+        self.group = TagGroup(name="test-group")
+        self.group.save()
+        self.tag = Tag(group=self.group, name="test-tag")
+        self.tag.save()
+        self.item = TestItem(name="test-item")
+        self.item.save()
+        self.item.tags.add(self.tag)
+
+    def test_verify_reports_drift(self):
+        # Django's call_command turns CommandError into SystemExit
+        self.assertRaises(SystemExit, call_command, "rebuild_tag_usage",
+                          verify=True, stdout=StringIO(), stderr=StringIO())
+
+    def test_rebuild(self):
+        out = StringIO()
+        call_command("rebuild_tag_usage", stdout=out)
+        self.assertEquals(out.getvalue(), "Rebuilt 1 tag usage counters\n")
+        self.assertEquals(TagUsage.objects.get(tag=self.tag).count, 1)
+        call_command("rebuild_tag_usage", verify=True, stdout=out)
+
+
+class TestCleanTags(TestCase):
+
+    def setUp(self):
+        self.tags = Tag.get_or_create_tags_for_strings(
+            ["old:a", "old:b", "old:c", "new:d"])
+        self.item = TestItem.objects.create(name="test-item")
+        self.item.tags.add(*self.tags)
+        SlugItem.objects.create(slug="x").auto_tags.add(self.tags[0])
+        Tag.objects.filter(group_name="old").update(archived=True)
+
+    def test_batches(self):
+        out = StringIO()
+        call_command("clean_tags", batch_size=2, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEquals(len(lines), 3)
+        self.assertTrue(lines[0].startswith("Deleted 2 tags up to pk"))
+        self.assertEquals(lines[2],
+                          "Deleted 3 archived tags and 4 through rows")
+        self.assertEquals([str(tag) for tag in Tag.objects.all()],
+                          ["new:d"])
+        self.assertEquals([str(tag) for tag in self.item.tags.all()],
+                          ["new:d"])
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("clean_tags", dry_run=True, stdout=out)
+        self.assertEquals(
+            out.getvalue().splitlines()[-1],
+            "Would delete 3 archived tags and 4 through rows")
+        self.assertTrue("tagman.SlugItem: 1" in out.getvalue())
+        self.assertEquals(Tag.objects.count(), 4)
+        self.assertEquals(self.item.tags.count(), 4)
+
+    def test_resume(self):
+        out = StringIO()
+        call_command("clean_tags", start_after=self.tags[0].pk,
+                     batch_size=1, time_limit=0, stdout=out)
+        self.assertTrue("--start-after={0}".format(self.tags[1].pk)
+                        in out.getvalue())
+        self.assertEquals(sorted(str(tag) for tag in Tag.objects.all()),
+                          ["new:d", "old:a", "old:c"])
+
+
+class TestCheckTagDenormalisation(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.tags = Tag.get_or_create_tags_for_strings(
+            ["meat:beef", "meat:pork", "*System:hidden", "flavour:hot"])
+        TagGroup.objects.filter(name="meat").update(slug="food")
+        TagGroup.objects.filter(name="System").update(name="Sys")
+        Tag.objects.filter(name="hot").update(group_is_system=True)
+
+    def test_reports_drift(self):
+        self.assertEquals(sorted(TagGroup.objects.drifted().values()),
+                          [1, 1, 2])
+        out = StringIO()
+        self.assertRaises(SystemExit, call_command,
+                          "check_tag_denormalisation", stdout=out,
+                          stderr=StringIO())
+        self.assertTrue("(meat): 2 tags drifted" in out.getvalue())
+
+    def test_repair(self):
+        out = StringIO()
+        call_command("check_tag_denormalisation", repair=True, stdout=out)
+        self.assertEquals(out.getvalue(), "Repaired 4 tags in 3 groups\n")
+        self.assertEquals(
+            sorted(str(tag) for tag in Tag.objects.all()),
+            ["*Sys:hidden", "flavour:hot", "meat:beef", "meat:pork"])
+        self.assertEquals(Tag.objects.filter(group_slug="food").count(), 2)
+        self.assertEquals(TagGroup.objects.drifted(), {})
+        call_command("check_tag_denormalisation", stdout=out)
+
+
+class TestAutoTagItems(TestCase):
+
+    def test_auto_tag(self):
+        for i in range(3):
+            SlugItem.objects.create(slug="item-{0}".format(i))
+        out = StringIO()
+        call_command("auto_tag_items", "tagman.SlugItem", chunk_size=2,
+                     stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEquals(len(lines), 3)
+        self.assertTrue(lines[1].startswith("SlugItem: 3 items up to pk"))
+        self.assertEquals(lines[2], "SlugItem: done, 3 items")
+        self.assertEquals(Tag.objects.filter(group_name="*SlugItem").count(),
+                          3)
+
+    def test_rejects_other_models(self):
+        self.assertRaises(SystemExit, call_command, "auto_tag_items",
+                          "tagman.TestItem", stdout=StringIO(),
+                          stderr=StringIO())
+
+
+class TestMergeTags(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.item = TestItem.objects.create(name="test-item")
+        self.item.add_tag_strs(["genre:sf", "genre:scifi"])
+        TestItem.objects.create(name="other").add_tag_strs(
+            ["genre:science-fiction", "genre:sf"])
+
+    def test_merge(self):
+        out = StringIO()
+        call_command("merge_tags", "genre:sf", "genre:scifi",
+                     into="genre:science-fiction", stdout=out)
+        self.assertEquals(out.getvalue(), "Added 1 rows to "
+                          "genre:science-fiction (tagman.IgnoreTestItem: 0, "
+                          "tagman.SlugItem: 0, tagman.StringsItem: 0, "
+                          "tagman.TCI: 0, tagman.TestItem: 1, "
+                          "tagman.Underscored_Item: 0)\n")
+        self.assertEquals([str(tag) for tag in Tag.objects.all()],
+                          ["genre:science-fiction"])
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("merge_tags", "genre:sf", into="genre:science-fiction",
+                     dry_run=True, stdout=out)
+        self.assertTrue(out.getvalue().startswith("Would add 1 rows"))
+        self.assertEquals(Tag.objects.count(), 3)
+
+    def test_errors(self):
+        for args, options in [((), {"into": "genre:sf"}),
+                              (("genre:sf",), {}),
+                              (("genre:nope",), {"into": "genre:sf"})]:
+            self.assertRaises(SystemExit, call_command, "merge_tags", *args,
+                              stdout=StringIO(), stderr=StringIO(),
+                              **options)
+
+
+class TestRefreshTagStrings(TestCase):
+
+    def test_refresh(self):
+        tag_cache().clear()
+        for i in range(3):
+            StringsItem.objects.create(name=str(i)).add_tag_str("meat:beef")
+        StringsItem.objects.update(tag_strings="[]")
+        out = StringIO()
+        call_command("refresh_tag_strings", chunk_size=2, stdout=out)
+        self.assertEquals(out.getvalue(), "StringsItem: done, 3 items\n")
+        self.assertEquals([item.get_tag_strings()
+                           for item in StringsItem.objects.all()],
+                          [["meat:beef"]] * 3)
+
+    def test_rejects_other_models(self):
+        self.assertRaises(SystemExit, call_command, "refresh_tag_strings",
+                          "tagman.TestItem", stdout=StringIO(),
+                          stderr=StringIO())
@@ -0,0 +1,69 @@
+from django.db import connection
+from django.test import TestCase
+
+from tagman import instrumentation
+from tagman.cache import tag_cache
+from tagman.models import Tag
+from tagman.signals import operation_measured
+from tagman.tests.models import TestItem
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.tags = Tag.get_or_create_tags_for_strings(
+            ["colour:red", "colour:blue"])
+        TestItem.objects.create(name="a").tags.add(*self.tags)
+        instrumentation.stats().reset()
+        instrumentation.enable()
+        self.measured = []
+        operation_measured.connect(self._measured)
+
+    def tearDown(self):
+        operation_measured.disconnect(self._measured)
+        instrumentation.disable()
+        instrumentation.stats().reset()
+
+    def _measured(self, sender, elapsed, queries, rows, **kwargs):
+        self.measured.append((sender, queries, rows))
+
+    def test_measures_calls(self):
+        tag_cache().clear()
+        Tag.tag_for_string("colour:red")
+        Tag.tag_for_string("colour:red")
+        self.assertEquals(self.measured, [("Tag.tag_for_string", 1, 1),
+                                          ("Tag.tag_for_string", 0, 1)])
+        totals = instrumentation.stats()["Tag.tag_for_string"]
+        self.assertEquals((totals["calls"], totals["queries"],
+                           totals["rows"]), (2, 1, 2))
+        self.assertTrue(totals["max_elapsed"] <= totals["elapsed"])
+
+    def test_nested_calls(self):
+        weights = Tag.public_objects.get_tags_with_weight()
+        self.assertEquals(weights, {"colour:red": 1, "colour:blue": 1})
+        self.assertEquals([sender for sender, _, _ in self.measured],
+                          ["tag_weights", "TagManager.get_tags_with_weight"])
+        self.assertEquals(self.measured[0][1:], (1, 2))
+        self.assertEquals(self.measured[1][1:], (2, 2))
+
+    def test_custom_rows(self):
+        group = self.tags[0].group
+        group.name = "color"
+        group.save()
+        self.assertEquals(
+            instrumentation.stats()["TagGroup.cascade"]["rows"], 2)
+
+    def test_debug_queries_discarded(self):
+        queries = len(connection.queries)
+        tag_cache().clear()
+        Tag.tags_for_string("colour:red, colour:blue")
+        self.assertEquals(len(connection.queries), queries)
+        self.assertEquals(connection.use_debug_cursor, None)
+        self.assertEquals(self.measured[-1], ("Tag.tags_for_string", 1, 2))
+
+    def test_disabled(self):
+        instrumentation.disable()
+        Tag.tags_for_string("colour:red, colour:blue")
+        self.assertEquals(self.measured, [])
+        self.assertEquals(instrumentation.stats().snapshot(), {})
@@ -1,8 +1,14 @@
 from django.test import TestCase
-from django.db import IntegrityError
+from django.test.utils import override_settings
+from django.db import IntegrityError, connection
 
-from tagman.models import Tag, TagGroup
+from tagman.cache import LRUCache, TagStringCache, tag_cache
+from tagman.models import Tag, TagGroup, TagUsage, _match_rows, tag_facets
+from tagman.registry import registry
+from tagman.signals import tag_denormalised
 from tagman.tests.models import TestItem, TCI, IgnoreTestItem
+from tagman.tests.models import SlugItem, StringsItem, Underscored_Item
+from tagman.tests.models import ChildItem
 
 
 class TestTags(TestCase):
@@ -131,6 +137,62 @@ class TestTags(TestCase):
         tag = Tag.objects.get(name="test-tag1")
         self.assertEquals(tag.group_is_system, True)
 
+    def test_group_save_unchanged_skips_cascade(self):
+        group = TagGroup.objects.get(pk=self.group.pk)
+        with self.assertNumQueries(2):
+            # select to decide between update and insert, then update
+            group.save()
+
+    def test_deferred_fields(self):
+        self.assertEquals(
+            [group.name for group in
+             TagGroup.objects.filter(pk=self.group.pk).only("id")],
+            ["test-group"])
+        group = TagGroup.objects.defer("system").get(pk=self.group.pk)
+        self.assertEquals(group.system, False)
+        tag = Tag.objects.select_related("group").only(
+            "name", "group_name", "group__name").get(pk=self.tag1.pk)
+        self.assertEquals(tag.group.name, "test-group")
+        self.assertEquals(
+            [tag.name for tag in Tag.objects.filter(pk=self.tag1.pk)
+             .only("id")], ["test-tag1"])
+        tag = Tag.objects.defer("group_name").get(pk=self.tag1.pk)
+        self.assertEquals(str(tag), "test-group:test-tag1")
+        tag = Tag.objects.select_related("group").only(
+            "name", "group__name").get(pk=self.tag1.pk)
+        self.assertEquals(tag.group.name, "test-group")
+        # a renamed deferred instance still cascades
+        group = TagGroup.objects.only("name").get(pk=self.group.pk)
+        group.name = "deferred-group"
+        group.save()
+        self.assertEquals(Tag.objects.get(pk=self.tag1.pk).group_name,
+                          "deferred-group")
+
+    def test_group_change_cascade_chunked(self):
+        tag3 = Tag(group=self.group, name="test-tag3")
+        tag3.save()
+        self.group.CASCADE_CHUNK_SIZE = 1
+        self.group.name = "chunked-group"
+        self.group.save()
+        self.assertEquals(
+            set(Tag.objects.filter(group=self.group)
+                .values_list("group_name", flat=True)),
+            set(["chunked-group"]))
+
+    def test_group_change_sends_tag_denormalised(self):
+        received = []
+
+        def receiver(sender, instance, **kwargs):
+            received.append(instance)
+        tag_denormalised.connect(receiver)
+        try:
+            self.group.system = True
+            self.group.save()
+        finally:
+            tag_denormalised.disconnect(receiver)
+        self.assertEquals(set(received), set(self.tags))
+        self.assertTrue(all(tag.system for tag in received))
+
     def test_add_tag_to_item(self):
         [self.item.tags.add(tag) for tag in self.tags]
         self.assertTrue([tag for tag in self.item.tags.all()
@@ -235,6 +297,31 @@ class TestTags(TestCase):
         self.assertTrue(self.item in list(items[item_model_name].all()))
         self.assertTrue(ignored_model in list(items[ignored_model_name].all()))
 
+    def test_models_for_tag(self):
+        models = self.tag1.models_for_tag()
+        self.assertTrue(set([TestItem, IgnoreTestItem, TCI,
+                             Underscored_Item]) <= models)
+
+    def test_registry_relations(self):
+        relation = registry.relation(TestItem, auto=True)
+        self.assertEquals(relation.through, TestItem.auto_tags.through)
+        self.assertEquals(relation.accessor, "testitem_auto_tagged_set")
+        self.assertEquals(relation.item_field, "testitem")
+        self.assertEquals(relation.tag_field, "tag")
+        self.assertEquals(registry.for_through(TestItem.tags.through).model,
+                          TestItem)
+        self.assertEquals(
+            [r.model for r in registry.relations(models=[TestItem])],
+            [TestItem, TestItem])
+
+    def test_get_tagged_items_underscored_model(self):
+        item = Underscored_Item()
+        item.save()
+        item.tags.add(self.tag1)
+        items = self.tag1.tagged_items(models=[Underscored_Item])
+        self.assertEquals(list(items["underscored_item"].all()), [item])
+        self.assertEquals(self.tag1.tag_weight(), 1)
+
     def test_get_unique_item_set(self):
         self.item.tags.add(self.tag1)
         item2 = TestItem(name="test-item-2")
@@ -287,6 +374,34 @@ class TestTags(TestCase):
         expected_non_composite_name_tags = {u'test-tag1': 3, u'test-tag2': 0}
         self.assertEquals(non_composite_name_tags, expected_non_composite_name_tags)
 
+    def test_tag_weight_single_tag(self):
+        self._setup_items_with_tags()
+        self.assertEquals(self.tag1.tag_weight(), 3)
+        self.assertEquals(self.tag1.tag_weight([IgnoreTestItem]), 2)
+        self.assertEquals(self.tag2.tag_weight(), 0)
+
+    def test_tag_weight_query_count(self):
+        self._setup_items_with_tags()
+        with self.assertNumQueries(2):
+            Tag.public_objects.get_tags_with_weight()
+
+    def test_tag_weight_limit(self):
+        self._setup_items_with_tags()
+        self.item.tags.add(self.tag2)
+        tag3 = Tag(group=self.groupb, name="test-tag3")
+        tag3.save()
+        tag3.testitem_set.add(self.item)
+        tag3.ignoretestitem_set.add(IgnoreTestItem.objects.get())
+        weights = Tag.public_objects.get_tags_with_weight(limit=2)
+        self.assertEquals(weights.items(), [('test-group:test-tag1', 3),
+                                            ('test-group-b:test-tag3', 2)])
+
+    def test_tag_weight_min_weight(self):
+        self._setup_items_with_tags()
+        self.item.tags.add(self.tag2)
+        weights = Tag.public_objects.get_tags_with_weight(min_weight=2)
+        self.assertEquals(weights, {'test-group:test-tag1': 3})
+
 
 class TestSystemTags(TestCase):
     """
@@ -424,3 +539,844 @@ class TestTaggedContentItem(TestCase):
         self.assertEquals(len(auto_tags), 1)
         self.assertEquals(auto_tags[0].name, "new-tci-slug")
         self.assertEquals(auto_tags[0].slug, "new-tci-slug")
+
+
+@override_settings(TAGMAN_USAGE_COUNTERS=True)
+class TestTagUsageCounters(TestCase):
+    """
+    With TAGMAN_USAGE_COUNTERS set, m2m changes from either side keep the
+    TagUsage counters current and weights are read from them.
+    """
+    def setUp(self):
+        self.group = TagGroup(name="test-group")
+        self.group.save()
+        self.tag1 = Tag(group=self.group, name="test-tag1")
+        self.tag1.save()
+        self.tag2 = Tag(group=self.group, name="test-tag2")
+        self.tag2.save()
+        self.item = TestItem(name="test-item")
+        self.item.save()
+        self.item2 = TestItem(name="test-item-2")
+        self.item2.save()
+
+    def _count(self, tag, model=TestItem, auto=False):
+        label = "tagman.{0}".format(model.__name__)
+        try:
+            return TagUsage.objects.get(tag=tag, model=label, auto=auto).count
+        except TagUsage.DoesNotExist:
+            return 0
+
+    def test_forward_add_remove_clear(self):
+        self.item.tags.add(self.tag1, self.tag2)
+        self.item2.tags.add(self.tag1)
+        self.item2.tags.add(self.tag1)
+        self.assertEquals(self._count(self.tag1), 2)
+        self.assertEquals(self._count(self.tag2), 1)
+        self.item.tags.remove(self.tag1)
+        self.item2.tags.remove(self.tag2)
+        self.assertEquals(self._count(self.tag1), 1)
+        self.assertEquals(self._count(self.tag2), 1)
+        self.item.tags.clear()
+        self.assertEquals(self._count(self.tag2), 0)
+
+    def test_reverse_add_remove_clear(self):
+        self.tag1.testitem_set.add(self.item, self.item2)
+        self.assertEquals(self._count(self.tag1), 2)
+        self.tag1.testitem_set.remove(self.item)
+        self.assertEquals(self._count(self.tag1), 1)
+        self.tag1.testitem_set.clear()
+        self.assertEquals(self._count(self.tag1), 0)
+
+    def test_bulk_tagging(self):
+        TestItem.objects.add_tag_strs(["test-group:test-tag1",
+                                       "test-group:test-tag2"])
+        self.item.set_tag_strs(["test-group:test-tag2", "test-group:new"])
+        TestItem.objects.remove_tag_strs(["test-group:test-tag2"])
+        self.assertEquals(self._count(self.tag1), 1)
+        self.assertEquals(self._count(self.tag2), 0)
+        self.assertEquals(TagUsage.objects.verify(), {})
+
+    def test_auto_tags_counted_separately(self):
+        self.item.auto_tags.add(self.tag1)
+        self.assertEquals(self._count(self.tag1, auto=True), 1)
+        self.assertEquals(self._count(self.tag1), 0)
+        self.assertEquals(self.tag1.tag_weight(), 0)
+
+    def test_item_delete(self):
+        item = IgnoreTestItem(name="ignore_me")
+        item.save()
+        item.tags.add(self.tag1)
+        self.assertEquals(self._count(self.tag1, IgnoreTestItem), 1)
+        item.delete()
+        self.assertEquals(self._count(self.tag1, IgnoreTestItem), 0)
+
+    def test_weights_read_from_counters(self):
+        self.item.tags.add(self.tag1, self.tag2)
+        self.item2.tags.add(self.tag1)
+        ignored = IgnoreTestItem(name="ignore_me")
+        ignored.save()
+        ignored.tags.add(self.tag2)
+        with self.assertNumQueries(1):
+            self.assertEquals(self.tag1.tag_weight(), 2)
+        self.assertEquals(self.tag2.tag_weight([IgnoreTestItem]), 1)
+        self.assertEquals(Tag.public_objects.get_tags_with_weight(),
+                          {'test-group:test-tag1': 2,
+                           'test-group:test-tag2': 2})
+        self.assertEquals(
+            Tag.public_objects.get_tags_with_weight(ignore_models=[IgnoreTestItem],
+                                             limit=1).items(),
+            [('test-group:test-tag1', 2)])
+
+    def test_verify_and_rebuild(self):
+        self.item.tags.add(self.tag1)
+        self.assertEquals(TagUsage.objects.verify(), {})
+        TagUsage.objects.all().delete()
+        self.item2.auto_tags.add(self.tag2)
+        drift = TagUsage.objects.verify()
+        self.assertEquals(drift, {(self.tag1.pk, "tagman.TestItem", False):
+                                  (0, 1)})
+        self.assertEquals(TagUsage.objects.rebuild(), 2)
+        self.assertEquals(TagUsage.objects.verify(), {})
+
+
+class TestTagStringCache(TestCase):
+    """
+    Tag string resolution is cached and the cache invalidated by tag and
+    group writes.
+    """
+    def setUp(self):
+        tag_cache().clear()
+        self.group = TagGroup(name="test-group")
+        self.group.save()
+        self.tag = Tag(group=self.group, name="test-tag")
+        self.tag.save()
+
+    def test_lru_eviction(self):
+        lru = LRUCache(2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        self.assertEquals(lru.set("c", 3), [("b", 2)])
+        self.assertTrue("a" in lru)
+        self.assertEquals(len(lru), 2)
+
+    def test_tag_for_string_cached(self):
+        self.assertEquals(Tag.tag_for_string("test-group:test-tag"), self.tag)
+        with self.assertNumQueries(0):
+            tag = Tag.tag_for_string("test-group:test-tag")
+        self.assertEquals(tag, self.tag)
+        self.assertEquals(str(tag), "test-group:test-tag")
+
+    def test_get_or_create_tag_for_string_cached(self):
+        tag = Tag.get_or_create_tag_for_string("test-group:new-tag")
+        Tag.get_or_create_tag_for_string("test-group:new-tag")
+        with self.assertNumQueries(0):
+            self.assertEquals(Tag.tag_for_string("test-group:new-tag"), tag)
+        # checked to still exist, without the group lookup
+        with self.assertNumQueries(1):
+            self.assertEquals(
+                Tag.get_or_create_tag_for_string("test-group:new-tag"), tag)
+
+    def test_get_or_create_tag_for_string_stale_cache(self):
+        Tag.tag_for_string("test-group:test-tag")
+        # deleted behind the cache's back, as by another process
+        connection.cursor().execute("DELETE FROM tagman_tag WHERE id = %s",
+                                    [self.tag.pk])
+        tag = Tag.get_or_create_tag_for_string("test-group:test-tag")
+        self.assertTrue(Tag.objects.filter(pk=tag.pk).exists())
+
+    def test_local_timeout(self):
+        cache = TagStringCache(local_timeout=0)
+        cache.set("test-group:test-tag", self.tag.cache_values())
+        self.assertEquals(cache.get("test-group:test-tag"), None)
+
+    def test_missing_tag_not_cached(self):
+        self.assertRaises(Tag.DoesNotExist, Tag.tag_for_string,
+                          "test-group:missing")
+        self.assertRaises(Tag.DoesNotExist, Tag.tag_for_string,
+                          "missing-group:test-tag")
+
+    def test_tag_rename_invalidates(self):
+        Tag.tag_for_string("test-group:test-tag")
+        self.tag.name = "renamed"
+        self.tag.save()
+        self.assertRaises(Tag.DoesNotExist, Tag.tag_for_string,
+                          "test-group:test-tag")
+        self.assertEquals(Tag.tag_for_string("test-group:renamed"), self.tag)
+
+    def test_archive_invalidates(self):
+        Tag.get_or_create_tag_for_string("test-group:test-tag")
+        self.tag.archive()
+        tag = Tag.get_or_create_tag_for_string("test-group:test-tag")
+        self.assertFalse(tag.archived)
+        self.assertFalse(Tag.objects.get(pk=self.tag.pk).archived)
+
+    def test_group_rename_invalidates(self):
+        Tag.tag_for_string("test-group:test-tag")
+        self.group.name = "new-group"
+        self.group.save()
+        self.assertRaises(Tag.DoesNotExist, Tag.tag_for_string,
+                          "test-group:test-tag")
+        tag = Tag.tag_for_string("new-group:test-tag")
+        self.assertEquals(tag.group_name, "new-group")
+
+    def test_bulk_invalidate(self):
+        Tag.tag_for_string("test-group:test-tag")
+        Tag.objects.filter(pk=self.tag.pk).update(name="renamed")
+        tag_cache().invalidate(tag_ids=[self.tag.pk])
+        self.assertRaises(Tag.DoesNotExist, Tag.tag_for_string,
+                          "test-group:test-tag")
+
+    def test_delete_invalidates(self):
+        Tag.tag_for_string("test-group:test-tag")
+        self.tag.delete()
+        self.assertRaises(Tag.DoesNotExist, Tag.tag_for_string,
+                          "test-group:test-tag")
+
+
+class TestBatchTagResolution(TestCase):
+    """
+    Lists of tag strings are resolved, and created, in bulk.
+    """
+    def setUp(self):
+        tag_cache().clear()
+        self.group = TagGroup(name="test-group")
+        self.group.save()
+        self.sys_group = TagGroup(name="system-group", system=True)
+        self.sys_group.save()
+        self.tag1 = Tag(group=self.group, name="test-tag1")
+        self.tag1.save()
+        self.tag2 = Tag(group=self.group, name="test-tag2")
+        self.tag2.save()
+        self.sys_tag = Tag(group=self.sys_group, name="sys-tag")
+        self.sys_tag.save()
+
+    def test_resolve_in_input_order(self):
+        strings = ["*system-group:sys-tag", "test-group:test-tag2",
+                   "test-group:test-tag1"]
+        with self.assertNumQueries(1):
+            resolution = Tag.resolve_tag_strings(strings)
+        self.assertEquals(resolution.tags,
+                          [self.sys_tag, self.tag2, self.tag1])
+        self.assertEquals(resolution.missing, [])
+        with self.assertNumQueries(0):
+            Tag.resolve_tag_strings(strings)
+
+    def test_resolve_reports_missing(self):
+        resolution = Tag.resolve_tag_strings(
+            ["test-group:test-tag1", "test-group:nope", "malformed",
+             "no-group:test-tag1"])
+        self.assertEquals(resolution.tags, [self.tag1])
+        self.assertEquals(resolution.missing,
+                          ["test-group:nope", "malformed",
+                           "no-group:test-tag1"])
+
+    def test_tags_for_string_missing(self):
+        try:
+            Tag.tags_for_string("test-group:test-tag1,test-group:a,"
+                                "test-group:b")
+        except Tag.DoesNotExist as e:
+            self.assertEquals(str(e), "Tags not found: test-group:a, "
+                                      "test-group:b")
+        else:
+            self.fail("Tag.DoesNotExist not raised")
+
+    def test_get_or_create_tags_for_strings(self):
+        self.tag2.archive()
+        tags = Tag.get_or_create_tags_for_strings(
+            ["test-group:new-tag", "test-group:test-tag1",
+             "*new-sys-group:Another Tag", "test-group:test-tag2"])
+        self.assertEquals([str(t) for t in tags],
+                          ["test-group:new-tag", "test-group:test-tag1",
+                           "*new-sys-group:Another Tag",
+                           "test-group:test-tag2"])
+        self.assertEquals(tags[1], self.tag1)
+        self.assertEquals(tags[3], self.tag2)
+        self.assertFalse(Tag.objects.get(pk=self.tag2.pk).archived)
+        new_group = TagGroup.objects.get(name="new-sys-group")
+        self.assertTrue(new_group.system)
+        self.assertEquals(new_group.slug, "new-sys-group")
+        self.assertEquals(tags[2].group, new_group)
+        self.assertEquals(tags[2].slug, "another-tag")
+        self.assertTrue(tags[2].group_is_system)
+        self.assertEquals(tags[2].group_slug, "new-sys-group")
+
+    def test_get_or_create_tags_for_strings_existing(self):
+        Tag.resolve_tag_strings(["test-group:test-tag1"])
+        # cached tags are only checked to still exist
+        with self.assertNumQueries(1):
+            tags = Tag.get_or_create_tags_for_strings(
+                ["test-group:test-tag1"])
+        self.assertEquals(tags, [self.tag1])
+
+    def test_match_rows_ignoring_case(self):
+        # rows as a case-insensitive collation would return them
+        rows = {("genre", "sf"): 1, ("Genre", "Drama"): 2}
+        self.assertEquals(
+            _match_rows([("Genre", "SF"), ("Genre", "Drama"), ("x", "y")],
+                        rows),
+            {("Genre", "SF"): 1, ("Genre", "Drama"): 2})
+        # a row spelled as another key is not shared with a case variant
+        self.assertEquals(_match_rows([("a", "b"), ("A", "b")],
+                                      {("a", "b"): 1}),
+                          {("a", "b"): 1})
+        self.assertEquals(_match_rows(["Genre"], {"genre": 3}),
+                          {"Genre": 3})
+
+    def test_get_or_create_tags_for_strings_stale_cache(self):
+        Tag.resolve_tag_strings(["test-group:test-tag1",
+                                 "test-group:test-tag2"])
+        # written behind the cache's back, as by another process
+        connection.cursor().execute("DELETE FROM tagman_tag WHERE id = %s",
+                                    [self.tag1.pk])
+        Tag.objects.filter(pk=self.tag2.pk).update(archived=True)
+        tag1, tag2 = Tag.get_or_create_tags_for_strings(
+            ["test-group:test-tag1", "test-group:test-tag2"])
+        self.assertTrue(Tag.objects.filter(pk=tag1.pk).exists())
+        self.assertEquals(tag2, self.tag2)
+        self.assertFalse(Tag.objects.get(pk=self.tag2.pk).archived)
+
+
+class TestBulkTagging(TestCase):
+    """
+    Many tag strings can be added, removed or set on one item or on a
+    whole queryset at once.
+    """
+    def setUp(self):
+        tag_cache().clear()
+        self.group = TagGroup(name="test-group")
+        self.group.save()
+        self.tag1 = Tag(group=self.group, name="test-tag1")
+        self.tag1.save()
+        self.items = [TestItem.objects.create(name="item-{0}".format(i))
+                      for i in range(3)]
+        self.item = self.items[0]
+
+    def _tag_strings(self, item, auto_tag=False):
+        tags = item.auto_tags if auto_tag else item.tags
+        return sorted(str(t) for t in tags.all())
+
+    def test_add_tag_strs(self):
+        self.item.tags.add(self.tag1)
+        tags = self.item.add_tag_strs(["test-group:test-tag1",
+                                       "test-group:test-tag2",
+                                       "*system:auto"])
+        self.assertEquals([str(t) for t in tags],
+                          ["test-group:test-tag1", "test-group:test-tag2",
+                           "*system:auto"])
+        self.assertEquals(self._tag_strings(self.item),
+                          ["*system:auto", "test-group:test-tag1",
+                           "test-group:test-tag2"])
+
+    def test_add_tag_strs_auto(self):
+        self.item.add_tag_strs(["*system:auto"], auto_tag=True)
+        self.assertEquals(self._tag_strings(self.item, True), ["*system:auto"])
+        self.assertEquals(self._tag_strings(self.item), [])
+
+    def test_remove_tag_strs(self):
+        self.item.add_tag_strs(["test-group:test-tag1", "test-group:b"])
+        self.item.remove_tag_strs(["test-group:test-tag1", "test-group:x"])
+        self.assertEquals(self._tag_strings(self.item), ["test-group:b"])
+
+    def test_set_tag_strs(self):
+        self.item.add_tag_strs(["test-group:test-tag1", "test-group:b"])
+        self.item.set_tag_strs(["test-group:b", "test-group:c"])
+        self.assertEquals(self._tag_strings(self.item),
+                          ["test-group:b", "test-group:c"])
+
+    def test_queryset_add_tag_strs(self):
+        self.item.tags.add(self.tag1)
+        TestItem.objects.filter(name__startswith="item")\
+            .add_tag_strs(["test-group:test-tag1", "test-group:b"])
+        for item in self.items:
+            self.assertEquals(self._tag_strings(item),
+                              ["test-group:b", "test-group:test-tag1"])
+        self.assertEquals(self.tag1.tag_weight(), 3)
+
+    def test_queryset_add_tag_strs_query_count(self):
+        Tag.get_or_create_tags_for_strings(["test-group:b"])
+        Tag.resolve_tag_strings(["test-group:test-tag1", "test-group:b"])
+        # check the cached tags, item ids, existing rows and one insert
+        with self.assertNumQueries(4):
+            TestItem.objects.add_tag_strs(["test-group:test-tag1",
+                                           "test-group:b"])
+
+    def test_queryset_remove_and_set(self):
+        TestItem.objects.add_tag_strs(["test-group:test-tag1", "test-group:b"])
+        TestItem.objects.exclude(pk=self.item.pk)\
+            .remove_tag_strs(["test-group:b"])
+        TestItem.objects.filter(pk=self.item.pk)\
+            .set_tag_strs(["test-group:c"])
+        self.assertEquals(self._tag_strings(self.items[0]), ["test-group:c"])
+        self.assertEquals(self._tag_strings(self.items[1]),
+                          ["test-group:test-tag1"])
+
+    @override_settings(TAGMAN_USAGE_COUNTERS=True)
+    def test_bulk_tagging_maintains_counters(self):
+        TestItem.objects.add_tag_strs(["test-group:test-tag1", "test-group:b"])
+        self.item.set_tag_strs(["test-group:c"])
+        self.assertEquals(TagUsage.objects.verify(), {})
+        self.assertEquals(self.tag1.tag_weight(), 2)
+
+
+class TestStreamingItems(TestCase):
+    """
+    Items for a tag are streamed across models in a global order with an
+    overall limit and cursors.
+    """
+    def setUp(self):
+        self.group = TagGroup(name="test-group")
+        self.group.save()
+        self.tag = Tag(group=self.group, name="test-tag")
+        self.tag.save()
+        self.items = []
+        # only these have the `name` field to order on
+        self.models = [TestItem, IgnoreTestItem]
+        for i, name in enumerate("dbfaec"):
+            model = TestItem if i % 2 else IgnoreTestItem
+            item = model.objects.create(name=name)
+            item.tags.add(self.tag)
+            self.items.append(item)
+
+    def test_order_and_limit(self):
+        names = [i.name for i in self.tag.iter_unique_items(
+            order_by="name", chunk_size=2, models=self.models)]
+        self.assertEquals(names, list("abcdef"))
+        names = [i.name for i in self.tag.iter_unique_items(
+            order_by="-name", limit=4, chunk_size=1, models=self.models)]
+        self.assertEquals(names, list("fedc"))
+
+    def test_filter_and_models(self):
+        items = list(self.tag.iter_unique_items(
+            models=[TestItem], filter_dict={"name__in": ["a", "b", "d"]}))
+        self.assertEquals([i.name for i in items], ["b", "a"])
+
+    def test_pages(self):
+        for order_by in ("pk", "name", "-name"):
+            seen, cursor = [], None
+            while True:
+                page, cursor = self.tag.unique_item_page(
+                    2, cursor, order_by=order_by, chunk_size=1,
+                    models=self.models)
+                seen.extend(page)
+                if cursor is None:
+                    break
+            self.assertEquals(len(seen), 6)
+            self.assertEquals(set(seen), set(self.items))
+            self.assertEquals(seen, list(self.tag.iter_unique_items(
+                order_by=order_by, models=self.models)))
+
+    def test_invalid_cursor(self):
+        self.assertRaises(ValueError, list,
+                          self.tag.iter_unique_items(cursor="not-a-cursor"))
+
+
+class TestTagQueries(TestCase):
+    """
+    ALL / ANY / NONE tag conditions compile into one query per model.
+    """
+    def setUp(self):
+        tag_cache().clear()
+        self.beef, self.spicy, self.hidden, self.mild = \
+            Tag.get_or_create_tags_for_strings(
+                ["meat:beef", "flavour:spicy", "*System:hidden",
+                 "flavour:mild"])
+        self.a = TestItem.objects.create(name="a")
+        self.a.tags.add(self.beef, self.spicy)
+        self.b = TestItem.objects.create(name="b")
+        self.b.tags.add(self.beef, self.spicy, self.hidden)
+        self.c = TestItem.objects.create(name="c")
+        self.c.tags.add(self.beef, self.mild)
+        self.c.auto_tags.add(self.spicy)
+        self.d = IgnoreTestItem.objects.create(name="d")
+        self.d.tags.add(self.beef, self.spicy)
+
+    def _names(self, queryset):
+        return sorted(item.name for item in queryset)
+
+    def test_all_none(self):
+        items = TestItem.objects.tagged(
+            all_of=["meat:beef", "flavour:spicy"],
+            none_of=["*System:hidden"])
+        with self.assertNumQueries(1):
+            self.assertEquals(self._names(items), ["a"])
+
+    def test_multi_table_child(self):
+        child = ChildItem.objects.create(name="e")
+        child.add_tag_strs(["meat:beef"])
+        self.assertEquals(
+            registry.relation(ChildItem), registry.relation(IgnoreTestItem))
+        self.assertEquals(
+            self._names(ChildItem.objects.tagged(all_of=["meat:beef"])),
+            ["e"])
+        self.assertEquals(
+            self._names(ChildItem.objects.tagged(none_of=["meat:beef"])),
+            [])
+
+    def test_any(self):
+        items = TestItem.objects.tagged(any_of=[self.mild, "*System:hidden"])
+        self.assertEquals(self._names(items), ["b", "c"])
+
+    def test_auto_tags(self):
+        items = TestItem.objects.tagged(all_of=[self.beef, self.spicy])
+        self.assertEquals(self._names(items), ["a", "b"])
+        items = TestItem.objects.tagged(all_of=[self.beef, self.spicy],
+                                        auto_tags=True)
+        self.assertEquals(self._names(items), ["a", "b", "c"])
+
+    def test_missing_tags(self):
+        self.assertEquals(
+            list(TestItem.objects.tagged(all_of=["meat:beef", "meat:x"])), [])
+        self.assertEquals(list(TestItem.objects.tagged(any_of=["meat:x"])),
+                          [])
+        self.assertEquals(
+            self._names(TestItem.objects.tagged(none_of=["meat:x"])),
+            ["a", "b", "c"])
+
+    def test_chains_with_filters(self):
+        items = TestItem.objects.filter(name__in=["a", "c"])\
+            .tagged(all_of=["meat:beef"]).exclude(name="c")
+        self.assertEquals(self._names(items), ["a"])
+
+    def test_items_tagged_across_models(self):
+        results = Tag.items_tagged(all_of=["meat:beef", "flavour:spicy"],
+                                   models=[TestItem, IgnoreTestItem])
+        self.assertEquals(self._names(results["testitem"]), ["a", "b"])
+        self.assertEquals(self._names(results["ignoretestitem"]), ["d"])
+        results = Tag.items_tagged(all_of=["meat:beef"],
+                                   ignore_models=[TestItem])
+        self.assertFalse("testitem" in results)
+        self.assertEquals(list(results["tci"]), [])
+
+
+class TestTagFacets(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        for name, tags in [("a", ["meat:beef", "flavour:spicy"]),
+                           ("b", ["meat:beef", "meat:pork"]),
+                           ("c", ["meat:pork", "*System:hidden"]),
+                           ("d", ["meat:beef", "flavour:mild"])]:
+            TestItem.objects.create(name=name).add_tag_strs(tags)
+        Tag.objects.filter(name="mild").update(archived=True)
+
+    def _counts(self, facets):
+        return [(group.name, group.count,
+                 [(tag.name, tag.count) for tag in group.tags])
+                for group in facets]
+
+    def test_facets(self):
+        self.assertEquals(self._counts(TestItem.objects.tag_facets()), [
+            ("meat", 5, [("beef", 3), ("pork", 2)]),
+            ("flavour", 1, [("spicy", 1)])])
+
+    def test_queryset(self):
+        facets = TestItem.objects.filter(name__in=["b", "c"]).tag_facets()
+        self.assertEquals(self._counts(facets),
+                          [("meat", 3, [("pork", 2), ("beef", 1)])])
+        self.assertEquals(facets[0].slug, "meat")
+        self.assertEquals(tag_facets(TestItem.objects.none()), [])
+
+    def test_top(self):
+        self.assertEquals(self._counts(TestItem.objects.tag_facets(top=1)), [
+            ("meat", 5, [("beef", 3)]),
+            ("flavour", 1, [("spicy", 1)])])
+
+    def test_system_and_archived(self):
+        self.assertEquals(
+            self._counts(TestItem.objects.tag_facets(system=True)),
+            [("*System", 1, [("hidden", 1)])])
+        self.assertEquals(
+            self._counts(TestItem.objects.tag_facets(archived=True)),
+            [("flavour", 1, [("mild", 1)])])
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            TestItem.objects.filter(name__in=["a", "b"]).tag_facets(top=5)
+
+
+class TestTagMerge(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.sf, self.scifi, self.target, self.other = \
+            Tag.get_or_create_tags_for_strings(
+                ["genre:sf", "genre:scifi", "genre:science-fiction",
+                 "format:book"])
+        self.a = IgnoreTestItem.objects.create(name="a")
+        self.a.tags.add(self.sf, self.scifi, self.other)
+        self.b = IgnoreTestItem.objects.create(name="b")
+        self.b.tags.add(self.sf, self.target)
+        self.c = SlugItem.objects.create(slug="c")
+        self.c.tags.add(self.scifi)
+        self.c.auto_tags.add(self.sf)
+
+    def _names(self, item):
+        return sorted(str(tag) for tag in item.tags.all())
+
+    def test_merge(self):
+        counts = Tag.merge(["genre:sf", self.scifi], self.target)
+        self.assertEquals(counts["tagman.IgnoreTestItem"], 1)
+        self.assertEquals(counts["tagman.SlugItem"], 2)
+        self.assertEquals(self._names(self.a),
+                          ["format:book", "genre:science-fiction"])
+        self.assertEquals(self._names(self.b), ["genre:science-fiction"])
+        self.assertEquals(self._names(self.c), ["genre:science-fiction"])
+        self.assertEquals([str(tag) for tag in self.c.auto_tags.all()],
+                          ["genre:science-fiction"])
+        self.assertEquals(sorted(str(tag) for tag in Tag.objects.all()),
+                          ["format:book", "genre:science-fiction"])
+        self.assertRaises(Tag.DoesNotExist, Tag.tag_for_string, "genre:sf")
+
+    def test_archive(self):
+        Tag.merge([self.sf], "genre:science-fiction", archive=True)
+        self.assertEquals(Tag.tag_for_string("genre:sf").archived, True)
+        self.assertEquals(self.sf.tag_weight(), 0)
+        self.assertEquals(self.target.tag_weight(), 2)
+
+    def test_dry_run(self):
+        counts = Tag.merge([self.sf, self.scifi], self.target, dry_run=True)
+        self.assertEquals(counts["tagman.IgnoreTestItem"], 1)
+        self.assertEquals(counts["tagman.SlugItem"], 2)
+        self.assertEquals(Tag.objects.count(), 4)
+        self.assertEquals(self._names(self.b),
+                          ["genre:science-fiction", "genre:sf"])
+
+    def test_query_count(self):
+        # the sources' items for each StringsItem field, an INSERT and a
+        # DELETE per through-table, then the sources are deleted with their
+        # remaining relations
+        with self.assertNumQueries(2 + 2 * 12 + 18):
+            Tag.merge([self.sf, self.scifi], self.target)
+
+    def test_missing(self):
+        self.assertRaises(Tag.DoesNotExist, Tag.merge, ["genre:nope"],
+                          self.target)
+        self.assertEquals(Tag.merge([self.target], self.target), {})
+
+    @override_settings(TAGMAN_USAGE_COUNTERS=True)
+    def test_usage_counters(self):
+        TagUsage.objects.rebuild()
+        Tag.merge([self.sf, self.scifi], self.target, archive=True)
+        self.assertEquals(TagUsage.objects.verify(), {})
+
+
+class TestPrefetchedTags(TestCase):
+    """
+    with_tags() loads tags and auto_tags for a page of items up front.
+    """
+    def setUp(self):
+        tag_cache().clear()
+        self.items = [TestItem.objects.create(name=str(i)) for i in range(5)]
+        TestItem.objects.add_tag_strs(["meat:beef", "flavour:spicy",
+                                       "*System:hidden"])
+        TestItem.objects.filter(name="0").add_tag_strs(["meat:pork"],
+                                                       auto_tag=True)
+
+    def test_two_queries(self):
+        with self.assertNumQueries(3):
+            items = list(TestItem.objects.with_tags().order_by("name"))
+            for item in items:
+                self.assertEquals(
+                    sorted(str(tag) for tag in item.tags.all()),
+                    ["*System:hidden", "flavour:spicy", "meat:beef"])
+                self.assertEquals(
+                    set(group.name for group in item.all_tag_groups()),
+                    set(["System", "flavour", "meat"]))
+            self.assertEquals(
+                [str(tag) for tag in items[0].auto_tags.all()], ["meat:pork"])
+            self.assertEquals(list(items[1].auto_tags.all()), [])
+
+    def test_groups_from_denormalised_fields(self):
+        item = TestItem.objects.with_tags().get(pk=self.items[0].pk)
+        groups = dict((group.name, group) for group in item.all_tag_groups())
+        system = TagGroup.objects.get(name="System")
+        self.assertEquals(groups["System"], system)
+        self.assertTrue(groups["System"].system)
+        self.assertEquals(groups["System"].slug, system.slug)
+        self.assertEquals(item.tags.all()[0].__class__, Tag)
+
+    def test_chained_and_plain(self):
+        items = TestItem.objects.with_tags().filter(name="0")
+        self.assertTrue("tags" in items[0]._prefetched_objects_cache)
+        item = TestItem.objects.get(name="0")
+        with self.assertNumQueries(1):
+            self.assertEquals(len(item.all_tag_groups()), 3)
+
+    def test_bulk_changes_drop_prefetched(self):
+        item = TestItem.objects.with_tags().get(pk=self.items[0].pk)
+        item.add_tag_strs(["meat:lamb"])
+        self.assertEquals(item.tags.count(), 4)
+
+    def test_self_auto_tag(self):
+        tci = TCI.objects.create()
+        tci.associate_auto_tags()
+        tci = TCI.objects.with_tags().get(pk=tci.pk)
+        with self.assertNumQueries(0):
+            self.assertEquals(str(tci.self_auto_tag), "*TCI:tci-slug")
+
+
+class TestBulkAutoTagging(TestCase):
+    """
+    TaggedContentItemQuerySet.associate_auto_tags backfills self-tags in
+    chunks.
+    """
+    def setUp(self):
+        tag_cache().clear()
+        self.items = [SlugItem.objects.create(slug="item-{0}".format(i))
+                      for i in range(5)]
+
+    def test_tags_every_item(self):
+        seen = []
+        progress = SlugItem.objects.associate_auto_tags(
+            chunk_size=2, callback=seen.append)
+        self.assertEquals([p.items for p in seen], [2, 4, 5])
+        self.assertEquals((progress.items, progress.tagged, progress.renamed,
+                           progress.last_pk), (5, 5, 0, self.items[-1].pk))
+        for item in self.items:
+            self.assertEquals(str(item.self_auto_tag),
+                              "*SlugItem:" + item.slug)
+        # a second run finds nothing to do
+        progress = SlugItem.objects.associate_auto_tags()
+        self.assertEquals((progress.tagged, progress.renamed), (0, 0))
+
+    def test_renames_stale_tags(self):
+        SlugItem.objects.associate_auto_tags()
+        old_tag = self.items[0].self_auto_tag
+        old_tag.archive()
+        SlugItem.objects.filter(pk=self.items[0].pk).update(slug="renamed")
+        progress = SlugItem.objects.associate_auto_tags()
+        self.assertEquals((progress.tagged, progress.renamed), (0, 1))
+        item = SlugItem.objects.get(pk=self.items[0].pk)
+        tag = item.self_auto_tag
+        self.assertEquals(tag.pk, old_tag.pk)
+        self.assertEquals((tag.slug, tag.archived), ("renamed", False))
+        self.assertEquals(str(Tag.tag_for_string("*SlugItem:renamed")),
+                          "*SlugItem:renamed")
+
+    def test_taken_name_is_shared(self):
+        SlugItem.objects.associate_auto_tags()
+        SlugItem.objects.filter(pk=self.items[0].pk).update(slug="item-1")
+        progress = SlugItem.objects.associate_auto_tags()
+        self.assertEquals((progress.tagged, progress.renamed), (1, 0))
+        self.assertEquals(
+            SlugItem.objects.get(pk=self.items[0].pk).self_auto_tag,
+            self.items[1].self_auto_tag)
+
+    def test_resume(self):
+        progress = SlugItem.objects.associate_auto_tags(
+            start_after=self.items[2].pk)
+        self.assertEquals(progress.items, 2)
+        self.assertEquals(
+            SlugItem.objects.tagged(any_of=["*SlugItem:item-0"],
+                                    auto_tags=True).count(), 0)
+
+
+class TestTagStrings(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.beef, self.pork, self.hidden = \
+            Tag.get_or_create_tags_for_strings(
+                ["meat:beef", "meat:pork", "*System:hidden"])
+        self.item = StringsItem.objects.create(name="a")
+        self.other = StringsItem.objects.create(name="b")
+
+    def _stored(self, item, auto_tag=False):
+        return StringsItem.objects.get(pk=item.pk).get_tag_strings(auto_tag)
+
+    def test_bulk_changes(self):
+        self.item.add_tag_strs(["meat:pork", "meat:beef"])
+        with self.assertNumQueries(0):
+            self.assertEquals(self.item.get_tag_strings(),
+                              ["meat:beef", "meat:pork"])
+        StringsItem.objects.all().add_tag_strs(["meat:lamb"])
+        self.assertEquals(self._stored(self.item),
+                          ["meat:beef", "meat:lamb", "meat:pork"])
+        self.assertEquals(self._stored(self.other), ["meat:lamb"])
+        StringsItem.objects.all().remove_tag_strs(["meat:beef"])
+        self.assertEquals(self._stored(self.item), ["meat:lamb", "meat:pork"])
+
+    def test_forward_changes(self):
+        self.assertEquals(self.item.get_tag_strings(), [])
+        self.item.tags.add(self.pork, self.beef)
+        with self.assertNumQueries(0):
+            self.assertEquals(self.item.get_tag_strings(),
+                              ["meat:beef", "meat:pork"])
+        self.assertEquals(self.item.tag_strings, '["meat:beef","meat:pork"]')
+        self.item.tags.remove(self.beef)
+        self.assertEquals(self._stored(self.item), ["meat:pork"])
+        self.item.auto_tags.add(self.hidden)
+        self.assertEquals(self.item.get_tag_strings(auto_tag=True),
+                          ["*System:hidden"])
+        self.item.tags.clear()
+        self.assertEquals(self.item.get_tag_strings(), [])
+        self.assertEquals(self._stored(self.item, auto_tag=True),
+                          ["*System:hidden"])
+
+    def test_reverse_changes(self):
+        self.beef.stringsitem_set.add(self.item, self.other)
+        self.assertEquals(self._stored(self.other), ["meat:beef"])
+        self.item.tags.add(self.pork)
+        self.beef.stringsitem_set.clear()
+        self.assertEquals(self._stored(self.item), ["meat:pork"])
+        self.assertEquals(self._stored(self.other), [])
+
+    def test_bulk_tagging(self):
+        StringsItem.objects.add_tag_strs(["meat:beef", "meat:lamb"])
+        self.assertEquals(self._stored(self.other),
+                          ["meat:beef", "meat:lamb"])
+        StringsItem.objects.filter(name="a").set_tag_strs(["meat:pork"])
+        self.assertEquals(self._stored(self.item), ["meat:pork"])
+
+    def test_renames(self):
+        self.item.tags.add(self.beef, self.pork)
+        self.other.auto_tags.add(self.beef)
+        self.beef.name = "steak"
+        self.beef.save()
+        self.assertEquals(self._stored(self.item), ["meat:pork", "meat:steak"])
+        group = TagGroup.objects.get(name="meat")
+        group.system = True
+        group.save()
+        self.assertEquals(self._stored(self.item),
+                          ["*meat:pork", "*meat:steak"])
+        self.assertEquals(self._stored(self.other, auto_tag=True),
+                          ["*meat:steak"])
+
+    def test_deferred_rename(self):
+        self.item.tags.add(self.beef)
+        tag = Tag.objects.only("name", "group").get(pk=self.beef.pk)
+        tag.name = "steak"
+        tag.save()
+        self.assertEquals(self._stored(self.item), ["meat:steak"])
+
+    def test_bulk_delete(self):
+        self.item.tags.add(self.beef, self.pork)
+        self.other.auto_tags.add(self.beef)
+        Tag.bulk_delete([self.beef.pk])
+        self.assertEquals(self._stored(self.item), ["meat:pork"])
+        self.assertEquals(self._stored(self.other, auto_tag=True), [])
+
+    def test_delete_and_merge(self):
+        self.item.tags.add(self.beef, self.pork)
+        self.other.tags.add(self.beef)
+        Tag.merge([self.beef], self.pork)
+        self.assertEquals(self._stored(self.item), ["meat:pork"])
+        self.assertEquals(self._stored(self.other), ["meat:pork"])
+        self.pork.delete()
+        self.assertEquals(self._stored(self.item), [])
+
+    def test_filter(self):
+        self.item.tags.add(self.beef)
+        self.other.tags.add(self.pork)
+        self.other.auto_tags.add(self.beef)
+        self.assertEquals(
+            list(StringsItem.objects.tag_strings_contain("meat:beef")),
+            [self.item])
+        self.assertEquals(
+            list(StringsItem.objects.tag_strings_contain("meat:beef",
+                                                         auto_tag=True)),
+            [self.other])
+        # the whole string is matched
+        self.assertEquals(
+            StringsItem.objects.tag_strings_contain("meat:bee").count(), 0)
@@ -0,0 +1,78 @@
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from tagman.cache import tag_cache
+from tagman.models import Tag, TagGroup
+from tagman.prefix_index import TagPrefixIndex
+from tagman.tests.models import TestItem
+from tagman.views import tag_search
+
+
+class TestTagPrefixIndex(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.beef, self.bacon, self.beer, self.hidden = \
+            Tag.get_or_create_tags_for_strings(
+                ["meat:beef", "meat:bacon", "drink:beer", "*System:beef"])
+        for i in range(3):
+            TestItem.objects.create(name=str(i)).tags.add(self.beer)
+        TestItem.objects.create(name="x").tags.add(self.bacon)
+        self.index = TagPrefixIndex()
+
+    def _texts(self, prefix, **kwargs):
+        return [match.text for match in self.index.search(prefix, **kwargs)]
+
+    def test_search(self):
+        self.assertEquals(self._texts("b"),
+                          ["drink:beer", "meat:bacon", "meat:beef"])
+        self.assertEquals(self.index.search("b", k=1)[0].weight, 3)
+        self.assertEquals(self._texts("MEAT"), ["meat:bacon", "meat:beef"])
+        self.assertEquals(self._texts("meat:be"), ["meat:beef"])
+        self.assertEquals(self._texts("beef", system=True), ["*System:beef"])
+        self.assertEquals(self._texts("*sys"), [])
+        self.assertEquals(self._texts("x"), [])
+
+    def test_keys_by_visibility(self):
+        self.index.search("b")
+        self.assertEquals(
+            sorted(self.index._keys[(True, False)]),
+            sorted((key, self.hidden.pk)
+                   for key in ["beef", "system", "system:beef"]))
+        self.assertFalse((False, True) in self.index._keys)
+        self.beef.archive()
+        self.index.search("b")
+        self.assertEquals(
+            [tag_id for key, tag_id in self.index._keys[(False, True)]],
+            [self.beef.pk] * 3)
+        self.assertFalse(self.beef.pk in [
+            tag_id for key, tag_id in self.index._keys[(False, False)]])
+
+    def test_search_is_in_memory(self):
+        self.index.search("b")
+        with self.assertNumQueries(0):
+            self.assertEquals(len(self.index.search("bee")), 2)
+
+    def test_follows_changes(self):
+        self.index.search("b")
+        self.beef.archive()
+        self.assertEquals(self._texts("be"), ["drink:beer"])
+        self.assertEquals(self._texts("be", archived=True), ["meat:beef"])
+        group = TagGroup.objects.get(name="drink")
+        group.name = "ale"
+        group.save()
+        with self.assertNumQueries(1):
+            self.assertEquals(self._texts("al"), ["ale:beer"])
+        self.assertEquals(self._texts("drink"), [])
+        self.bacon.delete()
+        self.assertEquals(self._texts("meat"), [])
+        Tag.get_or_create_tags_for_strings(["meat:brisket"])
+        self.assertEquals(self._texts("meat:b"), ["meat:brisket"])
+
+    def test_view(self):
+        request = RequestFactory().get("/tags/search/", {"q": "be", "k": 1})
+        data = json.loads(tag_search(request).content)
+        self.assertEquals(data["results"][0]["text"], "drink:beer")
+        self.assertEquals(len(data["results"]), 1)
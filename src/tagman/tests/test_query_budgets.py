@@ -0,0 +1,262 @@
+"""
+Query budgets for the public tagman API.
+
+Each operation is run against data sets of several sizes and must issue
+exactly the number of queries in its budget for all of them, so that a
+query count that grows with the data, such as an N+1 over tags, groups or
+items, fails here. The tag string cache is cleared first, so budgets are
+for the uncached path.
+"""
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from tagman.cache import tag_cache
+from tagman.models import Tag
+from tagman.tests.models import IgnoreTestItem, SlugItem, StringsItem
+from tagman.tests.models import TestItem
+
+SIZES = (1, 5, 20)
+
+# the tagged test models: TestItem, IgnoreTestItem, Underscored_Item, TCI,
+# SlugItem and StringsItem, each with a `tags` and an `auto_tags`
+# through-table
+MODELS = 6
+
+
+class Fixture(object):
+    """
+    `size` tags in each of two groups, `size` items of TestItem,
+    IgnoreTestItem and StringsItem each tagged with every tag of the first
+    group, and a SlugItem auto-tagged with its self-tag
+    """
+    def __init__(self, size):
+        self.size = size
+        self.prefix = "size{0}".format(size)
+        self.strings = ["{0}:tag{1}".format(self.prefix, i)
+                        for i in range(size)]
+        self.other_strings = ["{0}-other:tag{1}".format(self.prefix, i)
+                              for i in range(size)]
+        self.tags = Tag.get_or_create_tags_for_strings(self.strings)
+        self.other_tags = Tag.get_or_create_tags_for_strings(
+            self.other_strings)
+        self.tag = self.tags[0]
+        self.group = self.tag.group
+        self.items = []
+        for model in (TestItem, IgnoreTestItem, StringsItem):
+            for i in range(size):
+                item = model.objects.create(name="{0}-{1}".format(
+                    self.prefix, i))
+                item.tags.add(*self.tags)
+                self.items.append(item)
+        self.item = self.items[0]
+        self.slug_item = SlugItem.objects.create(slug=self.prefix)
+        self.slug_item.associate_auto_tags()
+
+
+class TestQueryBudgets(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.fixtures = [Fixture(size) for size in SIZES]
+
+    def _queries(self, operation, fixture):
+        tag_cache().clear()
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            operation(fixture)
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+        return len(connection.queries) - start
+
+    def assertBudget(self, budget, operation):
+        counts = [self._queries(operation, fixture)
+                  for fixture in self.fixtures]
+        self.assertEquals(counts, [budget] * len(SIZES))
+
+    # Tag
+
+    def test_tag_for_string(self):
+        self.assertBudget(1, lambda f: Tag.tag_for_string(f.strings[-1]))
+
+    def test_tags_for_string(self):
+        self.assertBudget(
+            1, lambda f: Tag.tags_for_string(", ".join(f.strings)))
+
+    def test_resolve_tag_strings(self):
+        self.assertBudget(
+            1, lambda f: Tag.resolve_tag_strings(f.strings + ["x:y"]))
+
+    def test_get_or_create_tag_for_string(self):
+        # group, tag
+        self.assertBudget(
+            2, lambda f: Tag.get_or_create_tag_for_string(f.strings[-1]))
+
+    def test_get_or_create_tags_for_strings(self):
+        # resolve, find the groups, create the missing tags, fetch them
+        self.assertBudget(4, lambda f: Tag.get_or_create_tags_for_strings(
+            f.strings + ["{0}:new{1}".format(f.prefix, i)
+                         for i in range(f.size)]))
+
+    @override_settings(TAGMAN_VOCABULARY_SNAPSHOT=True)
+    def test_get_or_create_tags_for_strings_with_snapshot(self):
+        # load the snapshot's generation, tags and groups, validate the
+        # tags found there, fetch the others, then as without it, bumping
+        # the generation once
+        self.assertBudget(3 + 2 + 3 + 1, lambda f: Tag
+                          .get_or_create_tags_for_strings(
+                              f.strings + ["{0}:new{1}".format(f.prefix, i)
+                                           for i in range(f.size)]))
+
+    def test_tag_save(self):
+        def rename(f):
+            f.tag.name = f.tag.name + "-renamed"
+            f.tag.save()
+        # group, update, the items of each StringsItem field, then their
+        # tag strings are read and written
+        self.assertBudget(6, rename)
+
+    def test_models_for_tag(self):
+        self.assertBudget(0, lambda f: f.tag.models_for_tag())
+
+    def test_tagged_items(self):
+        self.assertBudget(MODELS, lambda f: [
+            list(items.all()) for items in f.tag.tagged_items().values()])
+
+    def test_unique_item_set(self):
+        self.assertBudget(MODELS, lambda f: f.tag.unique_item_set())
+
+    def test_iter_unique_items(self):
+        self.assertBudget(2, lambda f: list(f.tag.iter_unique_items(
+            models=[TestItem, IgnoreTestItem])))
+
+    def test_tag_weight(self):
+        self.assertBudget(1, lambda f: f.tag.tag_weight())
+
+    def test_related_tags(self):
+        self.assertBudget(1, lambda f: f.tag.related_tags())
+
+    def test_bulk_delete(self):
+        # the items of each StringsItem field, a DELETE per through-table,
+        # the collector's deletes, then the StringsItems' tag strings are
+        # read and written
+        self.assertBudget(2 + MODELS * 2 + 18 + 2, lambda f: Tag.bulk_delete(
+            [tag.pk for tag in f.tags]))
+
+    def test_merge(self):
+        # as bulk_delete, with an INSERT and a DELETE per through-table
+        self.assertBudget(2 + MODELS * 2 * 2 + 18 + 2, lambda f: Tag.merge(
+            [f.tag], f.other_tags[0]))
+
+    @override_settings(TAGMAN_VOCABULARY_SNAPSHOT=True)
+    def test_bulk_delete_with_snapshot(self):
+        # as without the snapshot, bumping its generation once
+        self.assertBudget(2 + MODELS * 2 + 18 + 2 + 1, lambda f: Tag
+                          .bulk_delete([tag.pk for tag in f.tags]))
+
+    @override_settings(TAGMAN_VOCABULARY_SNAPSHOT=True)
+    def test_merge_with_snapshot(self):
+        # as without the snapshot, bumping its generation once however
+        # many tags are merged
+        self.assertBudget(2 + MODELS * 2 * 2 + 18 + 2 + 1, lambda f: Tag.merge(
+            f.tags, f.other_tags[0]))
+
+    def test_items_tagged(self):
+        # resolve, then one query per model
+        self.assertBudget(3, lambda f: [
+            list(items) for items in Tag.items_tagged(
+                all_of=f.strings, models=[TestItem, IgnoreTestItem]).values()])
+
+    # TagManager
+
+    def test_get_tags_with_weight(self):
+        self.assertBudget(2, lambda f: Tag.public_objects
+                          .get_tags_with_weight())
+
+    def test_get_tags_with_weight_ranked(self):
+        self.assertBudget(2, lambda f: Tag.public_objects
+                          .get_tags_with_weight(limit=10))
+
+    # TagGroup
+
+    def test_tag_group_save(self):
+        def rename(f):
+            f.group.name = f.group.name + "-renamed"
+            f.group.save()
+        # exists, update group, pk bounds, one chunk of tags, the items of
+        # each StringsItem field, then their tag strings are read and
+        # written
+        self.assertBudget(8, rename)
+
+    def test_tags_for_group(self):
+        self.assertBudget(1, lambda f: list(f.group.tags_for_group()))
+
+    # TaggedItem
+
+    def test_add_tag_str(self):
+        # group, tag, existing row, insert
+        self.assertBudget(4, lambda f: f.item.add_tag_str(f.other_strings[0]))
+
+    def test_add_tag_strs(self):
+        self.assertBudget(3, lambda f: f.item.add_tag_strs(f.other_strings))
+
+    def test_remove_tag_strs(self):
+        self.assertBudget(3, lambda f: f.item.remove_tag_strs(f.strings))
+
+    def test_set_tag_strs(self):
+        self.assertBudget(5, lambda f: f.item.set_tag_strs(f.other_strings))
+
+    def test_queryset_add_tag_strs(self):
+        self.assertBudget(4, lambda f: TestItem.objects.filter(
+            name__startswith=f.prefix).add_tag_strs(f.other_strings))
+
+    def test_queryset_add_tag_strs_strings_item(self):
+        # as for TestItem, then the items' tag strings are read and written
+        self.assertBudget(4 + 2, lambda f: StringsItem.objects.filter(
+            name__startswith=f.prefix).add_tag_strs(f.other_strings))
+
+    @override_settings(TAGMAN_USAGE_COUNTERS=True)
+    def test_queryset_tag_strs_with_counters(self):
+        def tag(f):
+            items = TestItem.objects.filter(name__startswith=f.prefix)
+            items.add_tag_strs(f.other_strings)
+            items.remove_tag_strs(f.strings)
+        # four queries each as without counters, then, as every tag
+        # changes by the same number of rows, the counters of the added
+        # tags are selected and inserted, and those of the removed ones
+        # updated
+        self.assertBudget(4 + 2 + 4 + 1, tag)
+
+    def test_all_tag_groups(self):
+        self.assertBudget(1, lambda f: f.item.all_tag_groups())
+
+    def test_tagged(self):
+        self.assertBudget(2, lambda f: list(
+            TestItem.objects.tagged(all_of=f.strings)))
+
+    def test_tag_facets(self):
+        self.assertBudget(1, lambda f: TestItem.objects.filter(
+            name__startswith=f.prefix).tag_facets(top=3))
+
+    def test_with_tags(self):
+        def fetch(f):
+            for item in TestItem.objects.with_tags()\
+                    .filter(name__startswith=f.prefix):
+                item.all_tag_groups()
+                list(item.tags.all())
+        self.assertBudget(3, fetch)
+
+    # TaggedContentItem
+
+    def test_self_auto_tag(self):
+        self.assertBudget(1, lambda f: f.slug_item.self_auto_tag)
+
+    def test_associate_auto_tags(self):
+        # find the self-tag, fetch its group, save it
+        self.assertBudget(4, lambda f: f.slug_item.associate_auto_tags())
+
+    def test_bulk_associate_auto_tags(self):
+        self.assertBudget(3, lambda f: SlugItem.objects.filter(
+            slug=f.prefix).associate_auto_tags())
@@ -0,0 +1,74 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from tagman.cache import tag_cache
+from tagman.models import RelatedTag, StaleRelatedTag, Tag, TagUsage
+from tagman.related import cooccurrence, refresh_related_tags
+from tagman.tests.models import IgnoreTestItem, TestItem
+
+
+class TestRelatedTags(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.beef, self.spicy, self.mild, self.pork = \
+            Tag.get_or_create_tags_for_strings(
+                ["meat:beef", "flavour:spicy", "flavour:mild", "meat:pork"])
+        TestItem.objects.create(name="a").tags.add(self.beef, self.spicy)
+        TestItem.objects.create(name="b").tags.add(self.beef, self.spicy,
+                                                   self.mild)
+        IgnoreTestItem.objects.create(name="c").tags.add(self.beef,
+                                                         self.spicy)
+        TestItem.objects.create(name="d").auto_tags.add(self.beef, self.pork)
+
+    def test_cooccurrence(self):
+        counts = cooccurrence([self.beef.pk])
+        self.assertEquals(counts, {(self.beef.pk, self.spicy.pk): 3,
+                                   (self.beef.pk, self.mild.pk): 1})
+
+    def test_related_tags(self):
+        self.assertEquals(refresh_related_tags(k=1, full=True), 4)
+        related = self.beef.related_tags()
+        self.assertEquals(related, [self.spicy])
+        self.assertAlmostEquals(related[0].related_score, 1.0)
+        self.assertEquals(self.mild.related_tags(), [self.beef])
+        self.assertEquals(self.pork.related_tags(), [])
+        refresh_related_tags(full=True)
+        self.assertEquals(self.mild.related_tags(k=5),
+                          [self.beef, self.spicy])
+
+    @override_settings(TAGMAN_USAGE_COUNTERS=True)
+    def test_drifted_counters(self):
+        TagUsage.objects.rebuild()
+        TagUsage.objects.filter(tag=self.mild).delete()
+        TagUsage.objects.filter(tag=self.spicy).update(count=0)
+        self.assertEquals(refresh_related_tags(full=True), 4)
+        self.assertEquals(self.beef.related_tags(), [])
+
+    @override_settings(TAGMAN_RELATED_TAGS=True)
+    def test_incremental(self):
+        refresh_related_tags(full=True)
+        item = TestItem.objects.create(name="e")
+        item.tags.add(self.mild, self.pork)
+        self.assertEquals(
+            set(StaleRelatedTag.objects.values_list("tag", flat=True)),
+            set([self.mild.pk, self.pork.pk]))
+        self.assertEquals(refresh_related_tags(), 2)
+        self.assertEquals(StaleRelatedTag.objects.count(), 0)
+        self.assertEquals(self.pork.related_tags(), [self.mild])
+
+        TestItem.objects.get(name="b").tags.remove(self.mild)
+        self.assertEquals(
+            set(StaleRelatedTag.objects.values_list("tag", flat=True)),
+            set([self.beef.pk, self.spicy.pk, self.mild.pk]))
+
+    def test_command(self):
+        out = StringIO()
+        call_command("build_related_tags", full=True, top=2, stdout=out)
+        self.assertEquals(out.getvalue(),
+                          "Refreshed related tags of 4 tags\n")
+        self.assertEquals(RelatedTag.objects.filter(tag=self.beef).count(),
+                          2)
@@ -0,0 +1,127 @@
+from django.db import transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+
+from tagman.cache import tag_cache
+from tagman.models import Tag, TagGroup, VocabularyGeneration
+from tagman.vocabulary import VocabularySnapshot, vocabulary_snapshot
+
+
+@override_settings(TAGMAN_VOCABULARY_SNAPSHOT=True)
+class TestVocabularySnapshot(TestCase):
+
+    def setUp(self):
+        tag_cache().clear()
+        self.beef, self.pork, self.hidden = \
+            Tag.get_or_create_tags_for_strings(
+                ["meat:beef", "meat:pork", "*System:hidden"])
+        self.snapshot = VocabularySnapshot(check_interval=0)
+
+    def test_indexes(self):
+        vocabulary = self.snapshot.vocabulary()
+        self.assertEquals(len(vocabulary), 3)
+        self.assertEquals(vocabulary.tag_for_names("meat", "beef").id,
+                          self.beef.pk)
+        self.assertEquals(vocabulary.tag_for_names("*System", "hidden").id,
+                          self.hidden.pk)
+        self.assertEquals(vocabulary.tag_for_names("System", "hidden").id,
+                          self.hidden.pk)
+        self.assertEquals(vocabulary.tag_for_names("meat", "lamb"), None)
+        self.assertEquals(vocabulary.tag_for_slugs("meat", "pork").id,
+                          self.pork.pk)
+        self.assertEquals([tag.name for tag in
+                           vocabulary.group_tags(self.beef.group_id)],
+                          ["beef", "pork"])
+        self.assertEquals(vocabulary.groups[self.hidden.group_id].system,
+                          True)
+        self.assertRaises(AttributeError, setattr, vocabulary, "extra", 1)
+
+    def test_entries_are_cache_values(self):
+        entry = self.snapshot.vocabulary().tags[self.beef.pk]
+        self.assertEquals(tuple(entry), self.beef.cache_values())
+        self.assertEquals(Tag.from_cache_values(entry), self.beef)
+
+    def test_local_changes(self):
+        self.snapshot.vocabulary()
+        self.beef.name = "steak"
+        self.beef.save()
+        group = TagGroup.objects.get(name="meat")
+        group.name = "food"
+        group.save()
+        # the changed tag and group are reloaded and the generation row
+        # checked, but as only this process wrote there is no full reload
+        with self.assertNumQueries(4):
+            vocabulary = self.snapshot.vocabulary()
+        self.assertEquals(vocabulary.tag_for_names("food", "steak").id,
+                          self.beef.pk)
+        self.assertEquals(vocabulary.tag_for_names("meat", "beef"), None)
+        self.assertEquals(vocabulary.groups[group.pk].name, "food")
+
+    def test_created_tags(self):
+        self.snapshot.vocabulary()
+        lamb, cod = Tag.get_or_create_tags_for_strings(
+            ["meat:lamb", "fish:cod"])
+        self.assertFalse(self.snapshot._stale)
+        # the new tags and group are loaded and the generation row
+        # checked, without a full reload
+        with self.assertNumQueries(4):
+            vocabulary = self.snapshot.vocabulary()
+        self.assertEquals(vocabulary.tag_for_names("meat", "lamb").id,
+                          lamb.pk)
+        self.assertEquals(vocabulary.groups[cod.group_id].name, "fish")
+
+    def test_other_process_changes(self):
+        self.snapshot.vocabulary()
+        Tag.objects.filter(pk=self.beef.pk).update(name="steak")
+        VocabularyGeneration.objects.filter(pk=1)\
+            .update(generation=F("generation") + 1)
+        vocabulary = self.snapshot.vocabulary()
+        self.assertEquals(vocabulary.tag_for_names("meat", "steak").id,
+                          self.beef.pk)
+
+    def test_check_interval(self):
+        snapshot = VocabularySnapshot(check_interval=60)
+        snapshot.vocabulary()
+        with self.assertNumQueries(0):
+            snapshot.vocabulary()
+
+    def test_bump(self):
+        generation = VocabularyGeneration.objects.current()
+        Tag.get_or_create_tag_for_string("meat:lamb")
+        self.assertTrue(VocabularyGeneration.objects.current() > generation)
+
+    def test_tag_resolution(self):
+        tag_cache().clear()
+        vocabulary_snapshot().reload()
+        with self.assertNumQueries(0):
+            self.assertEquals(Tag.tag_for_string("meat:beef"), self.beef)
+            self.assertEquals(
+                Tag.tags_for_string("meat:pork, *System:hidden"),
+                [self.pork, self.hidden])
+        self.assertRaises(Tag.DoesNotExist, Tag.tag_for_string, "meat:lamb")
+
+
+@override_settings(TAGMAN_VOCABULARY_SNAPSHOT=True)
+class TestVocabularyRollback(TransactionTestCase):
+
+    def test_rolled_back_tags(self):
+        tag_cache().clear()
+        Tag.get_or_create_tag_for_string("meat:beef")
+        snapshot = VocabularySnapshot(check_interval=0)
+        snapshot.vocabulary()
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            Tag.get_or_create_tag_for_string("meat:veal")
+            self.assertNotEquals(
+                snapshot.vocabulary().tag_for_names("meat", "veal"), None)
+        finally:
+            transaction.rollback()
+            transaction.leave_transaction_management()
+        # the rolled back bump leaves the generation row behind the
+        # snapshot's, so the next check reloads
+        self.assertEquals(snapshot.vocabulary().tag_for_names("meat", "veal"),
+                          None)
+        self.assertNotEquals(
+            snapshot.vocabulary().tag_for_names("meat", "beef"), None)
@@ -0,0 +1,8 @@
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns(
+    "tagman.views",
+    url(r"^tags/autocomplete/$", "tag_autocomplete",
+        name="tagman_tag_autocomplete"),
+    url(r"^tags/search/$", "tag_search", name="tagman_tag_search"),
+)
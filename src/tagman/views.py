@@ -0,0 +1,63 @@
+"""Views for Tagman; see tagman.urls"""
+import json
+
+from django.db.models import Q
+from django.http import HttpResponse
+
+from tagman.models import Tag, TAG_SEPARATOR, _composite_name
+from tagman.prefix_index import tag_index
+
+AUTOCOMPLETE_PAGE_SIZE = 20
+MAX_SEARCH_RESULTS = 50
+
+
+def tag_autocomplete(request):
+    """
+    Return a page of the public tags matching the `q` parameter as JSON,
+    `{"results": [{"id": ..., "text": "GRP:NAME"}, ...], "more": bool}`.
+
+    `q` matches the start of the tag or group name or, as "GRP:NA", of
+    both. `page` (from 1) selects the page of AUTOCOMPLETE_PAGE_SIZE tags.
+    """
+    term = request.GET.get("q", "").strip()
+    try:
+        page = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+
+    tags = Tag.objects.filter(group_is_system=False, archived=False)
+    if TAG_SEPARATOR in term:
+        group_name, name = term.split(TAG_SEPARATOR, 1)
+        tags = tags.filter(group_name__iexact=group_name,
+                           name__istartswith=name)
+    elif term:
+        tags = tags.filter(Q(name__istartswith=term) |
+                           Q(group_name__istartswith=term))
+
+    start = (page - 1) * AUTOCOMPLETE_PAGE_SIZE
+    rows = list(tags.order_by("group_name", "name")
+                .values_list("id", "group_name", "name")
+                [start:start + AUTOCOMPLETE_PAGE_SIZE + 1])
+    data = {
+        "results": [{"id": pk, "text": _composite_name(row_group, row_name)}
+                    for pk, row_group, row_name
+                    in rows[:AUTOCOMPLETE_PAGE_SIZE]],
+        "more": len(rows) > AUTOCOMPLETE_PAGE_SIZE,
+    }
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
+
+def tag_search(request):
+    """
+    Return the heaviest public tags whose name, group name or "GRP:NAME"
+    starts with the `q` parameter as JSON, `{"results": [{"id": ...,
+    "text": "GRP:NAME", "weight": ...}, ...]}`, from the in-process
+    prefix index. `k` is the number of results, default 10.
+    """
+    try:
+        k = min(max(int(request.GET.get("k", 10)), 1), MAX_SEARCH_RESULTS)
+    except ValueError:
+        k = 10
+    matches = tag_index().search(request.GET.get("q", ""), k)
+    data = {"results": [match._asdict() for match in matches]}
+    return HttpResponse(json.dumps(data), content_type="application/json")
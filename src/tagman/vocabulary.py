@@ -0,0 +1,228 @@
+"""
+A process-wide snapshot of the tag vocabulary, for resolving tag strings
+without queries.
+
+With TAGMAN_VOCABULARY_SNAPSHOT set, every tag and group is loaded once
+per process into an immutable Vocabulary of namedtuples, indexed by id,
+by (group slug, slug), by (group name, name) and by group, and
+Tag.tag_for_string and Tag.resolve_tag_strings read it before the tag
+string cache.
+
+Writes to tags and groups bump the single VocabularyGeneration row. At
+most every TAGMAN_VOCABULARY_CHECK_INTERVAL seconds (default 5) the
+snapshot reads the row, with one small query, and reloads when anyone
+else has bumped it. Changes made in this process are seen at once: the
+tags and groups they name are reloaded into a new snapshot before the
+next read.
+
+A snapshot read inside a transaction holds the transaction's uncommitted
+tags and groups. Should it roll back, its bumps roll back with it and the
+generation row falls behind this process's count of bumps, so the next
+check reloads; until then, for at most the check interval, the rolled
+back tags still resolve. Call tag_cache().clear() after a rollback to
+drop them at once.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import get_model
+from tagman.signals import vocabulary_changed
+
+# fields in the order of Tag.cache_values, so an entry can be passed to
+# Tag.from_cache_values
+VocabularyTag = namedtuple("VocabularyTag", [
+    "id", "name", "slug", "group_id", "group_name", "group_slug",
+    "group_is_system", "archived", "db"])
+
+VocabularyGroup = namedtuple("VocabularyGroup", [
+    "id", "name", "slug", "system"])
+
+TAG_FIELDS = VocabularyTag._fields[:-1]
+GROUP_FIELDS = VocabularyGroup._fields
+
+
+def _names_key(group_name, name):
+    # as the tag string cache's keys, see tagman.models._cache_key
+    return group_name.lstrip("*"), name
+
+
+class Vocabulary(object):
+    """
+    An immutable snapshot of the tags and groups of one database
+    """
+    __slots__ = ("generation", "tags", "groups", "by_slug", "by_names",
+                 "by_group")
+
+    def __init__(self, generation, tags, groups):
+        """
+        `tags` and `groups` are dicts of VocabularyTag and VocabularyGroup
+        keyed on id
+        """
+        self.generation = generation
+        self.tags = tags
+        self.groups = groups
+        self.by_slug = {}
+        self.by_names = {}
+        by_group = {}
+        for tag in tags.values():
+            self.by_slug[(tag.group_slug, tag.slug)] = tag
+            self.by_names[_names_key(tag.group_name, tag.name)] = tag
+            by_group.setdefault(tag.group_id, []).append(tag.id)
+        self.by_group = dict((group_id, tuple(sorted(tag_ids)))
+                             for group_id, tag_ids in by_group.items())
+
+    def __len__(self):
+        return len(self.tags)
+
+    def tag_for_names(self, group_name, name):
+        """
+        Return the VocabularyTag of group `group_name`, with or without
+        the system `*`, named `name`, or None
+        """
+        return self.by_names.get(_names_key(group_name, name))
+
+    def tag_for_slugs(self, group_slug, slug):
+        return self.by_slug.get((group_slug, slug))
+
+    def group_tags(self, group_id):
+        """
+        Return the VocabularyTags of a group, in id order
+        """
+        return [self.tags[tag_id] for tag_id in self.by_group.get(group_id,
+                                                                  ())]
+
+    def replace(self, tags, groups, tag_ids, group_ids):
+        """
+        Return a new Vocabulary in which the tags `tag_ids` and the tags of
+        groups `group_ids`, and those groups, are replaced by `tags` and
+        `groups`; ids missing from them have been deleted
+        """
+        new_tags = dict(self.tags)
+        for group_id in group_ids:
+            for tag_id in self.by_group.get(group_id, ()):
+                new_tags.pop(tag_id, None)
+        for tag_id in tag_ids:
+            new_tags.pop(tag_id, None)
+        new_tags.update(tags)
+        new_groups = dict(self.groups)
+        for group_id in group_ids:
+            new_groups.pop(group_id, None)
+        new_groups.update(groups)
+        return Vocabulary(self.generation, new_tags, new_groups)
+
+
+class VocabularySnapshot(object):
+    """
+    Holds the current Vocabulary of one database, reloading it when the
+    vocabulary changes. Local changes beyond `max_pending` tags or groups
+    are applied by a full reload instead.
+    """
+    def __init__(self, using="default", check_interval=5, max_pending=500):
+        self.using = using
+        self.check_interval = check_interval
+        self.max_pending = max_pending
+        self._vocabulary = None
+        self._checked = None
+        self._bumps = 0
+        self._stale = False
+        self._pending_tags = set()
+        self._pending_groups = set()
+        self._lock = threading.RLock()
+        vocabulary_changed.connect(self._vocabulary_changed)
+
+    def _vocabulary_changed(self, sender, tag_id=None, group_id=None,
+                            tag_ids=(), group_ids=(), **kwargs):
+        with self._lock:
+            if self._vocabulary is None:
+                return
+            if tag_id is None and group_id is None and not tag_ids and \
+                    not group_ids:
+                self._stale = True
+            if tag_id is not None:
+                self._pending_tags.add(tag_id)
+            self._pending_tags.update(tag_ids)
+            if group_id is not None:
+                self._pending_groups.add(group_id)
+            self._pending_groups.update(group_ids)
+            if len(self._pending_tags) + len(self._pending_groups) > \
+                    self.max_pending:
+                self._stale = True
+
+    def _generations(self):
+        return get_model("tagman", "VocabularyGeneration").objects
+
+    def _tag_rows(self, **filters):
+        return dict((row[0], VocabularyTag(*(row + (self.using,))))
+                    for row in get_model("tagman", "Tag").objects
+                    .using(self.using).filter(**filters)
+                    .values_list(*TAG_FIELDS))
+
+    def _group_rows(self, **filters):
+        return dict((row[0], VocabularyGroup(*row))
+                    for row in get_model("tagman", "TagGroup").objects
+                    .using(self.using).filter(**filters)
+                    .values_list(*GROUP_FIELDS))
+
+    def reload(self):
+        """
+        Load every tag and group
+        """
+        with self._lock:
+            self._bumps = self._generations().bumps(self.using)
+            generation = self._generations().current(self.using)
+            self._vocabulary = Vocabulary(generation, self._tag_rows(),
+                                          self._group_rows())
+            self._checked = time.time()
+            self._stale = False
+            self._pending_tags.clear()
+            self._pending_groups.clear()
+
+    def _apply_pending(self):
+        tag_ids, group_ids = self._pending_tags, self._pending_groups
+        tags = self._tag_rows(pk__in=tag_ids) if tag_ids else {}
+        if group_ids:
+            tags.update(self._tag_rows(group__in=group_ids))
+        groups = self._group_rows(pk__in=group_ids) if group_ids else {}
+        self._vocabulary = self._vocabulary.replace(tags, groups, tag_ids,
+                                                    group_ids)
+        self._pending_tags, self._pending_groups = set(), set()
+
+    def _refresh(self):
+        if self._vocabulary is None or self._stale:
+            self.reload()
+            return
+        if self._pending_tags or self._pending_groups:
+            self._apply_pending()
+        if time.time() - self._checked < self.check_interval:
+            return
+        # the row has moved on by our own bumps unless another process
+        # has written too
+        bumps = self._generations().bumps(self.using)
+        generation = self._generations().current(self.using)
+        if generation != self._vocabulary.generation + bumps - self._bumps:
+            self.reload()
+        self._checked = time.time()
+
+    def vocabulary(self):
+        """
+        Return the current Vocabulary
+        """
+        with self._lock:
+            self._refresh()
+            return self._vocabulary
+
+
+_snapshot = None
+
+
+def vocabulary_snapshot():
+    """
+    Return the process-wide VocabularySnapshot of the default database
+    """
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = VocabularySnapshot(check_interval=getattr(
+            settings, "TAGMAN_VOCABULARY_CHECK_INTERVAL", 5))
+    return _snapshot